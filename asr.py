@@ -0,0 +1,349 @@
+"""
+Motores de reconocimiento de voz (ASR) intercambiables.
+
+Todos los motores devuelven {"text", "language", "confianza"}, donde la
+confianza es la probabilidad media por token (exp(avg_logprob)) de los
+segmentos transcritos.
+
+`transcribir_lote` procesa varios audios con una sola pasada del modelo:
+los audios de hasta 30 s (una ventana de Whisper, rellena con silencio) se
+apilan en un lote y los resultados se reparten de nuevo por audio. Los más
+largos pasan por `transcribir`, cuya ventana deslizante no corta palabras
+entre ventanas y reintenta con otra temperatura si hace falta.
+"""
+import math
+import logging
+import subprocess
+
+import numpy as np
+
+log = logging.getLogger("bot.asr")
+
+MUESTREO = 16000
+# Whisper trabaja con ventanas fijas de 30 s (3000 tramas de espectrograma)
+VENTANA_LOTE = 30 * MUESTREO
+TRAMAS_VENTANA = 3000
+# Criterio de transcribe() para descartar una ventana sin voz (p. ej. el
+# silencio con el que se rellena un audio corto)
+UMBRAL_SIN_VOZ = 0.6
+UMBRAL_LOGPROB = -1.0
+
+
+def cargar_audio(ruta, muestreo=MUESTREO):
+    """
+    Decodifica cualquier archivo de audio a float32 mono con ffmpeg
+    """
+    salida = subprocess.run(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+         "-i", ruta, "-f", "s16le", "-ac", "1", "-ar", str(muestreo), "pipe:1"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    return np.frombuffer(salida, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def ventanas_lote(audio):
+    """
+    Corta un audio (ruta o array) en ventanas de 30 s rellenas con silencio
+    """
+    if isinstance(audio, str):
+        audio = cargar_audio(audio)
+    audio = np.asarray(audio, dtype=np.float32)
+    return [
+        np.pad(audio[i:i + VENTANA_LOTE], (0, max(0, VENTANA_LOTE - len(audio[i:i + VENTANA_LOTE]))))
+        for i in range(0, max(len(audio), 1), VENTANA_LOTE)
+    ]
+
+
+def sin_voz(no_speech_prob, avg_logprob):
+    """
+    Indica si una ventana decodificada debe descartarse por no tener voz
+    """
+    return no_speech_prob > UMBRAL_SIN_VOZ and avg_logprob < UMBRAL_LOGPROB
+
+
+def confianza_segmentos(logprobs):
+    """
+    Probabilidad media por token a partir del avg_logprob de cada segmento
+    """
+    if not logprobs:
+        return 0.0
+    return sum(math.exp(lp) for lp in logprobs) / len(logprobs)
+
+
+class MotorASR:
+    """
+    Interfaz común de los motores. Cada motor carga sus modelos una sola vez
+    por proceso y los reutiliza.
+    """
+
+    nombre = "base"
+
+    def __init__(self, hilos=0):
+        self.hilos = hilos
+        self.modelos = {}
+
+    def cargar(self, nombre_modelo):
+        if nombre_modelo not in self.modelos:
+            log.info(f"📦 Cargando modelo ASR {self.nombre}:{nombre_modelo}...")
+            self.modelos[nombre_modelo] = self._cargar(nombre_modelo)
+        return self.modelos[nombre_modelo]
+
+    def _cargar(self, nombre_modelo):
+        raise NotImplementedError
+
+    def transcribir(self, audio, nombre_modelo, opciones=None):
+        raise NotImplementedError
+
+    def transcribir_lote(self, audios, nombre_modelo, opciones=None):
+        """
+        Transcribe varios audios; `opciones` es una lista paralela a `audios`.
+        Solo los de una ventana (30 s o menos) van juntos al lote; los más
+        largos se transcriben uno a uno con transcribir().
+        """
+        opciones = opciones or [None] * len(audios)
+        audios = [cargar_audio(a) if isinstance(a, str) else np.asarray(a, dtype=np.float32) for a in audios]
+        resultados = [None] * len(audios)
+        cortos = [i for i, audio in enumerate(audios) if len(audio) <= VENTANA_LOTE]
+        if cortos:
+            lote = self._transcribir_ventanas([audios[i] for i in cortos], nombre_modelo, [opciones[i] for i in cortos])
+            for i, resultado in zip(cortos, lote):
+                resultados[i] = resultado
+        for i, resultado in enumerate(resultados):
+            if resultado is None:
+                resultados[i] = self.transcribir(audios[i], nombre_modelo, opciones[i])
+        return resultados
+
+    def _transcribir_ventanas(self, audios, nombre_modelo, opciones):
+        """
+        Transcribe audios de una sola ventana. Los motores sin soporte de
+        lotes los transcriben uno a uno.
+        """
+        return [self.transcribir(audio, nombre_modelo, o) for audio, o in zip(audios, opciones)]
+
+
+class MotorWhisper(MotorASR):
+    """
+    openai-whisper (PyTorch)
+    """
+
+    nombre = "whisper"
+
+    def __init__(self, hilos=0):
+        super().__init__(hilos)
+        import whisper
+        self.whisper = whisper
+        if hilos:
+            import torch
+            torch.set_num_threads(hilos)
+
+    def _cargar(self, nombre_modelo):
+        return self.whisper.load_model(nombre_modelo)
+
+    def transcribir(self, audio, nombre_modelo, opciones=None):
+        resultado = self.cargar(nombre_modelo).transcribe(audio, **(opciones or {}))
+        return {
+            "text": resultado["text"],
+            "language": resultado["language"],
+            "confianza": confianza_segmentos([s["avg_logprob"] for s in resultado.get("segments", [])]),
+        }
+
+    def _transcribir_ventanas(self, audios, nombre_modelo, opciones):
+        """
+        Decodifica juntas las ventanas de los audios con whisper.decode. Las
+        opciones (idioma) son comunes a todo el lote, por lo que se agrupan
+        los audios por opciones.
+        """
+        import torch
+
+        modelo = self.cargar(nombre_modelo)
+        grupos = {}
+        for i, opciones_audio in enumerate(opciones):
+            grupos.setdefault(tuple(sorted((opciones_audio or {}).items())), []).append(i)
+
+        resultados = [None] * len(audios)
+        for clave, indices in grupos.items():
+            mels, duenos = [], []
+            for i in indices:
+                for ventana in ventanas_lote(audios[i]):
+                    mels.append(self.whisper.log_mel_spectrogram(ventana, modelo.dims.n_mels)[:, :TRAMAS_VENTANA])
+                    duenos.append(i)
+            decodificados = self.whisper.decode(
+                modelo,
+                torch.stack(mels).to(modelo.device),
+                self.whisper.DecodingOptions(fp16=modelo.device.type == "cuda", without_timestamps=True, **dict(clave)),
+            )
+            por_audio = {}
+            for i, decodificado in zip(duenos, decodificados):
+                por_audio.setdefault(i, []).append(decodificado)
+            for i, partes in por_audio.items():
+                con_voz = [p for p in partes if not sin_voz(p.no_speech_prob, p.avg_logprob)]
+                resultados[i] = {
+                    "text": " ".join(p.text.strip() for p in con_voz),
+                    "language": partes[0].language,
+                    "confianza": confianza_segmentos([p.avg_logprob for p in con_voz]),
+                }
+        return resultados
+
+
+class MotorFasterWhisper(MotorASR):
+    """
+    faster-whisper (CTranslate2) con cuantización int8 por defecto, mucho más
+    rápido en CPU
+    """
+
+    nombre = "faster-whisper"
+
+    def __init__(self, hilos=0, compute_type="int8", dispositivo="cpu"):
+        super().__init__(hilos)
+        from faster_whisper import WhisperModel
+        self.WhisperModel = WhisperModel
+        self.compute_type = compute_type
+        self.dispositivo = dispositivo
+
+    def _cargar(self, nombre_modelo):
+        return self.WhisperModel(
+            nombre_modelo,
+            device=self.dispositivo,
+            compute_type=self.compute_type,
+            cpu_threads=self.hilos,
+        )
+
+    def transcribir(self, audio, nombre_modelo, opciones=None):
+        segmentos, info = self.cargar(nombre_modelo).transcribe(audio, **(opciones or {}))
+        segmentos = list(segmentos)
+        return {
+            "text": "".join(s.text for s in segmentos),
+            "language": info.language,
+            "confianza": confianza_segmentos([s.avg_logprob for s in segmentos]),
+        }
+
+    def _transcribir_ventanas(self, audios, nombre_modelo, opciones):
+        """
+        Una pasada de CTranslate2 para todos los audios: detección de idioma y
+        generate() por lotes sobre las ventanas apiladas. Cada audio usa el
+        idioma indicado en sus opciones o el detectado en su primera ventana.
+        Las ventanas sin voz se descartan con el mismo criterio que en Whisper.
+        """
+        import ctranslate2
+        from faster_whisper.tokenizer import Tokenizer
+
+        modelo = self.cargar(nombre_modelo)
+        mels, duenos = [], []
+        for i, audio in enumerate(audios):
+            for ventana in ventanas_lote(audio):
+                mels.append(modelo.feature_extractor(ventana)[:, :TRAMAS_VENTANA])
+                duenos.append(i)
+        caracteristicas = ctranslate2.StorageView.from_array(np.ascontiguousarray(np.stack(mels)))
+
+        idiomas = [(o or {}).get("language") for o in opciones]
+        if None in idiomas:
+            detectados = modelo.model.detect_language(caracteristicas)
+            for j, i in enumerate(duenos):
+                if idiomas[i] is None:
+                    idiomas[i] = detectados[j][0][0][2:-2]  # "<|es|>" -> "es"
+
+        tokenizadores = {}
+        for idioma in set(idiomas):
+            tokenizadores[idioma] = Tokenizer(modelo.hf_tokenizer, modelo.model.is_multilingual,
+                                              task="transcribe", language=idioma)
+        prompts = [
+            list(tokenizadores[idiomas[i]].sot_sequence) + [tokenizadores[idiomas[i]].no_timestamps]
+            for i in duenos
+        ]
+        generados = modelo.model.generate(
+            caracteristicas, prompts, beam_size=5, max_length=448, return_scores=True, return_no_speech_prob=True
+        )
+
+        textos = [[] for _ in audios]
+        puntuaciones = [[] for _ in audios]
+        for i, generado in zip(duenos, generados):
+            # Como faster-whisper: la puntuación viene normalizada por longitud
+            tokens = generado.sequences_ids[0]
+            avg_logprob = generado.scores[0] * len(tokens) / (len(tokens) + 1)
+            if sin_voz(generado.no_speech_prob, avg_logprob):
+                continue
+            textos[i].append(tokenizadores[idiomas[i]].decode(tokens).strip())
+            puntuaciones[i].append(avg_logprob)
+        return [
+            {"text": " ".join(filter(None, textos[i])), "language": idiomas[i],
+             "confianza": confianza_segmentos(puntuaciones[i])}
+            for i in range(len(audios))
+        ]
+
+
+MOTORES_ASR = {
+    MotorWhisper.nombre: MotorWhisper,
+    MotorFasterWhisper.nombre: MotorFasterWhisper,
+}
+
+
+def crear_motor(nombre, hilos=0, compute_type="int8"):
+    """
+    Crea el motor ASR configurado
+    """
+    if nombre not in MOTORES_ASR:
+        raise ValueError(f"Motor ASR desconocido: {nombre} (disponibles: {', '.join(MOTORES_ASR)})")
+    if nombre == MotorFasterWhisper.nombre:
+        return MotorFasterWhisper(hilos, compute_type)
+    return MOTORES_ASR[nombre](hilos)
+
+
+class PoliticaModelos:
+    """
+    Elige el tamaño de modelo por audio: el pequeño para notas de voz cortas y
+    el grande para audios largos o cuando el pequeño no está seguro
+    """
+
+    def __init__(self, motor, modelo_grande, modelo_pequeno=None, duracion_max_pequeno=30, confianza_min=0.6):
+        self.motor = motor
+        self.modelo_grande = modelo_grande
+        self.modelo_pequeno = modelo_pequeno
+        self.duracion_max_pequeno = duracion_max_pequeno
+        self.confianza_min = confianza_min
+        self.usos = {}
+        self.reintentos = 0
+
+    def precargar(self):
+        for nombre_modelo in filter(None, (self.modelo_pequeno, self.modelo_grande)):
+            self.motor.cargar(nombre_modelo)
+
+    def _transcribir(self, audio, nombre_modelo, opciones):
+        self.usos[nombre_modelo] = self.usos.get(nombre_modelo, 0) + 1
+        return self.motor.transcribir(audio, nombre_modelo, opciones)
+
+    def transcribir(self, audio, opciones=None, duracion=None):
+        if self.modelo_pequeno and duracion is not None and duracion < self.duracion_max_pequeno:
+            resultado = self._transcribir(audio, self.modelo_pequeno, opciones)
+            if resultado["confianza"] >= self.confianza_min:
+                return resultado
+            log.debug("🔁 Confianza baja (%.2f), repitiendo con %s", resultado['confianza'], self.modelo_grande)
+            self.reintentos += 1
+        return self._transcribir(audio, self.modelo_grande, opciones)
+
+    def _transcribir_lote(self, indices, audios, nombre_modelo, opciones):
+        self.usos[nombre_modelo] = self.usos.get(nombre_modelo, 0) + len(indices)
+        return self.motor.transcribir_lote([audios[i] for i in indices], nombre_modelo, [opciones[i] for i in indices])
+
+    def transcribir_lote(self, audios, opciones=None, duraciones=None):
+        """
+        Como transcribir() para varios audios a la vez: los cortos van en un
+        lote al modelo pequeño y el resto, junto con los de confianza baja,
+        en otro lote al grande
+        """
+        opciones = opciones or [None] * len(audios)
+        duraciones = duraciones or [None] * len(audios)
+        resultados = [None] * len(audios)
+        if self.modelo_pequeno:
+            cortos = [i for i, d in enumerate(duraciones) if d is not None and d < self.duracion_max_pequeno]
+            if cortos:
+                for i, resultado in zip(cortos, self._transcribir_lote(cortos, audios, self.modelo_pequeno, opciones)):
+                    if resultado["confianza"] >= self.confianza_min:
+                        resultados[i] = resultado
+                    else:
+                        self.reintentos += 1
+        pendientes = [i for i, r in enumerate(resultados) if r is None]
+        if pendientes:
+            for i, resultado in zip(pendientes, self._transcribir_lote(pendientes, audios, self.modelo_grande, opciones)):
+                resultados[i] = resultado
+        return resultados
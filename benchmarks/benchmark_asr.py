@@ -0,0 +1,134 @@
+"""
+Compara motores y modelos ASR sobre un corpus local: precisión (WER) y factor
+de tiempo real (RTF = tiempo de transcripción / duración del audio).
+
+El corpus es una carpeta con audios y, junto a cada uno, un .txt con la
+transcripción de referencia (mismo nombre):
+
+    corpus/
+        saludo.ogg
+        saludo.txt
+
+Uso:
+    python benchmarks/benchmark_asr.py corpus/ \\
+        --motor whisper:large-v3 --motor faster-whisper:small --hilos 4 \\
+        --salida resultados_asr.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asr import MUESTREO, cargar_audio, crear_motor
+
+EXTENSIONES_AUDIO = (".ogg", ".oga", ".opus", ".wav", ".mp3", ".m4a", ".flac")
+
+
+def normalizar(texto):
+    return re.sub(r"[^\w\s]", " ", texto.lower()).split()
+
+
+def wer(referencia, hipotesis):
+    """
+    Word error rate: distancia de edición entre palabras / palabras de la referencia
+    """
+    ref, hip = normalizar(referencia), normalizar(hipotesis)
+    if not ref:
+        return 0.0 if not hip else 1.0
+    anterior = list(range(len(hip) + 1))
+    for i, palabra_ref in enumerate(ref, 1):
+        actual = [i] + [0] * len(hip)
+        for j, palabra_hip in enumerate(hip, 1):
+            actual[j] = min(
+                anterior[j] + 1,
+                actual[j - 1] + 1,
+                anterior[j - 1] + (palabra_ref != palabra_hip),
+            )
+        anterior = actual
+    return anterior[-1] / len(ref)
+
+
+def leer_corpus(carpeta):
+    corpus = []
+    for nombre in sorted(os.listdir(carpeta)):
+        base, extension = os.path.splitext(nombre)
+        referencia = os.path.join(carpeta, base + ".txt")
+        if extension.lower() in EXTENSIONES_AUDIO and os.path.exists(referencia):
+            with open(referencia, encoding="utf-8") as f:
+                corpus.append((os.path.join(carpeta, nombre), f.read().strip()))
+    return corpus
+
+
+def evaluar(nombre_motor, nombre_modelo, corpus, hilos, compute_type, idioma):
+    motor = crear_motor(nombre_motor, hilos, compute_type)
+    motor.cargar(nombre_modelo)
+    opciones = {"language": idioma} if idioma else None
+
+    archivos = []
+    for ruta, referencia in corpus:
+        audio = cargar_audio(ruta)
+        duracion = len(audio) / MUESTREO
+        inicio = time.perf_counter()
+        resultado = motor.transcribir(audio, nombre_modelo, opciones)
+        tiempo = time.perf_counter() - inicio
+        archivos.append({
+            "archivo": os.path.basename(ruta),
+            "duracion_s": round(duracion, 2),
+            "tiempo_s": round(tiempo, 3),
+            "rtf": round(tiempo / duracion, 4) if duracion else None,
+            "wer": round(wer(referencia, resultado["text"]), 4),
+            "confianza": round(resultado["confianza"], 4),
+        })
+        print(f"  {os.path.basename(ruta)}: RTF {archivos[-1]['rtf']} | WER {archivos[-1]['wer']}", file=sys.stderr)
+
+    duracion_total = sum(a["duracion_s"] for a in archivos)
+    tiempo_total = sum(a["tiempo_s"] for a in archivos)
+    return {
+        "motor": nombre_motor,
+        "modelo": nombre_modelo,
+        "hilos": hilos,
+        "compute_type": compute_type if nombre_motor == "faster-whisper" else None,
+        "archivos": len(archivos),
+        "duracion_total_s": round(duracion_total, 2),
+        "tiempo_total_s": round(tiempo_total, 3),
+        "rtf": round(tiempo_total / duracion_total, 4) if duracion_total else None,
+        "wer_medio": round(sum(a["wer"] for a in archivos) / len(archivos), 4) if archivos else None,
+        "detalle": archivos,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Carpeta con audios y sus transcripciones .txt")
+    parser.add_argument("--motor", action="append", required=True,
+                        help="motor:modelo, p. ej. whisper:large-v3 o faster-whisper:small (repetible)")
+    parser.add_argument("--hilos", type=int, default=0, help="Hilos de CPU por motor (0 = automático)")
+    parser.add_argument("--compute-type", default="int8", help="Cuantización de faster-whisper")
+    parser.add_argument("--idioma", default=None, help="Fijar idioma en lugar de detectarlo")
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args()
+
+    corpus = leer_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"No hay pares audio/.txt en {args.corpus}")
+
+    resultados = []
+    for especificacion in args.motor:
+        nombre_motor, _, nombre_modelo = especificacion.partition(":")
+        print(f"▶️ {nombre_motor}:{nombre_modelo}", file=sys.stderr)
+        resultados.append(evaluar(nombre_motor, nombre_modelo, corpus, args.hilos, args.compute_type, args.idioma))
+
+    informe = json.dumps({"benchmark": "asr", "resultados": resultados}, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(informe)
+    else:
+        print(informe)
+
+
+if __name__ == "__main__":
+    main()
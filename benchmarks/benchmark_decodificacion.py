@@ -0,0 +1,168 @@
+"""
+Coste por mensaje de llevar una nota de voz descargada a PCM float32 de 16 kHz.
+
+Compara el camino anterior ("temporal": escribir el OGG en un archivo
+temporal, que ffmpeg lo relea como hace whisper.load_audio y borrarlo) con
+la decodificación en memoria del bot: "ffmpeg" (un proceso por audio con
+stdin/stdout), "pool" (ffmpeg precalentados, DECODIFICADOR_POOL) y "pyav"
+(libavcodec dentro del proceso, si PyAV está instalado). Los mensajes llegan
+de uno en uno separados por --pausa-ms, como en un chat normal, y se mide la
+latencia de cada uno. Todos los modos deben dar las mismas muestras.
+
+Los audios salen de una carpeta; sin carpeta se genera con ffmpeg una nota
+de voz OGG/Opus sintética de --segundos.
+
+Uso:
+    python benchmarks/benchmark_decodificacion.py notas/ --mensajes 200 --pausa-ms 50
+    python benchmarks/benchmark_decodificacion.py --segundos 10 --modo temporal --modo pool
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asr import MUESTREO, cargar_audio
+from decodificador import MODOS, Decodificador
+from comun import resumen_latencias
+from benchmark_asr import EXTENSIONES_AUDIO
+
+
+def generar_nota_voz(segundos):
+    """
+    Nota de voz sintética (tono modulado) en OGG/Opus mono, como las de Telegram
+    """
+    return subprocess.run(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"sine=frequency=220:beep_factor=4:duration={segundos}",
+         "-ac", "1", "-ar", "48000", "-c:a", "libopus", "-b:a", "32k", "-application", "voip",
+         "-f", "ogg", "pipe:1"],
+        capture_output=True,
+        check=True,
+    ).stdout
+
+
+def leer_audios(carpeta, segundos):
+    if not carpeta:
+        return [("sintetico", generar_nota_voz(segundos))]
+    rutas = [os.path.join(carpeta, n) for n in sorted(os.listdir(carpeta))
+             if os.path.splitext(n)[1].lower() in EXTENSIONES_AUDIO]
+    if not rutas:
+        sys.exit(f"❌ No hay audios en {carpeta}")
+    audios = []
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            audios.append((os.path.basename(ruta), f.read()))
+    return audios
+
+
+def decodificar_temporal(datos):
+    """
+    Camino anterior: archivo temporal en disco que ffmpeg vuelve a leer
+    """
+    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp:
+        temp.write(datos)
+    try:
+        return cargar_audio(temp.name)
+    finally:
+        os.unlink(temp.name)
+
+
+async def ejecutar_escenario(modo, audios, args):
+    decodificador = None
+    if modo != "temporal":
+        decodificador = Decodificador(modo, args.pool, MUESTREO)
+        await decodificador.iniciar()
+        if decodificador.modo != modo:
+            return None, None
+    loop = asyncio.get_running_loop()
+    latencias = []
+    muestras = {}
+    try:
+        for i in range(args.calentamiento + args.mensajes):
+            nombre, datos = audios[i % len(audios)]
+            inicio = time.perf_counter()
+            if decodificador is None:
+                # En el bot el archivo temporal bloqueaba un hilo, no el event loop
+                audio = await loop.run_in_executor(None, decodificar_temporal, datos)
+            else:
+                audio = await decodificador.decodificar(bytearray(datos))
+            if i >= args.calentamiento:
+                latencias.append(time.perf_counter() - inicio)
+            muestras[nombre] = audio
+            if args.pausa_ms:
+                await asyncio.sleep(args.pausa_ms / 1000)
+        metricas = decodificador.metricas() if decodificador else {}
+    finally:
+        if decodificador:
+            await decodificador.detener()
+
+    return {
+        "modo": modo,
+        "mensajes": args.mensajes,
+        "latencia": resumen_latencias(latencias),
+        "en_frio": metricas.get("en_frio", 0),
+    }, muestras
+
+
+async def ejecutar(args):
+    audios = leer_audios(args.carpeta, args.segundos)
+    resultados = []
+    referencia = None
+    for modo in args.modo:
+        print(f"▶️ {modo}", file=sys.stderr)
+        resultado, muestras = await ejecutar_escenario(modo, audios, args)
+        if resultado is None:
+            print(f"⚠️ {modo} no disponible, se omite", file=sys.stderr)
+            continue
+        if referencia is None:
+            referencia = muestras
+        resultado["audios_distintos"] = sum(
+            len(muestras[n]) != len(referencia[n]) or bool((muestras[n] != referencia[n]).any()) for n in muestras
+        )
+        resultados.append(resultado)
+
+    base = next((r for r in resultados if r["modo"] == "temporal"), None)
+    if base:
+        for resultado in resultados:
+            resultado["ahorro_por_mensaje_ms"] = round(base["latencia"]["media_ms"] - resultado["latencia"]["media_ms"], 1)
+
+    return {
+        "benchmark": "decodificacion",
+        "audios": len(audios),
+        "segundos_audio": round(sum(len(referencia[n]) for n in referencia) / MUESTREO, 1) if referencia else 0,
+        "pausa_ms": args.pausa_ms,
+        "pool": args.pool,
+        "resultados": resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta", nargs="?", help="Carpeta con notas de voz")
+    parser.add_argument("--segundos", type=float, default=8, help="Duración de la nota sintética si no hay carpeta")
+    parser.add_argument("--modo", action="append", choices=("temporal",) + MODOS,
+                        help="Modo a medir (repetible, por defecto todos)")
+    parser.add_argument("--mensajes", type=int, default=100, help="Mensajes medidos por modo")
+    parser.add_argument("--calentamiento", type=int, default=5, help="Mensajes iniciales sin medir")
+    parser.add_argument("--pausa-ms", type=float, default=50, help="Pausa entre mensajes")
+    parser.add_argument("--pool", type=int, default=2, help="DECODIFICADOR_POOL")
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args()
+    args.modo = args.modo or ["temporal", *MODOS]
+
+    informe = json.dumps(asyncio.run(ejecutar(args)), indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(informe)
+    else:
+        print(informe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Benchmark de extremo a extremo: ejecuta los handlers reales del bot
+(idioma, manejar_cambio_miembros, manejar_audio) con updates sintéticos
+contra una Bot API falsa y con ASR, LLM y TTS falsos de latencia
+configurable, así que no hace falta Telegram, GPU ni Ollama.
+
+Simula --grupos grupos de entre --usuarios-min y --usuarios-max usuarios
+repartidos en --idiomas idiomas y mide la latencia de cada handler
+(p50/p95/p99), el throughput de audios y las llamadas a cada API.
+
+Las latencias se indican como "const:ms", "exp:media_ms" o
+"lognorm:mediana_ms:sigma". La del ASR es por segundo de audio.
+
+Uso:
+    python benchmarks/benchmark_e2e.py --grupos 10 --usuarios-max 100 --idiomas 4 \\
+        --audios 200 --tasa 5 --lat-asr lognorm:150:0.3 --salida resultados_e2e.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import logging
+import tempfile
+
+# Sin persistencia: cada ejecución empieza con cachés vacías y una base de idiomas temporal
+_directorio = tempfile.mkdtemp(prefix="benchmark_e2e_")
+os.environ.setdefault("IDIOMAS_DB", os.path.join(_directorio, "idiomas.db"))
+for _variable in ("CACHE_TRANSCRIPCION_DB", "CACHE_TRADUCCION_DB", "CACHE_TTS_DB"):
+    os.environ.setdefault(_variable, "")
+os.environ.setdefault("METRICAS_PUERTO", "0")
+# La Bot API falsa no limita: sin esto los límites reales de Telegram dominarían la medida
+os.environ.setdefault("ENVIOS_POR_SEGUNDO", "100000")
+os.environ.setdefault("ENVIOS_GRUPO_POR_MINUTO", "6000000")
+
+import numpy as np
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackContext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from metricas import DURACION_ETAPAS
+from comun import Latencia, TelegramFalso, resumen_latencias
+
+TOKEN = "123456:BENCHMARK"
+
+
+class AsrFalso:
+    """
+    Sustituye a la política de modelos ASR: tarda `latencia` por segundo de audio
+    """
+
+    def __init__(self, latencia, idiomas):
+        self.latencia = latencia
+        self.idiomas = idiomas
+        self.llamadas = 0
+
+    def transcribir(self, audio, opciones=None, duracion=None):
+        self.llamadas += 1
+        time.sleep(self.latencia() * (duracion or 1))
+        idioma = (opciones or {}).get("language") or random.choice(self.idiomas)
+        # Texto distinto en cada nota para no medir solo aciertos de caché
+        return {"text": f"Hola a todos. Esta es la nota de voz {self.llamadas}. ¿Qué tal estáis?",
+                "language": idioma, "confianza": 0.9}
+
+
+class LlmFalso:
+    """
+    Sustituye al cliente de Ollama; responde al modo JSON por lotes y al normal
+    """
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.llamadas = 0
+
+    async def generate(self, model, prompt, format=None, stream=False):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia())
+        if format == "json":
+            return {"response": json.dumps({codigo: f"[{codigo}] traducción {self.llamadas}. Segunda frase."
+                                            for codigo in bot.NOMBRES_IDIOMAS})}
+        return {"response": f"traducción {self.llamadas}. Segunda frase."}
+
+
+class TtsFalso:
+    """
+    Sustituye a XTTS: devuelve medio segundo de silencio
+    """
+
+    class synthesizer:
+        output_sample_rate = 24000
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.llamadas = 0
+
+    def tts(self, text, language, speaker):
+        self.llamadas += 1
+        time.sleep(self.latencia())
+        return np.zeros(12000, dtype=np.float32)
+
+
+async def codificar_sin_ffmpeg(pcm, sample_rate):
+    return pcm[:1024]
+
+
+class DecodificadorFalso:
+    """
+    Sustituye al decodificador: la descarga falsa no es un OGG, así que
+    devuelve silencio con la duración de la nota (la ruta lleva su file_id)
+    """
+
+    def __init__(self):
+        self.duraciones = {}
+
+    async def decodificar(self, datos):
+        file_id = bytes(datos).split(b".ogg", 1)[0].rsplit(b"/", 1)[-1].decode()
+        return np.zeros(int(self.duraciones.get(file_id, 1) * bot.MUESTREO_WHISPER), dtype=np.float32)
+
+
+def resumen_tramos():
+    """
+    Duración media de cada etapa medida por metricas.tramo (todas las etiquetas juntas)
+    """
+    etapas = {}
+    for etiquetas, (_, suma, total) in DURACION_ETAPAS.series.items():
+        etapa = dict(etiquetas)["etapa"]
+        acumulado = etapas.setdefault(etapa, [0.0, 0])
+        acumulado[0] += suma
+        acumulado[1] += total
+    return {etapa: {"n": total, "media_ms": round(suma / total * 1000, 1)} for etapa, (suma, total) in etapas.items()}
+
+
+def usuario(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Usuario{user_id}", "username": f"usuario{user_id}"}
+
+
+def chat(chat_id):
+    return {"id": chat_id, "type": "supergroup", "title": f"Grupo {chat_id}"}
+
+
+class Simulacion:
+    def __init__(self, app, falso):
+        self.app = app
+        self.falso = falso
+        self.siguiente_id = 0
+        self.latencias = {"idioma": [], "manejar_cambio_miembros": [], "manejar_audio": []}
+        self.errores = 0
+
+    def nuevo_id(self):
+        self.siguiente_id += 1
+        return self.siguiente_id
+
+    def mensaje(self, chat_id, user_id, **campos):
+        return {
+            "update_id": self.nuevo_id(),
+            "message": {"message_id": self.siguiente_id, "date": int(time.time()),
+                        "chat": chat(chat_id), "from": usuario(user_id), **campos},
+        }
+
+    async def ejecutar(self, handler, datos, args=None):
+        update = Update.de_json(datos, self.app.bot)
+        contexto = CallbackContext.from_update(update, self.app)
+        contexto.args = args
+        inicio = time.perf_counter()
+        try:
+            await handler(update, contexto)
+        except Exception as e:
+            self.errores += 1
+            print(f"❌ {handler.__name__}: {e}", file=sys.stderr)
+        self.latencias[handler.__name__].append(time.perf_counter() - inicio)
+
+    async def registrar_idioma(self, chat_id, user_id, codigo):
+        await self.ejecutar(bot.idioma, self.mensaje(chat_id, user_id, text=f"/idioma {codigo}"), [codigo])
+
+    async def salida_miembro(self, chat_id, user_id):
+        await self.ejecutar(bot.manejar_cambio_miembros, {
+            "update_id": self.nuevo_id(),
+            "chat_member": {
+                "chat": chat(chat_id), "from": usuario(user_id), "date": int(time.time()),
+                "old_chat_member": {"status": "member", "user": usuario(user_id)},
+                "new_chat_member": {"status": "left", "user": usuario(user_id)},
+            },
+        })
+
+    async def nota_de_voz(self, chat_id, user_id, duracion):
+        i = self.nuevo_id()
+        bot.decodificador.duraciones[f"nota{i}"] = duracion
+        await self.ejecutar(bot.manejar_audio, self.mensaje(chat_id, user_id, voice={
+            "file_id": f"nota{i}", "file_unique_id": f"unota{i}", "duration": duracion, "mime_type": "audio/ogg",
+        }))
+
+
+async def ejecutar(args):
+    idiomas = list(bot.IDIOMAS_SOPORTADOS_TTS)[:args.idiomas]
+    asr = AsrFalso(Latencia(args.lat_asr), idiomas)
+    llm = LlmFalso(Latencia(args.lat_llm))
+    tts = TtsFalso(Latencia(args.lat_tts))
+
+    bot.MODO_TRADUCCIONES = args.modo_traducciones
+    bot.politica_asr = asr
+    bot.cliente_ollama = llm
+    bot.tts, bot.tts_speaker = tts, "falso"
+    bot.decodificador = DecodificadorFalso()
+    bot.estado_modelos.update(asr="listo", tts="listo" if args.tts else "desactivado")
+    if not args.tts:
+        bot.tts = None
+    ffmpeg = shutil.which("ffmpeg") is not None
+    if not ffmpeg:
+        bot.codificar_opus = codificar_sin_ffmpeg
+
+    falso = TelegramFalso(Latencia(args.lat_api))
+    app = ApplicationBuilder().token(TOKEN).base_url(f"{falso.url}/bot").base_file_url(f"{falso.url}/file/bot").build()
+    sim = Simulacion(app, falso)
+
+    grupos = {}
+    for g in range(args.grupos):
+        miembros = list(range(g * 1000 + 1, g * 1000 + 1 + random.randint(args.usuarios_min, args.usuarios_max)))
+        grupos[-1000000 - g] = miembros
+
+    async with app:
+        bot.repositorio_idiomas.iniciar_escritor()
+
+        # 1. Cada usuario registra su idioma
+        inicio = time.perf_counter()
+        await asyncio.gather(*(
+            sim.registrar_idioma(chat_id, user_id, random.choice(idiomas))
+            for chat_id, miembros in grupos.items() for user_id in miembros
+        ))
+        tiempo_registro = time.perf_counter() - inicio
+
+        # 2. Notas de voz con llegadas de Poisson (o todas a la vez con --tasa 0)
+        falso.reiniciar_contadores()
+        tareas = []
+        inicio = time.perf_counter()
+        for _ in range(args.audios):
+            chat_id = random.choice(list(grupos))
+            duracion = random.randint(args.duracion_min, args.duracion_max)
+            tareas.append(asyncio.create_task(sim.nota_de_voz(chat_id, random.choice(grupos[chat_id]), duracion)))
+            if args.tasa:
+                await asyncio.sleep(random.expovariate(args.tasa))
+        await asyncio.gather(*tareas)
+        tiempo_audios = time.perf_counter() - inicio
+        llamadas_audios = dict(falso.llamadas)
+
+        # 3. Salidas de miembros
+        falso.reiniciar_contadores()
+        salidas = [(chat_id, user_id) for chat_id, miembros in grupos.items() for user_id in miembros]
+        await asyncio.gather(*(sim.salida_miembro(chat_id, user_id)
+                               for chat_id, user_id in random.sample(salidas, min(args.salidas, len(salidas)))))
+        llamadas_salidas = dict(falso.llamadas)
+
+        await bot.repositorio_idiomas.detener_escritor()
+        for etapa in bot.etapas_pipeline.values():
+            await etapa.detener()
+    falso.detener()
+
+    return {
+        "benchmark": "e2e",
+        "configuracion": {
+            "grupos": args.grupos, "usuarios": [args.usuarios_min, args.usuarios_max], "idiomas": idiomas,
+            "audios": args.audios, "tasa": args.tasa, "duracion_s": [args.duracion_min, args.duracion_max],
+            "lat_api": args.lat_api, "lat_asr": args.lat_asr, "lat_llm": args.lat_llm, "lat_tts": args.lat_tts,
+            "tts": args.tts, "ffmpeg": ffmpeg, "modo_traducciones": args.modo_traducciones, "semilla": args.semilla,
+        },
+        "latencias": {handler: resumen_latencias(valores) for handler, valores in sim.latencias.items()},
+        "throughput": {
+            "registros_por_s": round(len(sim.latencias["idioma"]) / tiempo_registro, 1),
+            "audios_por_s": round(args.audios / tiempo_audios, 2),
+            "segundos_audios": round(tiempo_audios, 2),
+        },
+        "llamadas": {
+            "bot_api_audios": llamadas_audios,
+            "bot_api_salidas": llamadas_salidas,
+            "asr": asr.llamadas,
+            "llm": llm.llamadas,
+            "tts": tts.llamadas,
+            "envios": bot.gestor_envios.metricas(),
+            "pista_idioma": dict(bot.metricas_pista),
+        },
+        "tramos": resumen_tramos(),
+        "etapas": {
+            nombre: {clave: round(valor, 4) for clave, valor in etapa.metricas().items()}
+            for nombre, etapa in bot.etapas_pipeline.items()
+        },
+        "errores": sim.errores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grupos", type=int, default=5)
+    parser.add_argument("--usuarios-min", type=int, default=1)
+    parser.add_argument("--usuarios-max", type=int, default=100)
+    parser.add_argument("--idiomas", type=int, default=4, help="Idiomas distintos entre los usuarios (K)")
+    parser.add_argument("--audios", type=int, default=100)
+    parser.add_argument("--tasa", type=float, default=5, help="Audios por segundo (0 = todos a la vez)")
+    parser.add_argument("--duracion-min", type=int, default=3, help="Duración mínima de las notas (s)")
+    parser.add_argument("--duracion-max", type=int, default=30, help="Duración máxima de las notas (s)")
+    parser.add_argument("--salidas", type=int, default=20, help="Usuarios que abandonan su grupo")
+    parser.add_argument("--lat-api", default="lognorm:40:0.4", help="Latencia de cada llamada a la Bot API")
+    parser.add_argument("--lat-asr", default="lognorm:100:0.3", help="Latencia del ASR por segundo de audio")
+    parser.add_argument("--lat-llm", default="lognorm:400:0.5", help="Latencia de cada llamada al LLM")
+    parser.add_argument("--lat-tts", default="lognorm:300:0.3", help="Latencia de cada síntesis")
+    parser.add_argument("--modo-traducciones", choices=("separado", "editado", "unido"), default=bot.MODO_TRADUCCIONES,
+                        help="Cómo se publican las traducciones (MODO_TRADUCCIONES)")
+    parser.add_argument("--sin-tts", dest="tts", action="store_false", help="Simular el bot sin TTS")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs del bot")
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args()
+    if args.duracion_max >= bot.AUDIO_LARGO_S:
+        parser.error(f"--duracion-max debe ser menor que AUDIO_LARGO_S ({bot.AUDIO_LARGO_S})")
+    random.seed(args.semilla)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    resultados = asyncio.run(ejecutar(args))
+    shutil.rmtree(_directorio, ignore_errors=True)
+
+    informe = json.dumps(resultados, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(informe)
+    else:
+        print(informe)
+
+
+if __name__ == "__main__":
+    main()
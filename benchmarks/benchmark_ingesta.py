@@ -0,0 +1,182 @@
+"""
+Compara la recepción de updates por polling y por webhook, con el proceso
+secuencial de siempre y con updates concurrentes ordenados por chat.
+
+Levanta una Bot API falsa en local (getUpdates, setWebhook...) y registra los
+handlers con bot.registrar_handlers, como el bot real, pero con `/idioma` y
+`procesar_audio` sustituidos por handlers sintéticos que tardan --latencia-ms.
+Así mide solo la ingesta y el reparto de updates, no los modelos. Una
+fracción --audios de los updates son notas de voz de duración aleatoria, que
+pasan por manejar_audio y el planificador de audios como en el bot.
+
+También comprueba que los updates de un mismo chat terminan en orden. Los
+audios se registran con block=False y los ordena el planificador, así que su
+orden se informa aparte del de los comandos.
+
+Uso:
+    python benchmarks/benchmark_ingesta.py --updates 500 --chats 20 \\
+        --latencia-ms 50 --concurrencia 64 --salida resultados_ingesta.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+from telegram.ext import ApplicationBuilder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from bot import ProcesadorUpdatesPorChat
+from comun import TelegramFalso, percentil, puerto_libre
+
+TOKEN = "123456:BENCHMARK"
+
+
+def crear_updates(cantidad, chats, fraccion_audios):
+    updates = []
+    for i in range(1, cantidad + 1):
+        chat_id = -1000 - random.randrange(chats)
+        mensaje = {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Grupo {chat_id}"},
+            "from": {"id": i % 97 + 1, "is_bot": False, "first_name": "Usuario"},
+        }
+        if random.random() < fraccion_audios:
+            mensaje["voice"] = {"file_id": f"nota{i}", "file_unique_id": f"unota{i}", "duration": random.randint(1, 60)}
+        else:
+            mensaje["text"] = "/idioma es"
+            mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": 7}]
+        updates.append({"update_id": i, "message": mensaje})
+    return updates
+
+
+async def ejecutar_escenario(falso, modo, concurrencia, updates, latencia_s, conexiones):
+    total = len(updates)
+    terminados = {}
+    orden = {}  # (tipo, chat_id) -> último message_id procesado
+    desordenados = {"comando": 0, "audio": 0}
+    listo = asyncio.Event()
+
+    async def handler(update, context, *args, **kwargs):
+        await asyncio.sleep(random.expovariate(1 / latencia_s) if latencia_s else 0)
+        # El orden se mira al terminar: es el que ve el chat en las respuestas
+        tipo = "audio" if update.message.voice else "comando"
+        clave = (tipo, update.effective_chat.id)
+        if update.message.message_id < orden.get(clave, 0):
+            desordenados[tipo] += 1
+        orden[clave] = max(orden.get(clave, 0), update.message.message_id)
+        terminados[update.update_id] = time.perf_counter()
+        if len(terminados) == total:
+            listo.set()
+
+    builder = ApplicationBuilder().token(TOKEN).base_url(f"{falso.url}/bot")
+    builder = builder.concurrent_updates(ProcesadorUpdatesPorChat(concurrencia) if concurrencia else False)
+    app = builder.build()
+    # Los handlers se registran con los mismos filtros y block que el bot; los
+    # audios pasan por manejar_audio y un planificador que no rechaza ninguno
+    bot.idioma = bot.procesar_audio = handler
+    bot.planificador_audios = bot.PlanificadorAudios(max(concurrencia, 1), 1, total)
+    bot.registrar_handlers(app)
+    falso.enviados.clear()
+
+    async with app:
+        await app.start()
+        if modo == "polling":
+            falso.cargar(updates)
+            inicio = time.perf_counter()
+            await app.updater.start_polling(poll_interval=0, timeout=1)
+        else:
+            puerto = puerto_libre()
+            url = f"http://127.0.0.1:{puerto}/telegram"
+            await app.updater.start_webhook(listen="127.0.0.1", port=puerto, url_path="telegram", webhook_url=url)
+            inicio = time.perf_counter()
+            limite = asyncio.Semaphore(conexiones)
+            por_chat = {}
+            for update in updates:
+                por_chat.setdefault(update["message"]["chat"]["id"], []).append(update)
+
+            # Como Telegram: chats en paralelo, cada chat en orden
+            async def publicar(cliente, updates_chat):
+                for update in updates_chat:
+                    async with limite:
+                        falso.enviados[update["update_id"]] = time.perf_counter()
+                        await cliente.post(url, json=update)
+
+            async with httpx.AsyncClient(limits=httpx.Limits(max_connections=conexiones)) as cliente:
+                await asyncio.gather(*(publicar(cliente, u) for u in por_chat.values()))
+
+        await listo.wait()
+        tiempo = time.perf_counter() - inicio
+        await app.updater.stop()
+        await app.stop()
+
+    latencias = [(terminados[i] - falso.enviados[i]) * 1000 for i in terminados if i in falso.enviados]
+    return {
+        "modo": modo,
+        "concurrencia": concurrencia or "secuencial",
+        "updates": total,
+        "tiempo_s": round(tiempo, 3),
+        "updates_por_s": round(total / tiempo, 1),
+        "latencia_p50_ms": round(percentil(latencias, 50), 1),
+        "latencia_p95_ms": round(percentil(latencias, 95), 1),
+        "latencia_p99_ms": round(percentil(latencias, 99), 1),
+        "comandos_desordenados_por_chat": desordenados["comando"],
+        "audios_desordenados_por_chat": desordenados["audio"],
+    }
+
+
+async def ejecutar(args):
+    falso = TelegramFalso()
+    resultados = []
+    try:
+        for modo in args.modo:
+            for concurrencia in (0, args.concurrencia):
+                random.seed(args.semilla)
+                updates = crear_updates(args.updates, args.chats, args.audios)
+                print(f"▶️ {modo} / {'concurrente' if concurrencia else 'secuencial'}", file=sys.stderr)
+                resultados.append(await ejecutar_escenario(
+                    falso, modo, concurrencia, updates, args.latencia_ms / 1000, args.conexiones
+                ))
+    finally:
+        falso.detener()
+    return {
+        "benchmark": "ingesta",
+        "chats": args.chats,
+        "latencia_handler_ms": args.latencia_ms,
+        "fraccion_audios": args.audios,
+        "resultados": resultados,
+        "llamadas_bot_api": falso.llamadas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500, help="Updates por escenario")
+    parser.add_argument("--chats", type=int, default=20, help="Chats entre los que se reparten")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="Tiempo medio del handler (exponencial)")
+    parser.add_argument("--audios", type=float, default=0.3, help="Fracción de updates que son notas de voz")
+    parser.add_argument("--concurrencia", type=int, default=64, help="UPDATES_CONCURRENTES del modo concurrente")
+    parser.add_argument("--conexiones", type=int, default=40, help="Conexiones simultáneas al webhook")
+    parser.add_argument("--modo", action="append", choices=("polling", "webhook"),
+                        help="Modo a medir (repetible, por defecto ambos)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args()
+    args.modo = args.modo or ["polling", "webhook"]
+
+    informe = json.dumps(asyncio.run(ejecutar(args)), indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(informe)
+    else:
+        print(informe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Throughput de la transcripción con micro-lotes frente a un audio cada vez.
+
+Lanza --peticiones transcripciones con llegadas de Poisson (--tasa por
+segundo, 0 = todas a la vez) contra el PoolTranscripcion del bot, una vez por
+cada --lote (1 = el camino de siempre, transcribe() audio a audio), y mide
+audios por segundo, segundos de audio por segundo y la latencia de cada
+petición. También cuenta cuántos textos cambian respecto al primer --lote.
+
+Los audios salen de una carpeta (cualquier formato que lea ffmpeg). Con
+--simulado no hace falta modelo: cada pasada cuesta "fijo_ms:ventana_ms"
+(coste fijo más coste por ventana de 30 s), útil para probar el planificador.
+
+Uso:
+    python benchmarks/benchmark_lotes_asr.py corpus/ --motor faster-whisper:small \\
+        --peticiones 64 --tasa 0 --lote 1 --lote 4 --lote 8 --espera-ms 50
+    python benchmarks/benchmark_lotes_asr.py --simulado 400:60 --peticiones 64 --lote 1 --lote 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from asr import MUESTREO, PoliticaModelos, cargar_audio, crear_motor, ventanas_lote
+from comun import resumen_latencias
+from benchmark_asr import EXTENSIONES_AUDIO, normalizar
+
+
+class MotorSimulado:
+    """
+    Motor sin modelo: cada pasada tarda un coste fijo más un coste por ventana
+    """
+
+    nombre = "simulado"
+
+    def __init__(self, especificacion):
+        fijo, ventana = (float(v) / 1000 for v in especificacion.split(":"))
+        self.fijo = fijo
+        self.ventana = ventana
+
+    def cargar(self, nombre_modelo):
+        return None
+
+    def transcribir(self, audio, nombre_modelo, opciones=None):
+        return self.transcribir_lote([audio], nombre_modelo, [opciones])[0]
+
+    def transcribir_lote(self, audios, nombre_modelo, opciones=None):
+        ventanas = sum(len(ventanas_lote(audio)) for audio in audios)
+        time.sleep(self.fijo + self.ventana * ventanas)
+        return [{"text": f"audio de {len(audio) / MUESTREO:.1f}s", "language": "es", "confianza": 1.0} for audio in audios]
+
+
+def leer_audios(carpeta, simulado, cantidad):
+    if carpeta:
+        rutas = [os.path.join(carpeta, n) for n in sorted(os.listdir(carpeta))
+                 if os.path.splitext(n)[1].lower() in EXTENSIONES_AUDIO]
+        if not rutas:
+            sys.exit(f"❌ No hay audios en {carpeta}")
+        return [(os.path.basename(r), cargar_audio(r)) for r in rutas]
+    if not simulado:
+        sys.exit("❌ Indica una carpeta de audios o --simulado")
+    # Notas de voz sintéticas de 3 a 40 segundos
+    return [(f"sintetico{i}", np.zeros(random.randint(3, 40) * MUESTREO, dtype=np.float32)) for i in range(cantidad)]
+
+
+async def ejecutar_escenario(args, lote, peticiones):
+    pool = bot.PoolTranscripcion(args.workers, len(peticiones), "thread", lote, args.espera_ms / 1000)
+    latencias = []
+    textos = {}
+
+    async def peticion(i, nombre, audio):
+        inicio = time.perf_counter()
+        resultado = await pool.transcribir(audio, None, len(audio) / MUESTREO)
+        latencias.append(time.perf_counter() - inicio)
+        textos[i] = resultado["text"]
+
+    random.seed(args.semilla)
+    tareas = []
+    inicio = time.perf_counter()
+    for i, (nombre, audio) in enumerate(peticiones):
+        tareas.append(asyncio.create_task(peticion(i, nombre, audio)))
+        if args.tasa:
+            await asyncio.sleep(random.expovariate(args.tasa))
+    await asyncio.gather(*tareas)
+    tiempo = time.perf_counter() - inicio
+    pool.executor.shutdown()
+
+    m = pool.metricas()
+    segundos_audio = sum(len(audio) for _, audio in peticiones) / MUESTREO
+    return {
+        "lote_max": lote,
+        "tiempo_s": round(tiempo, 2),
+        "audios_por_s": round(len(peticiones) / tiempo, 2),
+        "segundos_audio_por_s": round(segundos_audio / tiempo, 1),
+        "lotes": m["lotes"],
+        "lote_medio": round(m["lote_medio"], 2),
+        "latencia": resumen_latencias(latencias),
+    }, textos
+
+
+async def ejecutar(args):
+    if args.simulado:
+        motor, modelo = MotorSimulado(args.simulado), "simulado"
+    else:
+        nombre_motor, _, modelo = args.motor.partition(":")
+        motor = crear_motor(nombre_motor, args.hilos, args.compute_type)
+        motor.cargar(modelo)
+    bot.politica_asr = PoliticaModelos(motor, modelo)
+
+    audios = leer_audios(args.carpeta, args.simulado, args.peticiones)
+    random.seed(args.semilla)
+    peticiones = [random.choice(audios) for _ in range(args.peticiones)]
+
+    resultados = []
+    referencia = None
+    for lote in args.lote:
+        print(f"▶️ lote máximo {lote}", file=sys.stderr)
+        resultado, textos = await ejecutar_escenario(args, lote, peticiones)
+        if referencia is None:
+            referencia = textos
+        resultado["textos_distintos"] = sum(normalizar(textos[i]) != normalizar(referencia[i]) for i in textos)
+        resultados.append(resultado)
+
+    return {
+        "benchmark": "lotes_asr",
+        "motor": f"simulado:{args.simulado}" if args.simulado else args.motor,
+        "peticiones": args.peticiones,
+        "tasa": args.tasa,
+        "workers": args.workers,
+        "espera_ms": args.espera_ms,
+        "resultados": resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta", nargs="?", help="Carpeta con audios")
+    parser.add_argument("--motor", default="faster-whisper:small", help="motor:modelo")
+    parser.add_argument("--simulado", default=None, help="Motor simulado fijo_ms:ventana_ms, sin modelo")
+    parser.add_argument("--lote", type=int, action="append", help="ASR_LOTE_MAX a medir (repetible)")
+    parser.add_argument("--espera-ms", type=float, default=50, help="ASR_LOTE_ESPERA_MS")
+    parser.add_argument("--peticiones", type=int, default=64)
+    parser.add_argument("--tasa", type=float, default=0, help="Peticiones por segundo (0 = todas a la vez)")
+    parser.add_argument("--workers", type=int, default=1, help="WHISPER_WORKERS")
+    parser.add_argument("--hilos", type=int, default=0)
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args()
+    args.lote = args.lote or [1, 4, 8]
+
+    informe = json.dumps(asyncio.run(ejecutar(args)), indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(informe)
+    else:
+        print(informe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Piezas compartidas por los benchmarks: Bot API falsa, distribuciones de
+latencia y percentiles.
+"""
+import json
+import time
+import random
+import socket
+import threading
+from email.parser import BytesParser
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def resumen_latencias(valores_s):
+    """
+    p50/p95/p99, media y máximo en milisegundos
+    """
+    if not valores_s:
+        return {"n": 0}
+    ms = [v * 1000 for v in valores_s]
+    return {
+        "n": len(ms),
+        "p50_ms": round(percentil(ms, 50), 1),
+        "p95_ms": round(percentil(ms, 95), 1),
+        "p99_ms": round(percentil(ms, 99), 1),
+        "media_ms": round(sum(ms) / len(ms), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+
+class Latencia:
+    """
+    Distribución de latencias en segundos, a partir de un texto:
+    "0", "const:50", "exp:50" (media) o "lognorm:50:0.5" (mediana y sigma), en ms
+    """
+
+    def __init__(self, especificacion):
+        self.especificacion = especificacion
+        tipo, *valores = especificacion.split(":")
+        if tipo.replace(".", "", 1).isdigit():
+            tipo, valores = "const", [tipo]
+        self.tipo = tipo
+        self.valores = [float(v) for v in valores]
+        if tipo not in ("const", "exp", "lognorm"):
+            raise ValueError(f"Distribución de latencia desconocida: {especificacion}")
+
+    def __call__(self):
+        if self.tipo == "const":
+            ms = self.valores[0]
+        elif self.tipo == "exp":
+            ms = random.expovariate(1 / self.valores[0]) if self.valores[0] else 0
+        else:
+            mediana, sigma = self.valores
+            ms = random.lognormvariate(0, sigma) * mediana
+        return ms / 1000
+
+    def __str__(self):
+        return self.especificacion
+
+
+class TelegramFalso:
+    """
+    Bot API mínima servida en local. Responde a los métodos que usa el bot con
+    objetos verosímiles, entrega los updates cargados por getUpdates, sirve
+    descargas de archivos y cuenta las llamadas por método. `latencia` se
+    aplica a cada petición.
+    """
+
+    def __init__(self, latencia=None):
+        self.latencia = latencia
+        self.pendientes = []
+        self.enviados = {}  # update_id -> instante en que se entregó
+        self.llamadas = {}
+        self.mensajes = 0
+        self.candado = threading.Lock()
+        self.puerto = puerto_libre()
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", self.puerto), self._crear_manejador())
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.puerto}"
+
+    def cargar(self, updates):
+        with self.candado:
+            self.pendientes.extend(updates)
+
+    def detener(self):
+        self.servidor.shutdown()
+
+    def reiniciar_contadores(self):
+        with self.candado:
+            self.llamadas.clear()
+
+    def _contar(self, metodo):
+        with self.candado:
+            self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+
+    def _mensaje(self, parametros, **extra):
+        with self.candado:
+            self.mensajes += 1
+            message_id = self.mensajes
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(parametros.get("chat_id") or 0), "type": "group", "title": "Grupo"},
+            **extra,
+        }
+
+    def _get_updates(self, parametros):
+        offset = int(parametros.get("offset") or 0)
+        with self.candado:
+            self.pendientes = [u for u in self.pendientes if u["update_id"] >= offset]
+            lote = self.pendientes[:100]
+            ahora = time.perf_counter()
+            for update in lote:
+                self.enviados.setdefault(update["update_id"], ahora)
+        if not lote:
+            time.sleep(0.01)
+        return lote
+
+    def responder(self, metodo, parametros):
+        """
+        Resultado de cada método de la Bot API
+        """
+        if metodo == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        if metodo == "getUpdates":
+            return self._get_updates(parametros)
+        if metodo == "getFile":
+            file_id = parametros.get("file_id", "archivo")
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": 4096,
+                    "file_path": f"voice/{file_id}.ogg"}
+        if metodo == "getChatMember":
+            user_id = int(parametros.get("user_id") or 0)
+            return {"status": "member", "user": {"id": user_id, "is_bot": False,
+                                                 "first_name": f"Usuario{user_id}", "username": f"usuario{user_id}"}}
+        if metodo == "getChatMemberCount":
+            return 5
+        if metodo in ("sendMessage", "editMessageText"):
+            return self._mensaje(parametros, text=str(parametros.get("text", "")))
+        if metodo == "sendVoice":
+            voz = f"voz{self.mensajes + 1}"
+            return self._mensaje(parametros, voice={"file_id": voz, "file_unique_id": f"u{voz}", "duration": 1})
+        return True
+
+    def _crear_manejador(self):
+        falso = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _esperar(self):
+                if falso.latencia:
+                    time.sleep(falso.latencia())
+
+            def _responder(self, datos, tipo="application/json"):
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def _parametros(self):
+                cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                tipo = self.headers.get("Content-Type", "")
+                if tipo.startswith("multipart/"):
+                    mensaje = BytesParser().parsebytes(f"Content-Type: {tipo}\r\n\r\n".encode() + cuerpo)
+                    crudos = {
+                        parte.get_param("name", header="content-disposition"): parte.get_payload(decode=True)
+                        for parte in mensaje.get_payload()
+                        if not parte.get_filename()
+                    }
+                    crudos = {clave: valor.decode() for clave, valor in crudos.items()}
+                elif tipo.startswith("application/json"):
+                    return json.loads(cuerpo or b"{}")
+                else:
+                    crudos = {clave: valores[0] for clave, valores in parse_qs(cuerpo.decode()).items()}
+                parametros = {}
+                for clave, valor in crudos.items():
+                    try:
+                        parametros[clave] = json.loads(valor)
+                    except ValueError:
+                        parametros[clave] = valor
+                return parametros
+
+            def do_GET(self):
+                # Descarga de archivos: el contenido depende de la ruta para no repetir hashes
+                falso._contar("descarga")
+                self._esperar()
+                self._responder(self.path.encode() * 64, "application/octet-stream")
+
+            def do_POST(self):
+                parametros = self._parametros()
+                metodo = self.path.rsplit("/", 1)[-1]
+                falso._contar(metodo)
+                if metodo != "getUpdates":
+                    self._esperar()
+                resultado = falso.responder(metodo, parametros)
+                self._responder(json.dumps({"ok": True, "result": resultado}).encode())
+
+        return Manejador
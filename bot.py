@@ -1,30 +1,180 @@
+import time
+INICIO_PROCESO = time.monotonic()
+
 import os
+import re
 import json
-import tempfile
-import whisper
+import asyncio
+import logging
+import sqlite3
+import hashlib
+import heapq
+import itertools
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import ollama
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     ChatMemberHandler,
     filters,
 )
-from TTS.api import TTS
+from asr import crear_motor, PoliticaModelos
+from cola_trabajos import ColaTrabajos
+from decodificador import Decodificador
+from metricas import ERRORES, registro, servir_metricas, tramo
+
+log = logging.getLogger("bot")
 
 # Cargar .env
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-# Cargar modelo de Whisper
-modelo_whisper = whisper.load_model("large-v3")
+# Logs: DEBUG muestra el detalle de cada audio; WARNING deja solo avisos y errores
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+# Métricas de Prometheus en http://METRICAS_HOST:METRICAS_PUERTO/metrics (0 = desactivadas)
+METRICAS_HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+METRICAS_PUERTO = int(os.getenv("METRICAS_PUERTO", "9464"))
+
+# Recepción de updates: "polling" o "webhook" (servidor HTTP local detrás de WEBHOOK_URL)
+MODO_INGESTA = os.getenv("MODO_INGESTA", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # URL pública, p. ej. https://bot.example.com
+WEBHOOK_ESCUCHA = os.getenv("WEBHOOK_ESCUCHA", "0.0.0.0")
+WEBHOOK_PUERTO = int(os.getenv("WEBHOOK_PUERTO", "8443"))
+WEBHOOK_RUTA = os.getenv("WEBHOOK_RUTA", "telegram")
+WEBHOOK_SECRETO = os.getenv("WEBHOOK_SECRETO", "") or None
+# Updates atendidos a la vez (los de un mismo chat siempre en orden); 0 = de uno en uno
+UPDATES_CONCURRENTES = int(os.getenv("UPDATES_CONCURRENTES", "64"))
+# Bot API alternativa: servidor local de Telegram o uno falso para pruebas
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+# Motor de reconocimiento de voz: "whisper" o "faster-whisper" (int8 en CPU)
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper")
+ASR_MODELO = os.getenv("ASR_MODELO", "large-v3")
+# Modelo pequeño opcional para notas de voz cortas (vacío = usar siempre ASR_MODELO)
+ASR_MODELO_CORTO = os.getenv("ASR_MODELO_CORTO", "")
+ASR_DURACION_CORTO_S = int(os.getenv("ASR_DURACION_CORTO_S", "30"))
+ASR_CONFIANZA_MIN = float(os.getenv("ASR_CONFIANZA_MIN", "0.6"))
+ASR_HILOS = int(os.getenv("ASR_HILOS", "0"))  # hilos por worker (0 = automático)
+ASR_COMPUTE_TYPE = os.getenv("ASR_COMPUTE_TYPE", "int8")
+# Pista de idioma: se transcribe directamente en el idioma configurado por el
+# remitente y solo se vuelve a la detección automática si la confianza es baja
+ASR_PISTA_IDIOMA = os.getenv("ASR_PISTA_IDIOMA", "1") == "1"
+ASR_PISTA_CONFIANZA_MIN = float(os.getenv("ASR_PISTA_CONFIANZA_MIN", "0.5"))
+
+# Los modelos se cargan en segundo plano cuando el bot ya está en marcha.
+# Con ASR_ACTIVADO/TTS_ACTIVADO a "0" ni siquiera se importan sus librerías.
+ASR_ACTIVADO = os.getenv("ASR_ACTIVADO", "1") == "1"
+TTS_ACTIVADO = os.getenv("TTS_ACTIVADO", "1") == "1"
+motor_asr = None
+politica_asr = None
+
+# Configurar pool de transcripción
+WHISPER_POOL = os.getenv("WHISPER_POOL", "thread")  # "thread" o "process"
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+WHISPER_COLA_MAX = int(os.getenv("WHISPER_COLA_MAX", "8"))
+# Micro-lotes: las transcripciones que llegan dentro de ASR_LOTE_ESPERA_MS se
+# agrupan (hasta ASR_LOTE_MAX) en una sola pasada del modelo (1 = desactivado)
+ASR_LOTE_MAX = int(os.getenv("ASR_LOTE_MAX", "1"))
+ASR_LOTE_ESPERA_MS = float(os.getenv("ASR_LOTE_ESPERA_MS", "50"))
+
+# Modo con workers: este proceso solo atiende Telegram y encola los audios en
+# COLA_TRABAJOS_DB; uno o varios `python worker.py` los procesan y responden
+MODO_WORKERS = os.getenv("MODO_WORKERS", "0") == "1"
+COLA_TRABAJOS_DB = os.getenv("COLA_TRABAJOS_DB", "trabajos.db")
+TRABAJO_REINTENTOS = int(os.getenv("TRABAJO_REINTENTOS", "3"))
+TRABAJO_VISIBILIDAD_S = int(os.getenv("TRABAJO_VISIBILIDAD_S", "600"))
+WORKER_CONCURRENCIA = int(os.getenv("WORKER_CONCURRENCIA", "2"))
+# Trabajos sin terminar admitidos en la cola (por chat se usa PLANIFICADOR_COLA_POR_CHAT)
+COLA_TRABAJOS_MAX = int(os.getenv("COLA_TRABAJOS_MAX", "200"))
+
+# Audios largos: se decodifican y transcriben por ventanas con resultados progresivos
+AUDIO_LARGO_S = int(os.getenv("AUDIO_LARGO_S", "120"))
+VENTANA_AUDIO_S = int(os.getenv("VENTANA_AUDIO_S", "30"))
+VAD_UMBRAL = float(os.getenv("VAD_UMBRAL", "0.01"))
+MUESTREO_WHISPER = 16000
+
+# Decodificación en memoria: "pool" (ffmpeg precalentados), "ffmpeg" (uno por audio) o "pyav"
+DECODIFICADOR = os.getenv("DECODIFICADOR", "pool").lower()
+DECODIFICADOR_POOL = int(os.getenv("DECODIFICADOR_POOL", "2"))
+
+# Caché de transcripciones por file_unique_id de Telegram (y hash del contenido)
+CACHE_TRANSCRIPCION_MB = float(os.getenv("CACHE_TRANSCRIPCION_MB", "8"))
+CACHE_TRANSCRIPCION_TTL = int(os.getenv("CACHE_TRANSCRIPCION_TTL", str(30 * 24 * 3600)))
+CACHE_TRANSCRIPCION_DB = os.getenv("CACHE_TRANSCRIPCION_DB", "cache.db")
+
+# Workers por etapa del pipeline de audio (la transcripción usa WHISPER_WORKERS)
+ETAPA_DESCARGA_WORKERS = int(os.getenv("ETAPA_DESCARGA_WORKERS", "4"))
+ETAPA_TRADUCCION_WORKERS = int(os.getenv("ETAPA_TRADUCCION_WORKERS", "4"))
+ETAPA_SINTESIS_WORKERS = int(os.getenv("ETAPA_SINTESIS_WORKERS", "1"))
+
+# Planificador de audios: reparto justo entre chats
+PLANIFICADOR_CONCURRENCIA = int(os.getenv("PLANIFICADOR_CONCURRENCIA", "4"))
+PLANIFICADOR_POR_CHAT = int(os.getenv("PLANIFICADOR_POR_CHAT", "1"))
+PLANIFICADOR_COLA_POR_CHAT = int(os.getenv("PLANIFICADOR_COLA_POR_CHAT", "20"))
+# Pesos opcionales por chat, p. ej. "-1001234:2,-1005678:0.5"
+PESOS_CHATS = {
+    chat_id.strip(): float(peso)
+    for chat_id, peso in (par.split(":") for par in os.getenv("PESOS_CHATS", "").split(",") if ":" in par)
+}
+
+# Consultas de miembros (get_chat_member): caché, límite de peticiones y barrido periódico
+CACHE_MIEMBROS_TTL = int(os.getenv("CACHE_MIEMBROS_TTL", "600"))
+MIEMBROS_POR_SEGUNDO = float(os.getenv("MIEMBROS_POR_SEGUNDO", "10"))
+BARRIDO_MIEMBROS_S = int(os.getenv("BARRIDO_MIEMBROS_S", "3600"))
+# Limpieza de chats inactivos (/limpiar_json en privado): tarea de fondo reanudable
+LIMPIEZA_CONCURRENCIA = int(os.getenv("LIMPIEZA_CONCURRENCIA", "8"))
+LIMPIEZA_POR_SEGUNDO = float(os.getenv("LIMPIEZA_POR_SEGUNDO", "20"))
+LIMPIEZA_INTERVALO_H = float(os.getenv("LIMPIEZA_INTERVALO_H", "0"))  # 0 = solo bajo demanda
+
+# Envíos a Telegram: límite global y por chat (Telegram admite unos 30 mensajes/s
+# en total, 20 por minuto en cada grupo y 1 por segundo en chats privados)
+ENVIOS_POR_SEGUNDO = float(os.getenv("ENVIOS_POR_SEGUNDO", "25"))
+ENVIOS_GRUPO_POR_MINUTO = float(os.getenv("ENVIOS_GRUPO_POR_MINUTO", "20"))
+ENVIOS_RAFAGA_CHAT = int(os.getenv("ENVIOS_RAFAGA_CHAT", "3"))
+ENVIOS_REINTENTOS = int(os.getenv("ENVIOS_REINTENTOS", "3"))
+# Publicación de traducciones: "separado" (un mensaje por idioma), "unido" (todas
+# en un mensaje al terminar) o "editado" (un mensaje que se completa según llegan)
+MODO_TRADUCCIONES = os.getenv("MODO_TRADUCCIONES", "separado")
 
 # Configurar Ollama
 OLLAMA_MODEL = "phi3:3.8b-mini-128k-instruct-q4_K_M"
-print("Inicializando TTS...")
+OLLAMA_CONCURRENCIA = int(os.getenv("OLLAMA_CONCURRENCIA", "4"))
+# Si es "1", las traducciones se publican en orden estable en lugar de según van terminando
+TRADUCCIONES_EN_ORDEN = os.getenv("TRADUCCIONES_EN_ORDEN", "0") == "1"
+# Traducir a todos los idiomas en una sola llamada cuando haya al menos TRADUCCION_LOTE_MIN destinos
+TRADUCCION_LOTE = os.getenv("TRADUCCION_LOTE", "1") == "1"
+TRADUCCION_LOTE_MIN = int(os.getenv("TRADUCCION_LOTE_MIN", "2"))
+# Caché de traducciones (CACHE_TRADUCCION_DB vacío = solo en memoria)
+CACHE_TRADUCCION_MB = float(os.getenv("CACHE_TRADUCCION_MB", "16"))
+CACHE_TRADUCCION_TTL = int(os.getenv("CACHE_TRADUCCION_TTL", str(7 * 24 * 3600)))
+CACHE_TRADUCCION_DB = os.getenv("CACHE_TRADUCCION_DB", "")
+cliente_ollama = ollama.AsyncClient()
+_semaforo_ollama = None
+
+def semaforo_ollama():
+    """Crea el semáforo de Ollama dentro del event loop activo"""
+    global _semaforo_ollama
+    if _semaforo_ollama is None:
+        _semaforo_ollama = asyncio.Semaphore(OLLAMA_CONCURRENCIA)
+    return _semaforo_ollama
+
+# Caché de audios TTS (OGG/Opus) y de file_id de Telegram ya subidos
+TTS_OPUS_BITRATE = os.getenv("TTS_OPUS_BITRATE", "32k")
+CACHE_TTS_MB = float(os.getenv("CACHE_TTS_MB", "64"))
+CACHE_TTS_TTL = int(os.getenv("CACHE_TTS_TTL", str(30 * 24 * 3600)))
+CACHE_TTS_DB = os.getenv("CACHE_TTS_DB", "cache.db")
+# "1": enviar la traducción frase a frase según se sintetiza; "0": una sola nota de voz
+TTS_STREAMING = os.getenv("TTS_STREAMING", "1") == "1"
+TTS_FRASE_MIN_CARACTERES = int(os.getenv("TTS_FRASE_MIN_CARACTERES", "40"))
 
 # Variables globales para TTS
 tts = None
@@ -37,11 +187,940 @@ def get_available_speakers(tts_instance):
         if speaker_manager and hasattr(speaker_manager, 'speakers'):
             return list(speaker_manager.speakers.keys())
     except Exception as e:
-        print(f"Error obteniendo speakers: {e}")
+        log.error(f"Error obteniendo speakers: {e}")
     
     # Fallback con speakers conocidos
     return ["Claribel Dervla", "Daisy Studious", "Andrew Chipper", "Craig Gutsy"]
 
+class CacheLRU:
+    """
+    Caché LRU con caducidad (TTL), límite en bytes y persistencia opcional en SQLite.
+    Los valores pueden ser bytes o cualquier objeto serializable a JSON.
+
+    El disco no se toca desde el event loop: las lecturas van a un hilo propio
+    y las escrituras (valores nuevos y marcas de uso) se acumulan y se vuelcan
+    juntas como mucho cada `intervalo_ms`, como en RepositorioIdiomas. Los
+    bytes en disco se llevan en memoria para no sumar la tabla en cada guardado.
+    Sin escritor en marcha (scripts, herramientas) se escribe al momento.
+    """
+
+    def __init__(self, nombre, max_bytes, ttl=None, ruta_db=None, intervalo_ms=500):
+        self.nombre = nombre
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entradas = OrderedDict()  # clave -> (valor, tamaño, creado)
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.intervalo = intervalo_ms / 1000
+        self.pendientes = {}  # clave -> (datos, binario, creado) aún sin volcar
+        self.usados = {}  # clave -> instante del último acierto en disco, sin volcar
+        self.sucio = None
+        self.tarea_escritor = None
+        self.detenido = False
+        self.escrituras = 0
+        self.db = None
+        self.executor = None
+        self.bytes_disco = 0
+        if ruta_db:
+            self.db = sqlite3.connect(ruta_db, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS cache_{nombre} ("
+                "clave TEXT PRIMARY KEY, valor BLOB, binario INTEGER, creado REAL, usado REAL)"
+            )
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS cache_{nombre}_usado ON cache_{nombre} (usado)")
+            if ttl:
+                self.db.execute(f"DELETE FROM cache_{nombre} WHERE creado < ?", (time.time() - ttl,))
+            self.db.commit()
+            self.bytes_disco = self.db.execute(
+                f"SELECT COALESCE(SUM(LENGTH(valor) + LENGTH(clave)), 0) FROM cache_{nombre}"
+            ).fetchone()[0]
+            # Un solo hilo por caché: la conexión nunca se usa desde dos hilos a la vez
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cache_{nombre}")
+
+    @staticmethod
+    def _serializar(valor):
+        if isinstance(valor, (bytes, bytearray)):
+            return bytes(valor), 1
+        return json.dumps(valor, ensure_ascii=False).encode("utf-8"), 0
+
+    @staticmethod
+    def _deserializar(datos, binario):
+        return bytes(datos) if binario else json.loads(datos)
+
+    def _caducada(self, creado):
+        return self.ttl is not None and time.time() - creado > self.ttl
+
+    def _expulsar(self):
+        while self.bytes_usados > self.max_bytes and self.entradas:
+            _, (_, tamaño, _) = self.entradas.popitem(last=False)
+            self.bytes_usados -= tamaño
+            self.expulsiones += 1
+
+    def _guardar_en_memoria(self, clave, valor, tamaño, creado):
+        if clave in self.entradas:
+            self.bytes_usados -= self.entradas.pop(clave)[1]
+        if tamaño > self.max_bytes:
+            return
+        self.entradas[clave] = (valor, tamaño, creado)
+        self.bytes_usados += tamaño
+        self._expulsar()
+
+    def _leer(self, clave):
+        return self.db.execute(
+            f"SELECT valor, binario, creado FROM cache_{self.nombre} WHERE clave = ?", (clave,)
+        ).fetchone()
+
+    async def obtener(self, clave):
+        """
+        Devuelve el valor guardado o None si no existe o ha caducado
+        """
+        entrada = self.entradas.get(clave)
+        if entrada is not None:
+            valor, tamaño, creado = entrada
+            if not self._caducada(creado):
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+                return valor
+            self.entradas.pop(clave)
+            self.bytes_usados -= tamaño
+
+        if self.db is not None:
+            fila = self.pendientes.get(clave)
+            if fila is None:
+                fila = await asyncio.get_running_loop().run_in_executor(self.executor, self._leer, clave)
+            if fila and not self._caducada(fila[2]):
+                valor = self._deserializar(fila[0], fila[1])
+                self._guardar_en_memoria(clave, valor, len(clave) + len(fila[0]), fila[2])
+                # La marca de uso para el LRU en disco se vuelca con el siguiente lote
+                self.usados[clave] = time.time()
+                self._marcar()
+                self.aciertos += 1
+                return valor
+
+        self.fallos += 1
+        return None
+
+    def guardar(self, clave, valor):
+        """
+        Guarda un valor en memoria y, si hay base de datos, lo deja pendiente de volcar a disco
+        """
+        datos, binario = self._serializar(valor)
+        ahora = time.time()
+        self._guardar_en_memoria(clave, valor, len(clave) + len(datos), ahora)
+        if self.db is not None:
+            self.pendientes[clave] = (datos, binario, ahora)
+            self.usados.pop(clave, None)
+            self._marcar()
+
+    # --- Volcado a disco ---
+
+    def _marcar(self):
+        if self.sucio is None:
+            self.vaciar()
+        else:
+            self.sucio.set()
+
+    def _tomar_pendientes(self):
+        lote, self.pendientes = self.pendientes, {}
+        usados, self.usados = self.usados, {}
+        return lote, usados
+
+    def _escribir(self, lote, usados):
+        if not lote and not usados:
+            return
+        tabla = f"cache_{self.nombre}"
+        bytes_disco = self.bytes_disco
+        try:
+            with self.db:
+                for clave, (datos, binario, creado) in lote.items():
+                    anterior = self.db.execute(
+                        f"SELECT LENGTH(valor) + LENGTH(clave) FROM {tabla} WHERE clave = ?", (clave,)
+                    ).fetchone()
+                    if anterior:
+                        bytes_disco -= anterior[0]
+                    self.db.execute(
+                        f"INSERT OR REPLACE INTO {tabla} VALUES (?, ?, ?, ?, ?)",
+                        (clave, datos, binario, creado, creado),
+                    )
+                    bytes_disco += len(clave) + len(datos)
+                self.db.executemany(
+                    f"UPDATE {tabla} SET usado = ? WHERE clave = ?",
+                    [(usado, clave) for clave, usado in usados.items()],
+                )
+                # En disco se aplica el mismo límite de bytes, borrando las menos
+                # usadas hasta dejar un 10 % libre para no borrar en cada volcado
+                if bytes_disco > self.max_bytes:
+                    expulsadas = []
+                    for clave, tamaño in self.db.execute(
+                        f"SELECT clave, LENGTH(valor) + LENGTH(clave) FROM {tabla} ORDER BY usado"
+                    ):
+                        if bytes_disco <= self.max_bytes * 0.9:
+                            break
+                        expulsadas.append((clave,))
+                        bytes_disco -= tamaño
+                    self.db.executemany(f"DELETE FROM {tabla} WHERE clave = ?", expulsadas)
+        except Exception:
+            # Devolver el lote a la cola sin pisar cambios más recientes
+            for clave, fila in lote.items():
+                self.pendientes.setdefault(clave, fila)
+            for clave, usado in usados.items():
+                self.usados.setdefault(clave, usado)
+            raise
+        self.bytes_disco = bytes_disco
+        self.escrituras += 1
+
+    def vaciar(self):
+        """Escribe ya todos los cambios pendientes"""
+        if self.db is not None:
+            self._escribir(*self._tomar_pendientes())
+
+    async def _escritor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.sucio.wait()
+            if self.detenido:
+                return
+            await asyncio.sleep(self.intervalo)
+            if self.detenido:
+                return
+            self.sucio.clear()
+            lote, usados = self._tomar_pendientes()
+            try:
+                await loop.run_in_executor(self.executor, self._escribir, lote, usados)
+            except Exception as e:
+                log.error(f"❌ Error guardando la caché {self.nombre}, se reintentará: {e}")
+                self.sucio.set()
+
+    def iniciar_escritor(self):
+        """Arranca el volcado diferido en el event loop activo"""
+        if self.db is None:
+            return
+        self.sucio = asyncio.Event()
+        self.detenido = False
+        if self.pendientes or self.usados:
+            self.sucio.set()
+        self.tarea_escritor = asyncio.create_task(self._escritor())
+
+    async def detener_escritor(self):
+        """
+        Detiene el volcado diferido y escribe lo que quede pendiente, después
+        del lote que esté escribiendo el hilo de la caché
+        """
+        if self.tarea_escritor:
+            self.detenido = True
+            self.sucio.set()
+            await self.tarea_escritor
+        self.tarea_escritor = None
+        self.sucio = None
+        if self.db is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.vaciar)
+
+    def contiene(self, clave):
+        """
+        Indica si la clave está en memoria, sin contar acierto ni fallo
+        """
+        return clave in self.entradas
+
+    def metricas(self):
+        """
+        Devuelve aciertos, fallos y ocupación de la caché
+        """
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self.entradas),
+            "bytes": self.bytes_usados,
+            "max_bytes": self.max_bytes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "expulsiones": self.expulsiones,
+            "tasa_aciertos": self.aciertos / total if total else 0.0,
+            "bytes_disco": self.bytes_disco,
+            "escrituras": self.escrituras,
+            "pendientes": len(self.pendientes),
+        }
+
+
+# Espera en cola por etapa; la duración de cada etapa la mide metricas.tramo
+ESPERA_COLAS = registro.histograma("bot_cola_espera_segundos", "Espera en la cola de cada etapa del pipeline")
+
+class EtapaPipeline:
+    """
+    Etapa del pipeline de audio: una cola asíncrona atendida por N workers.
+    Mide la espera en cola, el tiempo de servicio y la ocupación de los workers
+    para que se vea qué etapa es el cuello de botella.
+    """
+
+    def __init__(self, nombre, workers, max_cola=None):
+        self.nombre = nombre
+        self.workers = workers
+        self.max_cola = max_cola
+        self.cola = None
+        self.tareas = []
+        self.inicio = None
+        self.procesados = 0
+        self.errores = 0
+        self.rechazados = 0
+        self.en_servicio = 0
+        self.espera_total = 0.0
+        self.servicio_total = 0.0
+
+    def iniciar(self):
+        self.cola = asyncio.Queue()
+        self.inicio = time.monotonic()
+        self.tareas = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def detener(self):
+        for tarea in self.tareas:
+            tarea.cancel()
+        await asyncio.gather(*self.tareas, return_exceptions=True)
+        self.tareas = []
+        self.cola = None
+
+    async def _worker(self):
+        while True:
+            funcion, args, futuro, encolado = await self.cola.get()
+            if futuro.done():
+                continue
+            comienzo = time.monotonic()
+            self.espera_total += comienzo - encolado
+            ESPERA_COLAS.observar(comienzo - encolado, etapa=self.nombre)
+            self.en_servicio += 1
+            try:
+                resultado = await funcion(*args)
+                if not futuro.done():
+                    futuro.set_result(resultado)
+            except Exception as e:
+                self.errores += 1
+                if not futuro.done():
+                    futuro.set_exception(e)
+            finally:
+                self.en_servicio -= 1
+                self.procesados += 1
+                self.servicio_total += time.monotonic() - comienzo
+
+    async def ejecutar(self, funcion, *args):
+        """
+        Encola `funcion(*args)` en la etapa y espera su resultado
+        """
+        if self.cola is None:
+            self.iniciar()
+        if self.max_cola is not None and self.cola.qsize() + self.en_servicio >= self.max_cola:
+            self.rechazados += 1
+            raise ColaLlena(f"Cola de {self.nombre} llena ({self.cola.qsize() + self.en_servicio}/{self.max_cola})")
+        futuro = asyncio.get_running_loop().create_future()
+        self.cola.put_nowait((funcion, args, futuro, time.monotonic()))
+        return await futuro
+
+    def metricas(self):
+        transcurrido = time.monotonic() - self.inicio if self.inicio else 0.0
+        return {
+            "workers": self.workers,
+            "en_cola": self.cola.qsize() if self.cola else 0,
+            "en_servicio": self.en_servicio,
+            "procesados": self.procesados,
+            "errores": self.errores,
+            "rechazados": self.rechazados,
+            "espera_media": self.espera_total / self.procesados if self.procesados else 0.0,
+            "servicio_medio": self.servicio_total / self.procesados if self.procesados else 0.0,
+            "utilizacion": self.servicio_total / (self.workers * transcurrido) if transcurrido else 0.0,
+        }
+
+
+class PlanificadorAudios:
+    """
+    Reparte la capacidad de procesamiento de audios entre chats.
+
+    Usa colas por chat con encolado justo por tiempo de inicio (SFQ): el coste
+    de cada trabajo es la duración del audio dividida por el peso del chat,
+    así que un grupo muy activo no acapara el pipeline. Dentro de cada chat
+    los audios se atienden en el orden en que llegaron, y ningún chat supera
+    `por_chat` trabajos simultáneos.
+    """
+
+    def __init__(self, concurrencia=2, por_chat=1, max_cola_chat=20, pesos=None):
+        self.concurrencia = concurrencia
+        self.por_chat = por_chat
+        self.max_cola_chat = max_cola_chat
+        self.pesos = pesos or {}
+        self.chats = {}
+        self.activos = 0
+        self.tiempo_virtual = 0.0
+        self._secuencia = itertools.count()
+
+    def _estado_chat(self, chat_id):
+        estado = self.chats.get(chat_id)
+        if estado is None:
+            estado = self.chats[chat_id] = {
+                "cola": [], "fin_virtual": 0.0, "activos": 0,
+                "completados": 0, "rechazados": 0, "segundos_audio": 0.0, "espera_total": 0.0,
+            }
+        return estado
+
+    async def ejecutar(self, chat_id, duracion, crear_corutina):
+        """
+        Encola un trabajo y espera a que termine. Lanza ColaLlena si el chat
+        ya tiene demasiados audios esperando.
+        """
+        chat_id = str(chat_id)
+        estado = self._estado_chat(chat_id)
+        if len(estado["cola"]) >= self.max_cola_chat:
+            estado["rechazados"] += 1
+            raise ColaLlena(f"Cola del chat {chat_id} llena ({len(estado['cola'])}/{self.max_cola_chat})")
+
+        futuro = asyncio.get_running_loop().create_future()
+        # La clave es el número de llegada: cada chat se atiende en orden (FIFO);
+        # la duración solo cuenta como coste frente a los demás chats
+        heapq.heappush(
+            estado["cola"],
+            (next(self._secuencia), duracion, time.monotonic(), crear_corutina, futuro),
+        )
+        self._despachar()
+        return await futuro
+
+    def _purgar(self):
+        """
+        Olvida los chats sin audios pendientes ni en curso cuya etiqueta ya
+        alcanzó el tiempo virtual: al volver partirían del mismo punto. Con el
+        planificador vacío el tiempo virtual avanza hasta la última etiqueta.
+        """
+        if not self.activos and not any(estado["cola"] for estado in self.chats.values()):
+            self.tiempo_virtual = max((estado["fin_virtual"] for estado in self.chats.values()), default=self.tiempo_virtual)
+        inactivos = [
+            chat_id for chat_id, estado in self.chats.items()
+            if not estado["cola"] and not estado["activos"] and estado["fin_virtual"] <= self.tiempo_virtual
+        ]
+        for chat_id in inactivos:
+            del self.chats[chat_id]
+
+    def _despachar(self):
+        self._purgar()
+        while self.activos < self.concurrencia:
+            elegido, etiqueta_min = None, None
+            for chat_id, estado in self.chats.items():
+                if not estado["cola"] or estado["activos"] >= self.por_chat:
+                    continue
+                etiqueta = max(self.tiempo_virtual, estado["fin_virtual"])
+                if etiqueta_min is None or etiqueta < etiqueta_min:
+                    elegido, etiqueta_min = chat_id, etiqueta
+            if elegido is None:
+                return
+
+            estado = self.chats[elegido]
+            _, duracion, encolado, crear_corutina, futuro = heapq.heappop(estado["cola"])
+            peso = self.pesos.get(elegido, 1.0)
+            # Coste mínimo de 1 s para que los audios sin duración también cuenten
+            estado["fin_virtual"] = etiqueta_min + max(duracion, 1) / peso
+            self.tiempo_virtual = etiqueta_min
+            estado["activos"] += 1
+            estado["espera_total"] += time.monotonic() - encolado
+            self.activos += 1
+
+            tarea = asyncio.ensure_future(crear_corutina())
+            tarea.add_done_callback(
+                lambda t, chat_id=elegido, duracion=duracion, futuro=futuro: self._terminar(t, chat_id, duracion, futuro)
+            )
+
+    def _terminar(self, tarea, chat_id, duracion, futuro):
+        estado = self.chats[chat_id]
+        estado["activos"] -= 1
+        estado["completados"] += 1
+        estado["segundos_audio"] += duracion
+        self.activos -= 1
+        if not futuro.done():
+            if tarea.cancelled():
+                futuro.cancel()
+            elif tarea.exception() is not None:
+                futuro.set_exception(tarea.exception())
+            else:
+                futuro.set_result(tarea.result())
+        self._despachar()
+
+    def metricas(self):
+        """
+        Estadísticas por chat, ordenadas por segundos de audio procesados
+        """
+        por_chat = {
+            chat_id: {
+                "en_cola": len(e["cola"]),
+                "activos": e["activos"],
+                "completados": e["completados"],
+                "rechazados": e["rechazados"],
+                "segundos_audio": e["segundos_audio"],
+                "espera_media": e["espera_total"] / (e["completados"] + e["activos"]) if e["completados"] + e["activos"] else 0.0,
+            }
+            for chat_id, e in self.chats.items()
+        }
+        return {
+            "activos": self.activos,
+            "concurrencia": self.concurrencia,
+            "en_cola": sum(len(e["cola"]) for e in self.chats.values()),
+            "chats": dict(sorted(por_chat.items(), key=lambda item: -item[1]["segundos_audio"])),
+        }
+
+
+class ProcesadorUpdatesPorChat(BaseUpdateProcessor):
+    """
+    Atiende updates de chats distintos en paralelo, pero los de un mismo chat
+    de uno en uno y en el orden en que llegan. Solo cubre a los handlers que
+    bloquean: los audios (block=False) se ordenan en el planificador.
+
+    El semáforo de PTB se toma antes de llegar aquí, así que los updates de un
+    chat ocupado que esperan su turno ocuparían todas las plazas. Por eso a PTB
+    se le da un límite que no se alcanza y el límite real se aplica con un
+    semáforo propio, tomado ya dentro del candado del chat.
+    """
+
+    SIN_LIMITE = 2 ** 31 - 1
+
+    def __init__(self, max_concurrentes):
+        super().__init__(self.SIN_LIMITE)
+        self.max_concurrentes = max_concurrentes
+        self.plazas = asyncio.Semaphore(max_concurrentes)
+        self.candados = {}  # chat_id -> [asyncio.Lock, updates esperando o en curso]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self.plazas:
+                await coroutine
+            return
+        entrada = self.candados.setdefault(chat.id, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0], self.plazas:
+                await coroutine
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self.candados[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class LimitadorTasa:
+    """
+    Token bucket asíncrono: `tasa` permisos por segundo con ráfagas de hasta `rafaga`
+    """
+
+    def __init__(self, tasa, rafaga=1):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.tokens = rafaga
+        self.ultimo = time.monotonic()
+        self._lock = None
+
+    async def esperar(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                ahora = time.monotonic()
+                self.tokens = min(self.rafaga, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.tasa)
+
+
+class GestorEnvios:
+    """
+    Capa de salida hacia Telegram. Cada envío espera turno en un token bucket
+    global y en otro por chat; si Telegram responde RetryAfter (429) el chat
+    queda en pausa el tiempo indicado y el envío se reintenta.
+
+    Con `cupos` (la cola de trabajos del modo workers) los buckets y las
+    pausas viven en su base SQLite, compartidos por el bot y todos los
+    workers; `en_hilo` ejecuta esas llamadas fuera del event loop.
+    """
+
+    MAX_CHATS = 1000
+
+    def __init__(self, por_segundo, grupo_por_minuto, rafaga_chat, reintentos, cupos=None, en_hilo=None):
+        self.por_segundo = por_segundo
+        self.limitador_global = LimitadorTasa(por_segundo, max(1, int(por_segundo)))
+        self.cupos = cupos
+        self.en_hilo = en_hilo
+        self.grupo_por_minuto = grupo_por_minuto
+        self.rafaga_chat = rafaga_chat
+        self.reintentos = reintentos
+        self.chats = {}  # chat_id -> LimitadorTasa
+        self.pausas = {}  # chat_id -> instante hasta el que no se envía
+        self.envios = 0
+        self.retry_after = 0
+        self.espera_retry_after = 0.0
+        self.fallidos = 0
+
+    def _tasa_chat(self, chat_id):
+        # Los ids de grupos y canales son negativos
+        return self.grupo_por_minuto / 60 if chat_id.startswith("-") else 1
+
+    def _limitador(self, chat_id):
+        limitador = self.chats.get(chat_id)
+        if limitador is None:
+            if len(self.chats) >= self.MAX_CHATS:
+                self.purgar()
+            limitador = self.chats[chat_id] = LimitadorTasa(self._tasa_chat(chat_id), self.rafaga_chat)
+        return limitador
+
+    async def _esperar_turno(self, chat_id):
+        if self.cupos is None:
+            pausa = self.pausas.get(chat_id, 0) - time.monotonic()
+            if pausa > 0:
+                await asyncio.sleep(pausa)
+            await self._limitador(chat_id).esperar()
+            await self.limitador_global.esperar()
+            return
+        cupos = [
+            (f"chat:{chat_id}", self._tasa_chat(chat_id), self.rafaga_chat),
+            ("global", self.por_segundo, max(1, int(self.por_segundo))),
+        ]
+        while espera := await self.en_hilo(self.cupos.reservar_envio, cupos):
+            await asyncio.sleep(espera)
+
+    async def _pausar(self, chat_id, espera):
+        if len(self.pausas) >= self.MAX_CHATS:
+            ahora = time.monotonic()
+            self.pausas = {c: t for c, t in self.pausas.items() if t > ahora}
+        self.pausas[chat_id] = max(self.pausas.get(chat_id, 0), time.monotonic() + espera)
+        if self.cupos is not None:
+            await self.en_hilo(self.cupos.pausar_envios, f"chat:{chat_id}", espera)
+
+    def purgar(self, inactividad=600):
+        limite = time.monotonic() - inactividad
+        for chat_id in [c for c, l in self.chats.items() if l.ultimo < limite]:
+            del self.chats[chat_id]
+            self.pausas.pop(chat_id, None)
+
+    async def enviar(self, chat_id, funcion, /, *args, **kwargs):
+        """
+        Llama a `funcion(*args, **kwargs)` (reply_text, send_voice, edit_text...)
+        respetando los límites del chat y global
+        """
+        chat_id = str(chat_id)
+        for intento in range(self.reintentos + 1):
+            await self._esperar_turno(chat_id)
+            try:
+                resultado = await funcion(*args, **kwargs)
+            except RetryAfter as e:
+                espera = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                self.retry_after += 1
+                self.espera_retry_after += espera
+                await self._pausar(chat_id, espera)
+                if intento == self.reintentos:
+                    self.fallidos += 1
+                    raise
+                log.warning(f"⚠️ Telegram pide esperar {espera:.0f}s en el chat {chat_id} (intento {intento + 1})")
+                continue
+            self.envios += 1
+            return resultado
+
+    def metricas(self):
+        return {
+            "envios": self.envios,
+            "retry_after": self.retry_after,
+            "espera_retry_after": self.espera_retry_after,
+            "fallidos": self.fallidos,
+            "chats_en_pausa": sum(1 for t in self.pausas.values() if t > time.monotonic()),
+        }
+
+
+class CacheMiembros:
+    """
+    Caché con TTL de get_chat_member. Se mantiene al día con las actualizaciones
+    de ChatMemberHandler, agrupa consultas simultáneas al mismo usuario y limita
+    las peticiones a la Bot API.
+    """
+
+    def __init__(self, ttl, limitador):
+        self.ttl = ttl
+        self.limitador = limitador
+        self.entradas = {}  # (chat_id, user_id) -> (chat_member, instante)
+        self.en_vuelo = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.peticiones = 0
+
+    def actualizar(self, chat_id, chat_member):
+        self.entradas[(str(chat_id), str(chat_member.user.id))] = (chat_member, time.monotonic())
+
+    def purgar(self):
+        limite = time.monotonic() - self.ttl
+        for clave in [c for c, (_, t) in self.entradas.items() if t < limite]:
+            del self.entradas[clave]
+
+    REINTENTOS = 3
+
+    async def _consultar(self, bot, clave):
+        for intento in range(self.REINTENTOS + 1):
+            await self.limitador.esperar()
+            self.peticiones += 1
+            try:
+                chat_member = await bot.get_chat_member(int(clave[0]), int(clave[1]))
+                break
+            except RetryAfter as e:
+                if intento == self.REINTENTOS:
+                    raise
+                espera = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                log.warning(f"⚠️ Telegram pide esperar {espera:.0f}s antes de consultar miembros")
+                await asyncio.sleep(espera)
+        self.entradas[clave] = (chat_member, time.monotonic())
+        return chat_member
+
+    async def obtener(self, bot, chat_id, user_id):
+        clave = (str(chat_id), str(user_id))
+        entrada = self.entradas.get(clave)
+        if entrada and time.monotonic() - entrada[1] < self.ttl:
+            self.aciertos += 1
+            return entrada[0]
+
+        self.fallos += 1
+        futuro = self.en_vuelo.get(clave)
+        if futuro is None:
+            futuro = asyncio.ensure_future(self._consultar(bot, clave))
+            self.en_vuelo[clave] = futuro
+            futuro.add_done_callback(lambda _: self.en_vuelo.pop(clave, None))
+        return await asyncio.shield(futuro)
+
+    def metricas(self):
+        return {
+            "entradas": len(self.entradas),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "peticiones": self.peticiones,
+        }
+
+
+class ColaLlena(Exception):
+    """Se lanza cuando un pool de inferencia no admite más trabajos"""
+
+
+def _transcribir_en_worker(audio, opciones=None, duracion=None):
+    """
+    Ejecuta el motor ASR dentro de un worker del pool (hilo o proceso hijo).
+    `audio` puede ser una ruta o un array float32 a 16 kHz; la duración
+    permite a la política elegir el tamaño de modelo.
+    """
+    if politica_asr is None:
+        # Proceso hijo creado antes de terminar la carga en el padre
+        cargar_asr()
+    return politica_asr.transcribir(audio, opciones, duracion)
+
+
+def _transcribir_lote_en_worker(audios, opciones, duraciones):
+    """
+    Como _transcribir_en_worker para un lote de audios
+    """
+    if politica_asr is None:
+        cargar_asr()
+    return politica_asr.transcribir_lote(audios, opciones, duraciones)
+
+
+class PoolTranscripcion:
+    """
+    Ejecuta las transcripciones fuera del event loop con una cola acotada.
+    En modo "process" cada proceso hijo hereda los modelos ya cargados.
+
+    Con `lote_max` > 1 las peticiones se agrupan en micro-lotes: el primer
+    audio espera como mucho `lote_espera` segundos a que lleguen otros y el
+    lote se despacha al llenarse o al vencer el plazo. Si todos los workers
+    están ocupados el lote sigue creciendo hasta que uno quede libre.
+    """
+
+    def __init__(self, workers=1, max_cola=8, tipo="thread", lote_max=1, lote_espera=0.05):
+        if tipo == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self.workers = workers
+        self.max_cola = max_cola
+        self.tipo = tipo
+        self.en_curso = 0
+        self.completados = 0
+        self.rechazados = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.lote_max = lote_max
+        self.lote_espera = lote_espera
+        self.lote = []  # (audio, opciones, duración, encolado, futuro)
+        self.temporizador = None
+        self.lotes_en_curso = 0
+        self.lotes = 0
+        self.audios_en_lotes = 0
+
+    def _despachar_lote(self):
+        if self.temporizador is not None:
+            self.temporizador.cancel()
+            self.temporizador = None
+        if not self.lote or self.lotes_en_curso >= self.workers:
+            # Al terminar el lote en curso se vuelve a intentar
+            return
+        lote, self.lote = self.lote[:self.lote_max], self.lote[self.lote_max:]
+        self.lotes_en_curso += 1
+        self.lotes += 1
+        self.audios_en_lotes += len(lote)
+        despacho = time.monotonic()
+        ejecucion = asyncio.get_running_loop().run_in_executor(
+            self.executor, _transcribir_lote_en_worker,
+            [audio for audio, *_ in lote], [t[1] for t in lote], [t[2] for t in lote],
+        )
+        ejecucion.add_done_callback(lambda e: self._repartir_lote(lote, despacho, e))
+        log.debug("📦 Lote de %s transcripciones (%s esperando)", len(lote), len(self.lote))
+
+    def _repartir_lote(self, lote, despacho, ejecucion):
+        self.lotes_en_curso -= 1
+        error = ejecucion.exception() if not ejecucion.cancelled() else asyncio.CancelledError()
+        for i, (_, _, _, encolado, futuro) in enumerate(lote):
+            if futuro.done():
+                continue
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result((despacho - encolado, ejecucion.result()[i]))
+        if self.lote:
+            self._despachar_lote()
+
+    async def _transcribir_en_lote(self, audio, opciones, duracion, encolado):
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self.lote.append((audio, opciones, duracion, encolado, futuro))
+        if len(self.lote) >= self.lote_max:
+            self._despachar_lote()
+        elif self.temporizador is None:
+            self.temporizador = loop.call_later(self.lote_espera, self._despachar_lote)
+        return await futuro
+
+    async def transcribir(self, audio, opciones=None, duracion=None):
+        """
+        Encola una transcripción y espera su resultado sin bloquear el event loop.
+        Lanza ColaLlena si ya hay demasiados trabajos pendientes.
+        """
+        if self.en_curso >= self.max_cola:
+            self.rechazados += 1
+            raise ColaLlena(f"Cola de transcripción llena ({self.en_curso}/{self.max_cola})")
+
+        self.en_curso += 1
+        encolado = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            if self.lote_max > 1:
+                espera, resultado = await self._transcribir_en_lote(audio, opciones, duracion, encolado)
+            elif self.tipo == "process":
+                # En modo proceso no se puede medir el inicio dentro del hijo,
+                # así que la espera incluye el tiempo de transcripción
+                resultado = await loop.run_in_executor(self.executor, _transcribir_en_worker, audio, opciones, duracion)
+                espera = time.monotonic() - encolado
+            else:
+                def tarea():
+                    return time.monotonic() - encolado, _transcribir_en_worker(audio, opciones, duracion)
+                espera, resultado = await loop.run_in_executor(self.executor, tarea)
+        finally:
+            self.en_curso -= 1
+
+        self.completados += 1
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        log.debug("⏱️ Espera en cola de transcripción: %.2fs (pendientes: %s)", espera, self.en_curso)
+        return resultado
+
+    def metricas(self):
+        """
+        Devuelve las métricas actuales de la cola
+        """
+        return {
+            "tipo": self.tipo,
+            "workers": self.workers,
+            "en_cola": max(self.en_curso - self.workers, 0),
+            "en_curso": self.en_curso,
+            "max_cola": self.max_cola,
+            "completados": self.completados,
+            "rechazados": self.rechazados,
+            "espera_media": self.espera_total / self.completados if self.completados else 0.0,
+            "espera_max": self.espera_max,
+            "lote_max": self.lote_max,
+            "lotes": self.lotes,
+            "lote_medio": self.audios_en_lotes / self.lotes if self.lotes else 0.0,
+        }
+
+
+planificador_audios = PlanificadorAudios(
+    PLANIFICADOR_CONCURRENCIA, PLANIFICADOR_POR_CHAT, PLANIFICADOR_COLA_POR_CHAT, PESOS_CHATS
+)
+# Con micro-lotes la etapa y el pool deben dejar pasar a la vez un lote completo por worker
+cola_transcripcion_max = max(WHISPER_COLA_MAX, WHISPER_WORKERS * ASR_LOTE_MAX)
+pool_transcripcion = PoolTranscripcion(
+    WHISPER_WORKERS, cola_transcripcion_max, WHISPER_POOL, ASR_LOTE_MAX, ASR_LOTE_ESPERA_MS / 1000
+)
+cola_trabajos = ColaTrabajos(COLA_TRABAJOS_DB, TRABAJO_REINTENTOS, TRABAJO_VISIBILIDAD_S) if MODO_WORKERS else None
+# Un solo hilo para la cola de trabajos: SQLite puede esperar un bloqueo hasta
+# 30 s y no debe hacerlo en el event loop, y así la conexión no se usa desde dos hilos
+executor_cola = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cola")
+conteos_trabajos = {}  # última lectura de la cola, para las métricas
+
+async def en_cola(funcion, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor_cola, funcion, *args)
+
+async def leer_cola_trabajos():
+    conteos_trabajos.update(await en_cola(cola_trabajos.metricas))
+    return conteos_trabajos
+
+async def vigilar_cola_trabajos(intervalo=15):
+    """
+    Refresca cada `intervalo` segundos los conteos de la cola que exportan las métricas
+    """
+    while True:
+        try:
+            await leer_cola_trabajos()
+        except Exception as e:
+            log.warning(f"⚠️ No se pudo leer la cola de trabajos: {e}")
+        await asyncio.sleep(intervalo)
+etapas_pipeline = {
+    "descarga": EtapaPipeline("descarga", ETAPA_DESCARGA_WORKERS),
+    "transcripcion": EtapaPipeline("transcripción", WHISPER_WORKERS * ASR_LOTE_MAX, cola_transcripcion_max),
+    "traduccion": EtapaPipeline("traducción", ETAPA_TRADUCCION_WORKERS),
+    "sintesis": EtapaPipeline("síntesis", ETAPA_SINTESIS_WORKERS),
+}
+decodificador = Decodificador(DECODIFICADOR, DECODIFICADOR_POOL, MUESTREO_WHISPER)
+# En modo workers los límites de envío se comparten en la base de la cola
+gestor_envios = GestorEnvios(
+    ENVIOS_POR_SEGUNDO, ENVIOS_GRUPO_POR_MINUTO, ENVIOS_RAFAGA_CHAT, ENVIOS_REINTENTOS, cola_trabajos, en_cola
+)
+cache_miembros = CacheMiembros(CACHE_MIEMBROS_TTL, LimitadorTasa(MIEMBROS_POR_SEGUNDO, max(1, int(MIEMBROS_POR_SEGUNDO))))
+cache_transcripciones = CacheLRU(
+    "transcripciones",
+    int(CACHE_TRANSCRIPCION_MB * 1024 * 1024),
+    CACHE_TRANSCRIPCION_TTL,
+    CACHE_TRANSCRIPCION_DB or None,
+)
+cache_traducciones = CacheLRU(
+    "traducciones",
+    int(CACHE_TRADUCCION_MB * 1024 * 1024),
+    CACHE_TRADUCCION_TTL,
+    CACHE_TRADUCCION_DB or None,
+)
+
+cache_tts = CacheLRU("tts", int(CACHE_TTS_MB * 1024 * 1024), CACHE_TTS_TTL, CACHE_TTS_DB or None)
+cache_tts_file_ids = CacheLRU("tts_file_ids", 1024 * 1024, None, CACHE_TTS_DB or None)
+caches = (cache_transcripciones, cache_traducciones, cache_tts, cache_tts_file_ids)
+# XTTS no es seguro entre hilos: un único worker dedicado
+executor_tts = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+
+def clave_traduccion(texto, idioma_origen, idioma_destino):
+    """
+    Clave de caché: texto normalizado + idiomas + modelo de Ollama
+    """
+    normalizado = " ".join(unicodedata.normalize("NFC", texto).casefold().split())
+    return hashlib.sha256(
+        f"{OLLAMA_MODEL}\0{idioma_origen}\0{idioma_destino}\0{normalizado}".encode("utf-8")
+    ).hexdigest()
+
 TEXTO_INSTRUCCIONES_BASICAS = (
     "**⚙️ Para empezar, cada miembro debe hacer esto:**\n"
     "1. Usen el comando `/idioma` seguido del código de su idioma. Por ejemplo, si hablan español, escriban:\n"
@@ -49,38 +1128,484 @@ TEXTO_INSTRUCCIONES_BASICAS = (
     "2. Para ver una lista de idiomas disponibles, usen el comando `/idiomas_disponibles`."
 )
 
-try:
-    tts = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", gpu=True)
-    
-    # Obtener speakers disponibles y seleccionar uno
-    speakers = get_available_speakers(tts)
-    if speakers:
-        tts_speaker = speakers[0]  # Usar el primer speaker disponible
-        print(f"✅ TTS inicializado correctamente con speaker: {tts_speaker}")
-    else:
-        print("❌ No se pudieron obtener speakers, TTS deshabilitado")
+# --- Carga diferida de modelos ---
+
+# "pendiente", "cargando", "listo", "error" o "desactivado"
+estado_modelos = {
+    "asr": "pendiente" if ASR_ACTIVADO else "desactivado",
+    "tts": "pendiente" if TTS_ACTIVADO else "desactivado",
+}
+_eventos_modelos = {}
+_tarea_carga_modelos = None
+
+def registrar_fase(fase, inicio):
+    log.info(f"⏱️ Arranque: {fase} en {time.monotonic() - inicio:.2f}s")
+
+def evento_modelo(nombre):
+    """Evento que se activa cuando termina la carga (con éxito o no) de un modelo"""
+    if nombre not in _eventos_modelos:
+        _eventos_modelos[nombre] = asyncio.Event()
+    return _eventos_modelos[nombre]
+
+def cargar_asr():
+    """
+    Carga el motor y los modelos de reconocimiento de voz
+    """
+    global motor_asr, politica_asr
+    inicio = time.monotonic()
+    motor = crear_motor(ASR_BACKEND, ASR_HILOS, ASR_COMPUTE_TYPE)
+    politica = PoliticaModelos(
+        motor, ASR_MODELO, ASR_MODELO_CORTO or None, ASR_DURACION_CORTO_S, ASR_CONFIANZA_MIN
+    )
+    politica.precargar()
+    motor_asr, politica_asr = motor, politica
+    registrar_fase(f"modelo ASR ({ASR_BACKEND}:{ASR_MODELO})", inicio)
+    return True
+
+def cargar_tts():
+    """
+    Carga XTTS v2 y elige el speaker. Devuelve False si el bot seguirá sin audio.
+    """
+    global tts, tts_speaker
+    inicio = time.monotonic()
+    log.info("Inicializando TTS...")
+    try:
+        from TTS.api import TTS
+        instancia = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", gpu=True)
+
+        # Obtener speakers disponibles y seleccionar uno
+        speakers = get_available_speakers(instancia)
+        if speakers:
+            tts_speaker = speakers[0]  # Usar el primer speaker disponible
+            tts = instancia
+            log.info(f"✅ TTS inicializado correctamente con speaker: {tts_speaker}")
+        else:
+            log.error("❌ No se pudieron obtener speakers, TTS deshabilitado")
+
+    except Exception as e:
+        log.error(f"❌ Error crítico al inicializar TTS: {e}")
+        log.warning("El bot funcionará sin la capacidad de enviar audios.")
         tts = None
-        
-except Exception as e:
-    print(f"❌ Error crítico al inicializar TTS: {e}")
-    print("El bot funcionará sin la capacidad de enviar audios.")
-    tts = None
-    tts_speaker = None
-    
-# Archivo JSON y estructura base
+        tts_speaker = None
+
+    registrar_fase("modelo TTS", inicio)
+    return tts is not None
+
+async def cargar_modelos():
+    """
+    Carga los modelos activados en un hilo aparte, sin bloquear el event loop
+    """
+    loop = asyncio.get_running_loop()
+    for nombre, cargar in (("asr", cargar_asr), ("tts", cargar_tts)):
+        if estado_modelos[nombre] == "desactivado":
+            evento_modelo(nombre).set()
+            continue
+        estado_modelos[nombre] = "cargando"
+        try:
+            listo = await loop.run_in_executor(None, cargar)
+            estado_modelos[nombre] = "listo" if listo else "error"
+        except Exception as e:
+            log.error(f"❌ Error cargando el modelo {nombre}: {e}")
+            estado_modelos[nombre] = "error"
+        evento_modelo(nombre).set()
+    registrar_fase("bot listo (modelos cargados)", INICIO_PROCESO)
+
+def iniciar_carga_modelos():
+    """
+    Lanza la carga de modelos una sola vez
+    """
+    global _tarea_carga_modelos
+    if _tarea_carga_modelos is None:
+        _tarea_carga_modelos = asyncio.ensure_future(cargar_modelos())
+
+async def esperar_asr(update):
+    """
+    Espera a que el ASR esté listo, avisando al usuario si todavía se está
+    cargando. Devuelve False si la transcripción no está disponible.
+    """
+    if estado_modelos["asr"] == "listo":
+        return True
+    if estado_modelos["asr"] in ("pendiente", "cargando"):
+        iniciar_carga_modelos()
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "🔥 Calentando motores... tu audio se procesará en cuanto el modelo esté listo."
+        )
+        await evento_modelo("asr").wait()
+    if estado_modelos["asr"] != "listo":
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "❌ La transcripción no está disponible en este momento."
+        )
+        return False
+    return True
+
+# Almacén de idiomas (SQLite) y JSON antiguo para la importación inicial
 ARCHIVO_IDIOMAS = "idiomas.json"
-idiomas = {}
+ARCHIVO_IDIOMAS_DB = os.getenv("IDIOMAS_DB", "idiomas.db")
+# Intervalo mínimo entre escrituras a disco de los idiomas (agrupa ráfagas de cambios)
+ESCRITURA_IDIOMAS_MS = int(os.getenv("ESCRITURA_IDIOMAS_MS", "500"))
 
-if os.path.exists(ARCHIVO_IDIOMAS):
-    try:
-        with open(ARCHIVO_IDIOMAS, "r") as f:
-            idiomas = json.load(f)
-    except json.JSONDecodeError:
-        idiomas = {}
+class IndiceIdiomas:
+    """
+    Índice chat -> idioma -> {user_id} que RepositorioIdiomas actualiza en cada
+    escritura. Enrutar un audio cuesta O(idiomas del chat): las rutas por
+    idioma de origen y las menciones ya resueltas se guardan y solo se
+    recalculan cuando cambia el chat (o caducan, en el caso de las menciones).
+    """
+
+    def __init__(self, normalizar=str, ttl_menciones=600):
+        self.normalizar = normalizar
+        self.ttl_menciones = ttl_menciones
+        self.chats = {}  # chat_id -> {idioma: set(user_ids)}
+        self.rutas = {}  # chat_id -> {idioma_origen: {idioma_destino: tupla de user_ids}}
+        self.menciones = {}  # chat_id -> {idioma: (user_ids, nombres, instante)}
+        self.aciertos_rutas = 0
+        self.aciertos_menciones = 0
+
+    def _invalidar(self, chat_id, idioma):
+        self.rutas.pop(chat_id, None)
+        menciones_chat = self.menciones.get(chat_id)
+        if menciones_chat:
+            menciones_chat.pop(idioma, None)
+
+    def agregar(self, chat_id, user_id, idioma):
+        idioma = self.normalizar(idioma)
+        self.chats.setdefault(chat_id, {}).setdefault(idioma, set()).add(user_id)
+        self._invalidar(chat_id, idioma)
+
+    def quitar(self, chat_id, user_id, idioma):
+        idioma = self.normalizar(idioma)
+        idiomas = self.chats.get(chat_id)
+        usuarios = idiomas.get(idioma) if idiomas else None
+        if usuarios is None:
+            return
+        usuarios.discard(user_id)
+        if not usuarios:
+            del idiomas[idioma]
+        if not idiomas:
+            del self.chats[chat_id]
+        self._invalidar(chat_id, idioma)
+
+    def quitar_chat(self, chat_id):
+        self.chats.pop(chat_id, None)
+        self.rutas.pop(chat_id, None)
+        self.menciones.pop(chat_id, None)
+
+    @staticmethod
+    def construir(memoria, normalizar):
+        chats = {}
+        for chat_id, usuarios in memoria.items():
+            for user_id, idioma in usuarios.items():
+                chats.setdefault(chat_id, {}).setdefault(normalizar(idioma), set()).add(user_id)
+        return chats
+
+    def reconstruir(self, memoria):
+        self.chats = self.construir(memoria, self.normalizar)
+        self.rutas = {}
+        self.menciones = {}
+
+    def idiomas_chat(self, chat_id):
+        """{idioma: set(user_ids)} de un chat (no modificar)"""
+        return self.chats.get(chat_id) or {}
+
+    def destinos(self, chat_id, idioma_origen):
+        """
+        {idioma: user_ids} de los idiomas del chat distintos de `idioma_origen`
+        (ya normalizado). El diccionario se comparte entre llamadas: no modificar.
+        """
+        rutas_chat = self.rutas.get(chat_id)
+        if rutas_chat is None:
+            rutas_chat = self.rutas[chat_id] = {}
+        ruta = rutas_chat.get(idioma_origen)
+        if ruta is not None:
+            self.aciertos_rutas += 1
+            return ruta
+        ruta = rutas_chat[idioma_origen] = {
+            idioma: tuple(usuarios)
+            for idioma, usuarios in self.idiomas_chat(chat_id).items()
+            if idioma and idioma != idioma_origen
+        }
+        return ruta
+
+    def menciones_guardadas(self, chat_id, idioma, user_ids):
+        menciones_chat = self.menciones.get(chat_id)
+        entrada = menciones_chat.get(idioma) if menciones_chat else None
+        if entrada is None or entrada[0] != user_ids or time.monotonic() - entrada[2] >= self.ttl_menciones:
+            return None
+        self.aciertos_menciones += 1
+        return entrada[1]
+
+    def guardar_menciones(self, chat_id, idioma, user_ids, nombres):
+        self.menciones.setdefault(chat_id, {})[idioma] = (user_ids, nombres, time.monotonic())
+
+
+class RepositorioIdiomas:
+    """
+    Guarda el idioma de cada usuario por chat en SQLite.
+    Las lecturas se sirven desde memoria y las escrituras se acumulan y se
+    vuelcan en una sola transacción como mucho cada `intervalo_ms`, de modo
+    que una ráfaga de cambios se convierte en una única escritura atómica.
+    Sin escritor en marcha (scripts, herramientas) se escribe al momento.
+    """
+
+    def __init__(self, ruta_db, intervalo_ms=500, indice=None):
+        self.db = sqlite3.connect(ruta_db, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS idiomas ("
+                "chat_id TEXT NOT NULL, user_id TEXT NOT NULL, idioma TEXT NOT NULL, "
+                "PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID"
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+
+        self.memoria = {}  # chat_id -> {user_id: idioma}
+        for chat_id, user_id, idioma in self.db.execute("SELECT chat_id, user_id, idioma FROM idiomas"):
+            self.memoria.setdefault(chat_id, {})[user_id] = idioma
+        self.indice = indice or IndiceIdiomas()
+        self.indice.reconstruir(self.memoria)
+
+        self.intervalo = intervalo_ms / 1000
+        self.pendientes = {}  # (chat_id, user_id) -> idioma, o None para borrar
+        self.en_escritura = {}  # lote que se está volcando ahora mismo
+        self.sucio = None
+        self.tarea_escritor = None
+        self.detenido = False
+        self.actualizaciones = 0
+        self.coalescidas = 0
+        self.escrituras = 0
+        self.filas_escritas = 0
+        self.verificaciones = 0
+        self.inconsistencias = 0
+
+    # --- Lecturas (desde memoria) ---
+
+    def obtener_idioma(self, chat_id, user_id):
+        return self.memoria.get(str(chat_id), {}).get(str(user_id))
+
+    def idiomas_chat(self, chat_id):
+        """Devuelve {user_id: idioma} de un chat"""
+        return dict(self.memoria.get(str(chat_id), {}))
+
+    def existe_chat(self, chat_id):
+        return str(chat_id) in self.memoria
+
+    def chats(self):
+        return list(self.memoria)
+
+    # --- Escrituras (memoria al instante, disco diferido) ---
+
+    def _marcar(self, chat_id, user_id, idioma):
+        clave = (chat_id, user_id)
+        if clave in self.pendientes:
+            self.coalescidas += 1
+        self.pendientes[clave] = idioma
+        self.actualizaciones += 1
+        if self.sucio is None:
+            self.vaciar()
+        else:
+            self.sucio.set()
+
+    def guardar_idioma(self, chat_id, user_id, idioma):
+        chat_id, user_id = str(chat_id), str(user_id)
+        usuarios = self.memoria.setdefault(chat_id, {})
+        if user_id in usuarios:
+            self.indice.quitar(chat_id, user_id, usuarios[user_id])
+        usuarios[user_id] = idioma
+        self.indice.agregar(chat_id, user_id, idioma)
+        self._marcar(chat_id, user_id, idioma)
+
+    def eliminar_usuario(self, chat_id, user_id):
+        chat_id, user_id = str(chat_id), str(user_id)
+        usuarios = self.memoria.get(chat_id)
+        if not usuarios or user_id not in usuarios:
+            return False
+        self.indice.quitar(chat_id, user_id, usuarios.pop(user_id))
+        if not usuarios:
+            del self.memoria[chat_id]
+        self._marcar(chat_id, user_id, None)
+        return True
+
+    def eliminar_chat(self, chat_id):
+        chat_id = str(chat_id)
+        usuarios = self.memoria.pop(chat_id, None)
+        if not usuarios:
+            return False
+        self.indice.quitar_chat(chat_id)
+        for user_id in usuarios:
+            self._marcar(chat_id, user_id, None)
+        return True
+
+    def migrar_chat(self, chat_id_antiguo, chat_id_nuevo):
+        chat_id_antiguo, chat_id_nuevo = str(chat_id_antiguo), str(chat_id_nuevo)
+        usuarios = self.memoria.pop(chat_id_antiguo, None)
+        if not usuarios:
+            return False
+        self.indice.quitar_chat(chat_id_antiguo)
+        destino = self.memoria.setdefault(chat_id_nuevo, {})
+        for user_id, idioma in usuarios.items():
+            if user_id in destino:
+                self.indice.quitar(chat_id_nuevo, user_id, destino[user_id])
+            destino[user_id] = idioma
+            self.indice.agregar(chat_id_nuevo, user_id, idioma)
+            self._marcar(chat_id_antiguo, user_id, None)
+            self._marcar(chat_id_nuevo, user_id, idioma)
+        return True
+
+    # --- Volcado a disco ---
+
+    def _tomar_pendientes(self):
+        lote, self.pendientes = self.pendientes, {}
+        return lote
+
+    def _escribir(self, lote):
+        if not lote:
+            return
+        try:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO idiomas VALUES (?, ?, ?)",
+                    [(c, u, i) for (c, u), i in lote.items() if i is not None],
+                )
+                self.db.executemany(
+                    "DELETE FROM idiomas WHERE chat_id = ? AND user_id = ?",
+                    [clave for clave, i in lote.items() if i is None],
+                )
+        except Exception:
+            # Devolver el lote a la cola sin pisar cambios más recientes
+            for clave, idioma in lote.items():
+                self.pendientes.setdefault(clave, idioma)
+            raise
+        self.escrituras += 1
+        self.filas_escritas += len(lote)
+
+    def vaciar(self):
+        """Escribe ya todos los cambios pendientes"""
+        self._escribir(self._tomar_pendientes())
+
+    async def _escritor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.sucio.wait()
+            if self.detenido:
+                return
+            await asyncio.sleep(self.intervalo)
+            if self.detenido:
+                return
+            self.sucio.clear()
+            lote = self.en_escritura = self._tomar_pendientes()
+            try:
+                await loop.run_in_executor(None, self._escribir, lote)
+            except Exception as e:
+                log.error(f"❌ Error guardando idiomas, se reintentará: {e}")
+                self.sucio.set()
+            finally:
+                self.en_escritura = {}
+
+    def iniciar_escritor(self):
+        """Arranca el volcado diferido en el event loop activo"""
+        self.sucio = asyncio.Event()
+        self.detenido = False
+        if self.pendientes:
+            self.sucio.set()
+        self.tarea_escritor = asyncio.create_task(self._escritor())
+
+    async def detener_escritor(self):
+        """
+        Detiene el volcado diferido y escribe lo que quede pendiente. No se
+        cancela la tarea: se espera a que termine el lote que esté escribiendo
+        su hilo, para que ese lote (más antiguo) no se confirme después del final.
+        """
+        if self.tarea_escritor:
+            self.detenido = True
+            self.sucio.set()
+            await self.tarea_escritor
+        self.tarea_escritor = None
+        self.sucio = None
+        self.vaciar()
+        log.debug("💾 Idiomas guardados (%s escrituras, %s cambios agrupados)", self.escrituras, self.coalescidas)
+
+    def verificar_indice(self, reparar=True):
+        """
+        Comprueba que la memoria y el índice coinciden con lo guardado en SQLite
+        más los cambios aún sin volcar. Devuelve las diferencias encontradas y,
+        si `reparar`, reconstruye memoria e índice a partir de lo guardado.
+        """
+        guardado = {}
+        for chat_id, user_id, idioma in self.db.execute("SELECT chat_id, user_id, idioma FROM idiomas"):
+            guardado.setdefault(chat_id, {})[user_id] = idioma
+        for cambios in (self.en_escritura, self.pendientes):
+            for (chat_id, user_id), idioma in cambios.items():
+                if idioma is None:
+                    guardado.get(chat_id, {}).pop(user_id, None)
+                else:
+                    guardado.setdefault(chat_id, {})[user_id] = idioma
+        guardado = {chat_id: usuarios for chat_id, usuarios in guardado.items() if usuarios}
+
+        diferencias = [
+            f"memoria del chat {chat_id}"
+            for chat_id in set(guardado) | set(self.memoria)
+            if guardado.get(chat_id) != self.memoria.get(chat_id)
+        ]
+        indice_esperado = IndiceIdiomas.construir(guardado, self.indice.normalizar)
+        diferencias += [
+            f"índice del chat {chat_id}"
+            for chat_id in set(indice_esperado) | set(self.indice.chats)
+            if indice_esperado.get(chat_id) != self.indice.chats.get(chat_id)
+        ]
 
-def guardar_idiomas():
-    with open(ARCHIVO_IDIOMAS, "w") as f:
-        json.dump(idiomas, f)
+        self.verificaciones += 1
+        if diferencias:
+            self.inconsistencias += len(diferencias)
+            log.warning(f"⚠️ Índice de idiomas inconsistente: {', '.join(sorted(diferencias)[:10])}")
+            if reparar:
+                self.memoria = guardado
+                self.indice.reconstruir(guardado)
+        return diferencias
+
+    def metricas(self):
+        return {
+            "chats": len(self.memoria),
+            "idiomas_indexados": sum(len(idiomas) for idiomas in self.indice.chats.values()),
+            "aciertos_rutas": self.indice.aciertos_rutas,
+            "aciertos_menciones": self.indice.aciertos_menciones,
+            "verificaciones": self.verificaciones,
+            "inconsistencias": self.inconsistencias,
+            "actualizaciones": self.actualizaciones,
+            "coalescidas": self.coalescidas,
+            "escrituras": self.escrituras,
+            "filas_escritas": self.filas_escritas,
+            "pendientes": len(self.pendientes),
+        }
+
+    def importar_json(self, ruta):
+        """
+        Importa una sola vez el antiguo idiomas.json. Devuelve cuántos usuarios se importaron.
+        """
+        if self.db.execute("SELECT 1 FROM meta WHERE clave = 'json_importado'").fetchone():
+            return 0
+        datos = {}
+        if os.path.exists(ruta):
+            try:
+                with open(ruta, "r") as f:
+                    datos = json.load(f)
+            except json.JSONDecodeError:
+                datos = {}
+
+        filas = [
+            (str(chat_id), str(user_id), idioma)
+            for chat_id, usuarios in datos.items()
+            for user_id, idioma in usuarios.items()
+        ]
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO idiomas VALUES (?, ?, ?)", filas)
+            self.db.execute("INSERT INTO meta VALUES ('json_importado', ?)", (str(time.time()),))
+        for chat_id, user_id, idioma in filas:
+            usuarios = self.memoria.setdefault(chat_id, {})
+            if user_id not in usuarios:
+                usuarios[user_id] = idioma
+                self.indice.agregar(chat_id, user_id, idioma)
+        return len(filas)
 
 # Diccionario de códigos de idioma a nombres completos
 NOMBRES_IDIOMAS = {
@@ -198,147 +1723,364 @@ IDIOMAS_SOPORTADOS_TTS = {
     'es', 'en', 'fr', 'de', 'it', 'pt', 'pl', 'tr', 'ru', 'nl', 'cs', 'ar', 'zh', 'ja', 'hu', 'ko'
 }
 
+# Idiomas que Whisper acepta como `language` (con sus códigos propios)
+IDIOMAS_WHISPER = {
+    'en', 'zh', 'de', 'es', 'ru', 'ko', 'fr', 'ja', 'pt', 'tr', 'pl', 'ca', 'nl', 'ar', 'sv', 'it', 'id',
+    'hi', 'fi', 'vi', 'he', 'uk', 'el', 'ms', 'cs', 'ro', 'da', 'hu', 'ta', 'no', 'th', 'ur', 'hr', 'bg',
+    'lt', 'la', 'mi', 'ml', 'cy', 'sk', 'te', 'fa', 'lv', 'bn', 'sr', 'az', 'sl', 'kn', 'et', 'mk', 'br',
+    'eu', 'is', 'hy', 'ne', 'mn', 'bs', 'kk', 'sq', 'sw', 'gl', 'mr', 'pa', 'si', 'km', 'sn', 'yo', 'so',
+    'af', 'oc', 'ka', 'be', 'tg', 'sd', 'gu', 'am', 'yi', 'lo', 'uz', 'fo', 'ht', 'ps', 'tk', 'nn', 'mt',
+    'sa', 'lb', 'my', 'bo', 'tl', 'mg', 'as', 'tt', 'haw', 'ln', 'ha', 'ba', 'jw', 'su', 'yue'
+}
+
+# Códigos antiguos, de Whisper o variantes regionales -> código de NOMBRES_IDIOMAS
+ALIAS_IDIOMAS = {
+    'iw': 'he', 'jw': 'jv', 'in': 'id', 'ji': 'yi', 'nb': 'no', 'nn': 'no', 'fil': 'tl',
+    'yue': 'zh', 'cmn': 'zh', 'zho': 'zh', 'chi': 'zh', 'spa': 'es', 'eng': 'en', 'fra': 'fr', 'fre': 'fr',
+    'deu': 'de', 'ger': 'de', 'por': 'pt', 'ita': 'it', 'rus': 'ru', 'jpn': 'ja', 'kor': 'ko', 'ara': 'ar',
+}
+CODIGOS_POR_NOMBRE = {nombre: codigo for codigo, nombre in NOMBRES_IDIOMAS.items()}
+
+def normalizar_idioma(codigo):
+    """
+    Lleva a un mismo código lo que escriben los usuarios y lo que devuelve
+    Whisper: "zh-CN", "zh_tw", "yue" -> "zh"; "pt-BR" -> "pt"; "iw" -> "he";
+    "spanish" -> "es". Los códigos desconocidos se devuelven en minúsculas.
+    """
+    if not codigo:
+        return ""
+    codigo = str(codigo).strip().lower().replace("_", "-")
+    if codigo in CODIGOS_POR_NOMBRE:
+        return CODIGOS_POR_NOMBRE[codigo]
+    codigo = codigo.split("-")[0]
+    return ALIAS_IDIOMAS.get(codigo, codigo)
+
+def idioma_para_asr(codigo):
+    """
+    Código que entiende Whisper para un idioma normalizado, o None si no lo admite
+    """
+    codigo = {'jv': 'jw'}.get(codigo, codigo)
+    return codigo if codigo in IDIOMAS_WHISPER else None
+
+# El índice agrupa a los usuarios por idioma normalizado
+repositorio_idiomas = RepositorioIdiomas(
+    ARCHIVO_IDIOMAS_DB, ESCRITURA_IDIOMAS_MS, IndiceIdiomas(normalizar_idioma, CACHE_MIEMBROS_TTL)
+)
+importados = repositorio_idiomas.importar_json(ARCHIVO_IDIOMAS)
+if importados:
+    log.info(f"📥 Importados {importados} idiomas desde {ARCHIVO_IDIOMAS}")
+
+# Uso de la pista de idioma del remitente
+metricas_pista = {"sin_pista": 0, "aceptadas": 0, "descartadas": 0}
+
+def tasa_pista():
+    """Fracción de transcripciones con pista en las que no hizo falta detectar el idioma"""
+    usadas = metricas_pista["aceptadas"] + metricas_pista["descartadas"]
+    return metricas_pista["aceptadas"] / usadas if usadas else 0.0
+
+async def transcribir_con_pista(audio, duracion, pista=None, tramo_asr="transcripcion"):
+    """
+    Transcribe en el idioma configurado por el remitente, saltándose la
+    detección; si la confianza queda por debajo de ASR_PISTA_CONFIANZA_MIN
+    se repite con detección automática
+    """
+    pista = idioma_para_asr(normalizar_idioma(pista)) if ASR_PISTA_IDIOMA and pista else None
+    if pista is None:
+        metricas_pista["sin_pista"] += 1
+    else:
+        with tramo(tramo_asr, idioma=pista):
+            resultado = await etapas_pipeline["transcripcion"].ejecutar(
+                pool_transcripcion.transcribir, audio, {"language": pista}, duracion
+            )
+        if resultado.get("confianza", 1.0) >= ASR_PISTA_CONFIANZA_MIN:
+            metricas_pista["aceptadas"] += 1
+            return resultado
+        metricas_pista["descartadas"] += 1
+        log.debug("🔁 Confianza baja con la pista %s (%.2f), detectando el idioma", pista, resultado['confianza'])
+
+    with tramo(tramo_asr, idioma="") as t:
+        resultado = await etapas_pipeline["transcripcion"].ejecutar(
+            pool_transcripcion.transcribir, audio, None, duracion
+        )
+        t["idioma"] = resultado["language"]
+    return resultado
+
 def limpiar_chat_del_json(chat_id):
     """
-    Elimina un chat del JSON de idiomas
+    Elimina un chat del almacén de idiomas
     """
-    chat_id_str = str(chat_id)
-    if chat_id_str in idiomas:
-        del idiomas[chat_id_str]
-        guardar_idiomas()
-        print(f"🗑️ Chat {chat_id} eliminado del JSON")
+    if repositorio_idiomas.eliminar_chat(chat_id):
+        log.info(f"🗑️ Chat {chat_id} eliminado del JSON")
         return True
     return False
 
 def limpiar_usuario_del_json(chat_id, user_id):
     """
-    Elimina un usuario específico del JSON de idiomas
+    Elimina un usuario específico del almacén de idiomas
     """
-    chat_id_str = str(chat_id)
-    user_id_str = str(user_id)
-    
-    if chat_id_str in idiomas and user_id_str in idiomas[chat_id_str]:
-        del idiomas[chat_id_str][user_id_str]
-        
-        # Si no quedan usuarios en el chat, eliminar el chat completo
-        if not idiomas[chat_id_str]:
-            del idiomas[chat_id_str]
-            print(f"🗑️ Chat {chat_id} eliminado completamente (sin usuarios)")
+    if repositorio_idiomas.eliminar_usuario(chat_id, user_id):
+        # Un chat sin usuarios deja de existir en el almacén
+        if not repositorio_idiomas.existe_chat(chat_id):
+            log.info(f"🗑️ Chat {chat_id} eliminado completamente (sin usuarios)")
         else:
-            print(f"🗑️ Usuario {user_id} eliminado del chat {chat_id}")
-        
-        guardar_idiomas()
+            log.info(f"🗑️ Usuario {user_id} eliminado del chat {chat_id}")
         return True
     return False
 
 async def verificar_y_limpiar_usuarios_inactivos(context, chat_id):
     """
-    Verifica qué usuarios del JSON siguen siendo miembros del grupo y elimina los que no
+    Verifica qué usuarios del almacén siguen siendo miembros del grupo y elimina los que no.
+    `context` puede ser el de un handler o la propia Application (solo se usa `.bot`).
     """
-    chat_id_str = str(chat_id)
-    
-    if chat_id_str not in idiomas:
+    participantes = repositorio_idiomas.idiomas_chat(chat_id)
+    if not participantes:
         return
     
     usuarios_a_eliminar = []
     
-    for user_id in idiomas[chat_id_str].keys():
-        try:
-            # Intentar obtener información del miembro del chat
-            chat_member = await context.bot.get_chat_member(chat_id, int(user_id))
-            
+    # Consultar todos los miembros a la vez (la caché limita las peticiones reales)
+    resultados = await asyncio.gather(
+        *(cache_miembros.obtener(context.bot, chat_id, user_id) for user_id in participantes),
+        return_exceptions=True,
+    )
+    
+    for user_id, chat_member in zip(participantes, resultados):
+        if isinstance(chat_member, BadRequest):
+            # Telegram no encuentra al usuario en el grupo
+            log.error(f"❌ No se pudo verificar usuario {user_id}: {chat_member}")
+            usuarios_a_eliminar.append(user_id)
+        elif isinstance(chat_member, Exception):
+            # Errores transitorios (red, TimedOut, RetryAfter...): se conserva y se revisa en el próximo barrido
+            log.warning(f"⚠️ No se pudo verificar usuario {user_id}, se conserva: {chat_member}")
+        elif chat_member.status in ['left', 'kicked', 'banned']:
             # Si el usuario no es miembro activo, agregarlo a la lista de eliminación
-            if chat_member.status in ['left', 'kicked', 'banned']:
-                usuarios_a_eliminar.append(user_id)
-                print(f"❌ Usuario {user_id} no es miembro activo (status: {chat_member.status})")
-                
-        except Exception as e:
-            # Si no se puede obtener información del usuario, probablemente ya no está en el grupo
-            print(f"❌ No se pudo verificar usuario {user_id}: {e}")
             usuarios_a_eliminar.append(user_id)
+            log.error(f"❌ Usuario {user_id} no es miembro activo (status: {chat_member.status})")
     
     # Eliminar usuarios que ya no están en el grupo
     for user_id in usuarios_a_eliminar:
         limpiar_usuario_del_json(chat_id, user_id)
     
     if usuarios_a_eliminar:
-        print(f"🧹 Limpiados {len(usuarios_a_eliminar)} usuarios inactivos del chat {chat_id}")
+        log.info(f"🧹 Limpiados {len(usuarios_a_eliminar)} usuarios inactivos del chat {chat_id}")
+
+def idioma_remitente(update, participantes=None):
+    """
+    Idioma configurado por quien envía el mensaje, desde la copia de
+    `participantes` de un trabajo o desde el repositorio
+    """
+    user_id = str(update.message.from_user.id)
+    if participantes is not None:
+        return participantes.get(user_id)
+    return repositorio_idiomas.obtener_idioma(update.message.chat_id, user_id)
+
+def rutas_idiomas(chat_id, idioma_detectado, participantes=None):
+    """
+    {idioma: user_ids} que necesitan traducción. Sale del índice del repositorio
+    salvo que se pase la copia de `participantes` guardada con un trabajo.
+    """
+    if participantes is None:
+        return repositorio_idiomas.indice.destinos(str(chat_id), idioma_detectado)
+    return agrupar_usuarios_por_idioma(participantes, idioma_detectado)
 
 def agrupar_usuarios_por_idioma(participantes, idioma_detectado):
     """
     Agrupa usuarios por idioma, excluyendo aquellos que ya tienen el idioma detectado
     """
     usuarios_por_idioma = {}
+    idioma_detectado = normalizar_idioma(idioma_detectado)
     
     for uid, lang in participantes.items():
-        if lang != idioma_detectado:
+        lang = normalizar_idioma(lang)
+        if lang and lang != idioma_detectado:
             if lang not in usuarios_por_idioma:
                 usuarios_por_idioma[lang] = []
             usuarios_por_idioma[lang].append(uid)
     
     return usuarios_por_idioma
 
-async def obtener_nombres_usuarios(context, chat_id, user_ids):
+async def obtener_nombres_usuarios(context, chat_id, user_ids, idioma=None):
     """
-    Obtiene los nombres de los usuarios para mencionar
+    Obtiene los nombres de los usuarios para mencionar. Con `idioma`, las
+    menciones de ese grupo de usuarios se guardan en el índice de idiomas.
     """
+    if idioma is not None:
+        nombres = repositorio_idiomas.indice.menciones_guardadas(str(chat_id), idioma, user_ids)
+        if nombres is not None:
+            return nombres
+
+    resultados = await asyncio.gather(
+        *(cache_miembros.obtener(context.bot, chat_id, uid) for uid in user_ids),
+        return_exceptions=True,
+    )
+    
     nombres = []
-    for uid in user_ids:
-        try:
-            chat_member = await context.bot.get_chat_member(chat_id, int(uid))
-            nombre = chat_member.user.first_name
-            # Agregar @ para mención si el usuario tiene username
-            if chat_member.user.username:
-                nombres.append(f"@{chat_member.user.username}")
-            else:
-                nombres.append(nombre)
-        except Exception as e:
-            print(f"❌ Error al obtener nombre de usuario {uid}: {e}")
+    errores = False
+    for uid, chat_member in zip(user_ids, resultados):
+        if isinstance(chat_member, Exception):
+            log.error(f"❌ Error al obtener nombre de usuario {uid}: {chat_member}")
             nombres.append(f"Usuario {uid}")
+            errores = True
+        elif chat_member.user.username:
+            # Agregar @ para mención si el usuario tiene username
+            nombres.append(f"@{chat_member.user.username}")
+        else:
+            nombres.append(chat_member.user.first_name)
     
+    if idioma is not None and not errores:
+        repositorio_idiomas.indice.guardar_menciones(str(chat_id), idioma, user_ids, nombres)
     return nombres
 
+async def barrido_miembros_periodico(app):
+    """
+    Revisa cada BARRIDO_MIEMBROS_S segundos qué usuarios registrados siguen en sus grupos
+    """
+    while True:
+        await asyncio.sleep(BARRIDO_MIEMBROS_S)
+        log.info("🧹 Barrido periódico de miembros...")
+        cache_miembros.purgar()
+        for chat_id in repositorio_idiomas.chats():
+            try:
+                await verificar_y_limpiar_usuarios_inactivos(app, chat_id)
+            except Exception as e:
+                log.error(f"❌ Error en barrido del chat {chat_id}: {e}")
+        repositorio_idiomas.verificar_indice()
+
 async def traducir_texto(texto, idioma_origen, idioma_destino):
     """
     Traduce texto usando Ollama
     """
     try:
-        print(f"🔄 Traduciendo de {idioma_origen} a {idioma_destino}")
-        print(f"📝 Texto original: {texto}")
+        log.debug("🔄 Traduciendo de %s a %s", idioma_origen, idioma_destino)
+        log.debug("📝 Texto original: %s", texto)
+
+        clave = clave_traduccion(texto, idioma_origen, idioma_destino)
+        traduccion = await cache_traducciones.obtener(clave)
+        if traduccion is not None:
+            log.debug("💾 Traducción en caché: %s", traduccion)
+            return traduccion
         
         # Convertir códigos de idioma a nombres completos
         nombre_origen = NOMBRES_IDIOMAS.get(idioma_origen, idioma_origen)
         nombre_destino = NOMBRES_IDIOMAS.get(idioma_destino, idioma_destino)
         
-        print(f"🌐 Idiomas: {nombre_origen} → {nombre_destino}")
+        log.debug("🌐 Idiomas: %s → %s", nombre_origen, nombre_destino)
         
         # Crear prompt para traducción
         prompt = f"""Translate the following text from {nombre_origen} to {nombre_destino}. 
         Only provide the translation, no additional text or explanations.
         The text you'll receive comes from an automatic transcription, so it has errors. Please translate it without any mistakes.
-        Remember you will only say the translation from the input. No more explanation.
+        Remember you will only say the translation from the input. No more explanation.
+
+        Text to translate: "{texto}"
+
+        Translation:"""
+        
+        # Generar traducción con Ollama (limitando las peticiones simultáneas)
+        async with semaforo_ollama():
+            log.debug("🤖 Enviando a Ollama...")
+            with tramo("traduccion", idioma=idioma_destino):
+                response = await cliente_ollama.generate(
+                    model=OLLAMA_MODEL,
+                    prompt=prompt,
+                    stream=False
+                )
+        
+        traduccion = response['response'].strip()
+        log.debug("✅ Traducción recibida: %s", traduccion)
+        cache_traducciones.guardar(clave, traduccion)
+        
+        return traduccion
+        
+    except Exception as e:
+        log.error(f"❌ Error en traducción: {e}")
+        return f"[Error de traducción] {texto}"
+
+def parsear_traducciones_lote(respuesta, idiomas_destino):
+    """
+    Valida la respuesta JSON del modelo y devuelve solo las traducciones correctas
+    """
+    texto = respuesta.strip()
+    inicio, fin = texto.find("{"), texto.rfind("}")
+    if inicio == -1 or fin <= inicio:
+        return {}
+
+    try:
+        datos = json.loads(texto[inicio:fin + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(datos, dict):
+        return {}
+
+    claves = {str(clave).strip().lower(): valor for clave, valor in datos.items()}
+    traducciones = {}
+    for codigo in idiomas_destino:
+        valor = claves.get(codigo.lower())
+        if valor is None:
+            # Algunos modelos usan el nombre del idioma en lugar del código
+            valor = claves.get(NOMBRES_IDIOMAS.get(codigo, codigo))
+        if isinstance(valor, str) and valor.strip():
+            traducciones[codigo] = valor.strip()
+    return traducciones
+
+async def traducir_lote(texto, idioma_origen, idiomas_destino):
+    """
+    Traduce texto a varios idiomas con una sola llamada a Ollama.
+    Devuelve solo los idiomas válidos; el resto debe traducirse por separado.
+    """
+    traducciones = {}
+    try:
+        # Solo se piden al modelo los idiomas que no están en caché
+        pendientes = []
+        for codigo in idiomas_destino:
+            en_cache = await cache_traducciones.obtener(clave_traduccion(texto, idioma_origen, codigo))
+            if en_cache is not None:
+                traducciones[codigo] = en_cache
+            else:
+                pendientes.append(codigo)
+        if len(pendientes) < TRADUCCION_LOTE_MIN:
+            # Lo que quede se traduce por separado
+            return traducciones
+        idiomas_destino = pendientes
+
+        nombre_origen = NOMBRES_IDIOMAS.get(idioma_origen, idioma_origen)
+        lista_destinos = ", ".join(
+            f"{codigo} ({NOMBRES_IDIOMAS.get(codigo, codigo)})" for codigo in idiomas_destino
+        )
+        log.debug("🔄 Traducción en lote de %s a %s", idioma_origen, idiomas_destino)
+
+        prompt = f"""Translate the following text from {nombre_origen} into each of these languages: {lista_destinos}.
+        The text you'll receive comes from an automatic transcription, so it has errors. Please translate it without any mistakes.
+        Answer ONLY with a JSON object whose keys are the language codes and whose values are the translations.
+        No more explanation.
 
         Text to translate: "{texto}"
 
-        Translation:"""
-        
-        print(f"🤖 Enviando a Ollama...")
-        
-        # Generar traducción con Ollama
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
-            prompt=prompt,
-            stream=False
-        )
-        
-        traduccion = response['response'].strip()
-        print(f"✅ Traducción recibida: {traduccion}")
-        
-        return traduccion
-        
+        JSON:"""
+
+        async with semaforo_ollama():
+            log.debug("🤖 Enviando lote a Ollama...")
+            with tramo("traduccion_lote", idioma=idioma_origen):
+                response = await cliente_ollama.generate(
+                    model=OLLAMA_MODEL,
+                    prompt=prompt,
+                    format="json",
+                    stream=False
+                )
+
+        recibidas = parsear_traducciones_lote(response['response'], idiomas_destino)
+        faltantes = [codigo for codigo in idiomas_destino if codigo not in recibidas]
+        log.debug("✅ Lote recibido: %s/%s idiomas", len(recibidas), len(idiomas_destino))
+        if faltantes:
+            log.warning(f"⚠️ Idiomas ausentes o mal formados en el lote: {faltantes}")
+        for codigo, traduccion in recibidas.items():
+            cache_traducciones.guardar(clave_traduccion(texto, idioma_origen, codigo), traduccion)
+        traducciones.update(recibidas)
+        return traducciones
+
     except Exception as e:
-        print(f"❌ Error en traducción: {e}")
-        return f"[Error de traducción] {texto}"
+        log.error(f"❌ Error en traducción en lote: {e}")
+        return traducciones
 
 async def verificar_miembros_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -354,22 +2096,22 @@ async def verificar_miembros_chat(update: Update, context: ContextTypes.DEFAULT_
         # Obtener número de miembros del chat
         member_count = await context.bot.get_chat_member_count(chat_id)
         
-        print(f"👥 Verificando miembros en chat {chat_id}: {member_count} miembros")
+        log.info(f"👥 Verificando miembros en chat {chat_id}: {member_count} miembros")
         
         # Si solo hay 1 miembro (el bot), limpiar del JSON
         if member_count <= 1:
             limpiar_chat_del_json(chat_id)
-            print(f"🏃‍♂️ Bot se quedó solo en chat {chat_id}, datos eliminados")
+            log.info(f"🏃‍♂️ Bot se quedó solo en chat {chat_id}, datos eliminados")
             
             # Opcional: intentar salir del grupo
             try:
                 await context.bot.leave_chat(chat_id)
-                print(f"👋 Bot salió del chat {chat_id}")
+                log.info(f"👋 Bot salió del chat {chat_id}")
             except Exception as e:
-                print(f"❌ No se pudo salir del chat {chat_id}: {e}")
+                log.error(f"❌ No se pudo salir del chat {chat_id}: {e}")
                 
     except Exception as e:
-        print(f"❌ Error verificando miembros del chat: {e}")
+        log.error(f"❌ Error verificando miembros del chat: {e}")
 
 async def manejar_cambio_miembros(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -383,11 +2125,14 @@ async def manejar_cambio_miembros(update: Update, context: ContextTypes.DEFAULT_
         if not chat_member_update:
             return
             
+        # Mantener la caché de miembros al día sin consultar a la API
+        cache_miembros.actualizar(chat_id, chat_member_update.new_chat_member)
+        
         user_id = chat_member_update.new_chat_member.user.id
         old_status = chat_member_update.old_chat_member.status
         new_status = chat_member_update.new_chat_member.status
         
-        print(f"🔄 Cambio de miembro en chat {chat_id}: Usuario {user_id} {old_status} → {new_status}")
+        log.info(f"🔄 Cambio de miembro en chat {chat_id}: Usuario {user_id} {old_status} → {new_status}")
         
         # Si el usuario salió/fue expulsado/baneado
         if new_status in ['left', 'kicked', 'banned']:
@@ -399,11 +2144,11 @@ async def manejar_cambio_miembros(update: Update, context: ContextTypes.DEFAULT_
             
         # Si el bot fue expulsado del grupo
         elif chat_member_update.new_chat_member.user.id == context.bot.id and new_status in ['left', 'kicked', 'banned']:
-            print(f"🚫 Bot expulsado del chat {chat_id}")
+            log.info(f"🚫 Bot expulsado del chat {chat_id}")
             limpiar_chat_del_json(chat_id)
                 
     except Exception as e:
-        print(f"❌ Error manejando cambio de miembros: {e}")
+        log.error(f"❌ Error manejando cambio de miembros: {e}")
 
 async def manejar_migracion_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -414,17 +2159,192 @@ async def manejar_migracion_grupo(update: Update, context: ContextTypes.DEFAULT_
             old_chat_id = str(update.message.migrate_from_chat_id)
             new_chat_id = str(update.effective_chat.id)
             
-            print(f"🔄 Migración de grupo: {old_chat_id} → {new_chat_id}")
+            log.info(f"🔄 Migración de grupo: {old_chat_id} → {new_chat_id}")
             
-            # Migrar datos del JSON
-            if old_chat_id in idiomas:
-                idiomas[new_chat_id] = idiomas[old_chat_id]
-                del idiomas[old_chat_id]
-                guardar_idiomas()
-                print(f"✅ Datos migrados exitosamente")
+            # Migrar datos del almacén
+            if repositorio_idiomas.migrar_chat(old_chat_id, new_chat_id):
+                log.info(f"✅ Datos migrados exitosamente")
                 
     except Exception as e:
-        print(f"❌ Error en migración de grupo: {e}")
+        log.error(f"❌ Error en migración de grupo: {e}")
+
+class LimpiezaChats:
+    """
+    Limpieza de chats inactivos como tarea de fondo. Los chats por revisar y
+    su estado se guardan en SQLite, así que tras un reinicio la limpieza
+    continúa donde se quedó. Se revisan `concurrencia` chats a la vez con un
+    límite de peticiones por segundo y el progreso se publica editando un
+    mensaje de estado.
+    """
+
+    REINTENTOS = 3
+    PUNTO_CONTROL = 50  # chats revisados entre escrituras del avance
+    PROGRESO_S = 5  # segundos entre ediciones del mensaje de progreso
+
+    def __init__(self, ruta_db, concurrencia=8, limitador=None):
+        self.db = sqlite3.connect(ruta_db, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS limpieza_chats ("
+                "chat_id TEXT PRIMARY KEY, estado TEXT NOT NULL DEFAULT 'pendiente') WITHOUT ROWID"
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS limpieza_meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        self.concurrencia = concurrencia
+        self.limitador = limitador or LimitadorTasa(20, 20)
+        self.tarea = None
+        self.revisados = []  # (estado, chat_id) aún sin guardar
+        self.total = 0
+        self.hechos = 0
+        self.eliminados = 0
+        self.errores = 0
+
+    def _meta(self, clave, valor=None):
+        fila = self.db.execute("SELECT valor FROM limpieza_meta WHERE clave = ?", (clave,)).fetchone()
+        return json.loads(fila[0]) if fila else valor
+
+    def en_curso(self):
+        return self.tarea is not None and not self.tarea.done()
+
+    def pendiente(self):
+        return self.db.execute("SELECT 1 FROM limpieza_chats WHERE estado = 'pendiente' LIMIT 1").fetchone() is not None
+
+    def ultima(self):
+        """Instante (epoch) en que terminó la última limpieza"""
+        return self._meta("ultima", 0)
+
+    def iniciar(self, bot, chats=None, aviso=None):
+        """
+        Lanza la limpieza de `chats` o, sin chats, reanuda la que quedó a medias.
+        `aviso` es (chat_id, message_id) del mensaje de progreso.
+        """
+        if self.en_curso():
+            return False
+        if chats is not None:
+            with self.db:
+                self.db.execute("DELETE FROM limpieza_chats")
+                self.db.executemany("INSERT INTO limpieza_chats (chat_id) VALUES (?)", [(c,) for c in chats])
+                self.db.execute("INSERT OR REPLACE INTO limpieza_meta VALUES ('aviso', ?)", (json.dumps(aviso),))
+        self.tarea = asyncio.create_task(self._ejecutar(bot))
+        return True
+
+    async def detener(self):
+        if self.en_curso():
+            self.tarea.cancel()
+            await asyncio.gather(self.tarea, return_exceptions=True)
+
+    def _guardar_avance(self):
+        revisados, self.revisados = self.revisados, []
+        if revisados:
+            with self.db:
+                self.db.executemany("UPDATE limpieza_chats SET estado = ? WHERE chat_id = ?", revisados)
+
+    async def _revisar(self, bot, chat_id):
+        """
+        Devuelve "activo", "eliminado" o "error" (fallo transitorio, el chat se conserva)
+        """
+        for intento in range(self.REINTENTOS):
+            await self.limitador.esperar()
+            try:
+                miembros = await bot.get_chat_member_count(int(chat_id))
+            except RetryAfter as e:
+                espera = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                log.warning(f"⚠️ Limpieza: Telegram pide esperar {espera:.0f}s")
+                await asyncio.sleep(espera)
+                continue
+            except (BadRequest, Forbidden):
+                # El chat no existe o el bot ya no tiene acceso
+                miembros = 0
+            except Exception as e:
+                log.warning(f"⚠️ Limpieza: no se pudo revisar el chat {chat_id} (intento {intento + 1}): {e}")
+                await asyncio.sleep(2 ** intento)
+                continue
+            if miembros <= 1:
+                repositorio_idiomas.eliminar_chat(chat_id)
+                return "eliminado"
+            return "activo"
+        return "error"
+
+    def _texto_progreso(self, terminado=False):
+        if terminado:
+            return (f"✅ Limpieza terminada: {self.total} chats revisados, {self.eliminados} eliminados"
+                    + (f", {self.errores} sin poder revisar" if self.errores else ""))
+        return f"🧹 Limpieza en curso: {self.hechos}/{self.total} chats revisados, {self.eliminados} eliminados"
+
+    async def _avisar(self, bot, texto):
+        aviso = self._meta("aviso")
+        if not aviso:
+            return
+        try:
+            await gestor_envios.enviar(aviso[0], bot.edit_message_text, texto, chat_id=aviso[0], message_id=aviso[1])
+        except Exception as e:
+            log.debug("No se pudo actualizar el progreso de la limpieza: %s", e)
+
+    async def _ejecutar(self, bot):
+        conteos = dict(self.db.execute("SELECT estado, COUNT(*) FROM limpieza_chats GROUP BY estado").fetchall())
+        self.total = sum(conteos.values())
+        self.hechos = self.total - conteos.get("pendiente", 0)
+        self.eliminados = conteos.get("eliminado", 0)
+        self.errores = conteos.get("error", 0)
+        pendientes = iter([fila[0] for fila in self.db.execute(
+            "SELECT chat_id FROM limpieza_chats WHERE estado = 'pendiente'"
+        )])
+        log.info(f"🧹 Limpieza de chats: {self.total - self.hechos} pendientes de {self.total}")
+
+        async def worker():
+            for chat_id in pendientes:
+                estado = await self._revisar(bot, chat_id)
+                self.revisados.append((estado, chat_id))
+                self.hechos += 1
+                self.eliminados += estado == "eliminado"
+                self.errores += estado == "error"
+                if len(self.revisados) >= self.PUNTO_CONTROL:
+                    self._guardar_avance()
+
+        async def progreso():
+            while True:
+                await asyncio.sleep(self.PROGRESO_S)
+                self._guardar_avance()
+                await self._avisar(bot, self._texto_progreso())
+
+        informe = asyncio.create_task(progreso())
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrencia)))
+        finally:
+            informe.cancel()
+            self._guardar_avance()
+
+        await self._avisar(bot, self._texto_progreso(terminado=True))
+        log.info(self._texto_progreso(terminado=True))
+        with self.db:
+            self.db.execute("DELETE FROM limpieza_chats")
+            self.db.execute("DELETE FROM limpieza_meta WHERE clave = 'aviso'")
+            self.db.execute("INSERT OR REPLACE INTO limpieza_meta VALUES ('ultima', ?)", (json.dumps(time.time()),))
+
+    def metricas(self):
+        return {
+            "en_curso": self.en_curso(),
+            "total": self.total,
+            "revisados": self.hechos,
+            "eliminados": self.eliminados,
+            "errores": self.errores,
+        }
+
+limpieza_chats = LimpiezaChats(
+    ARCHIVO_IDIOMAS_DB, LIMPIEZA_CONCURRENCIA, LimitadorTasa(LIMPIEZA_POR_SEGUNDO, max(1, int(LIMPIEZA_POR_SEGUNDO)))
+)
+
+async def limpieza_periodica(app):
+    """
+    Lanza la limpieza de chats cada LIMPIEZA_INTERVALO_H horas, contando desde
+    la última que terminó (también antes de un reinicio)
+    """
+    intervalo = LIMPIEZA_INTERVALO_H * 3600
+    while True:
+        await asyncio.sleep(max(0, limpieza_chats.ultima() + intervalo - time.time()))
+        if limpieza_chats.iniciar(app.bot, repositorio_idiomas.chats()):
+            await asyncio.gather(limpieza_chats.tarea, return_exceptions=True)
+        # Si ya había una en curso o esta falló, volver a mirar en un minuto
+        await asyncio.sleep(60)
 
 async def comando_limpiar_json(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -433,33 +2353,126 @@ async def comando_limpiar_json(update: Update, context: ContextTypes.DEFAULT_TYP
     try:
         # Solo permitir en chats privados o a administradores
         if update.effective_chat.type == 'private':
-            # Limpiar todos los chats inactivos
-            chats_eliminados = []
-            for chat_id in list(idiomas.keys()):
-                try:
-                    member_count = await context.bot.get_chat_member_count(int(chat_id))
-                    if member_count <= 1:
-                        del idiomas[chat_id]
-                        chats_eliminados.append(chat_id)
-                except:
-                    # Chat no existe o bot no tiene acceso
-                    del idiomas[chat_id]
-                    chats_eliminados.append(chat_id)
-            
-            if chats_eliminados:
-                guardar_idiomas()
-                await update.message.reply_text(f"🗑️ Eliminados {len(chats_eliminados)} chats inactivos del JSON")
-            else:
-                await update.message.reply_text("✅ No hay chats inactivos para limpiar")
+            # Limpiar todos los chats inactivos en segundo plano
+            if limpieza_chats.en_curso():
+                await gestor_envios.enviar(
+                    update.effective_chat.id, update.message.reply_text, "⏳ Ya hay una limpieza en curso, su mensaje de progreso se va actualizando"
+                )
+                return
+            chats = repositorio_idiomas.chats()
+            aviso = await gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, f"🧹 Limpieza de {len(chats)} chats en marcha..."
+            )
+            limpieza_chats.iniciar(context.bot, chats, (aviso.chat_id, aviso.message_id))
         else:
             # En grupos, permitir limpiar solo ese chat específico
             chat_id = update.effective_chat.id
             await verificar_y_limpiar_usuarios_inactivos(context, chat_id)
-            await update.message.reply_text("✅ Usuarios inactivos verificados y eliminados")
+            await gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, "✅ Usuarios inactivos verificados y eliminados"
+            )
                 
     except Exception as e:
-        print(f"❌ Error en comando limpiar: {e}")
-        await update.message.reply_text("❌ Error al limpiar el JSON")
+        log.error(f"❌ Error en comando limpiar: {e}")
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "❌ Error al limpiar el JSON"
+        )
+
+def formatear_cache(titulo, cache):
+    """
+    Resume las métricas de una caché para /estado
+    """
+    c = cache.metricas()
+    return (
+        f"{titulo}\n"
+        f"• Entradas: {c['entradas']} ({c['bytes'] / 1024:.0f}/{c['max_bytes'] / 1024:.0f} KB)\n"
+        f"• Aciertos: {c['aciertos']} | Fallos: {c['fallos']} ({c['tasa_aciertos']:.0%})"
+    )
+
+def formatear_etapas():
+    """
+    Resume latencia y ocupación de cada etapa del pipeline, marcando la más cargada
+    """
+    metricas = {nombre: etapa.metricas() for nombre, etapa in etapas_pipeline.items()}
+    mas_cargada = max(metricas, key=lambda nombre: metricas[nombre]["utilizacion"])
+    lineas = ["⚙️ Pipeline de audio"]
+    for nombre, e in metricas.items():
+        marca = " 🐢" if nombre == mas_cargada and e["procesados"] else ""
+        lineas.append(
+            f"• {etapas_pipeline[nombre].nombre}: {e['utilizacion']:.0%} ocupación, "
+            f"espera {e['espera_media']:.2f}s, servicio {e['servicio_medio']:.2f}s, "
+            f"{e['en_cola']} en cola{marca}"
+        )
+    return "\n".join(lineas)
+
+def formatear_cola_trabajos(t):
+    return (
+        f"📮 Cola de trabajos (modo workers): {t['pendiente']} pendientes, {t['en_proceso']} en proceso\n"
+        f"• Hechos: {t['hecho']} | Muertos: {t['muerto']}"
+    )
+
+async def estado(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Muestra las métricas internas del bot (colas, cachés y almacenamiento).
+    Del planificador solo se detalla el chat actual, para no mostrar a
+    cualquiera los ids y el uso de otros grupos.
+    """
+    m = pool_transcripcion.metricas()
+    p = planificador_audios.metricas()
+    chat_actual = str(update.effective_chat.id)
+    c = cache_miembros.metricas()
+    r = repositorio_idiomas.metricas()
+    e = gestor_envios.metricas()
+    l = limpieza_chats.metricas()
+    d = decodificador.metricas()
+
+    secciones = [
+        "📊 **Estado del bot**",
+        f"🔥 Modelos: ASR {estado_modelos['asr']} | TTS {estado_modelos['tts']}"
+        if not MODO_WORKERS else formatear_cola_trabajos(await leer_cola_trabajos()),
+        (f"🗓️ Planificador: {p['activos']}/{p['concurrencia']} en curso, {p['en_cola']} en cola\n"
+        + "\n".join(
+            f"• Este chat: {e['segundos_audio']:.0f}s de audio, {e['completados']} audios, "
+            f"{e['en_cola']} en cola, espera media {e['espera_media']:.1f}s"
+            for chat_id, e in p["chats"].items() if chat_id == chat_actual
+        )).rstrip(),
+        formatear_etapas(),
+        f"🎯 Transcripción ({m['tipo']}, {m['workers']} workers, {ASR_BACKEND})\n"
+        f"• En cola: {m['en_cola']} | En curso: {m['en_curso']}/{m['max_cola']}\n"
+        f"• Completados: {m['completados']} | Rechazados: {m['rechazados']}\n"
+        f"• Espera media: {m['espera_media']:.2f}s | Espera máx: {m['espera_max']:.2f}s\n"
+        + (f"• Lotes: {m['lotes']} (medio {m['lote_medio']:.1f}/{m['lote_max']})\n" if m['lote_max'] > 1 else "")
+        + f"• Modelos usados: {', '.join(f'{n}: {u}' for n, u in politica_asr.usos.items()) if politica_asr else '-'} "
+        f"| Reintentos por confianza baja: {politica_asr.reintentos if politica_asr else 0}\n"
+        f"• Pista de idioma: {metricas_pista['aceptadas']} aceptadas, {metricas_pista['descartadas']} descartadas, "
+        f"{metricas_pista['sin_pista']} sin pista ({tasa_pista():.0%} de acierto)\n"
+        f"• Decodificación ({d['modo']}): {d['decodificados']} audios, media {d['tiempo_medio'] * 1000:.0f} ms | "
+        f"ffmpeg listos: {d['listos']} | Arranques en frío: {d['en_frio']} | Errores: {d['errores']}",
+        formatear_cache("🎯 Caché de transcripciones", cache_transcripciones),
+        formatear_cache("🌐 Caché de traducciones", cache_traducciones),
+        formatear_cache("🔊 Caché de audios TTS", cache_tts),
+        f"🎤 TTS ({'por frases' if TTS_STREAMING else 'nota única'}): {metricas_tts['envios']} envíos, "
+        f"{metricas_tts['frases']} frases\n"
+        f"• Primer audio medio: {metricas_tts['ttfb_total'] / max(metricas_tts['envios'], 1):.2f}s "
+        f"(máx {metricas_tts['ttfb_max']:.2f}s) | Total medio: "
+        f"{metricas_tts['tiempo_total'] / max(metricas_tts['envios'], 1):.2f}s",
+        f"📤 Envíos ({MODO_TRADUCCIONES}): {e['envios']} | 429 recibidos: {e['retry_after']} "
+        f"({e['espera_retry_after']:.0f}s de espera) | Fallidos: {e['fallidos']} | Chats en pausa: {e['chats_en_pausa']}",
+        f"👥 Miembros en caché: {c['entradas']} | Aciertos: {c['aciertos']} | Peticiones API: {c['peticiones']}",
+        f"💾 Idiomas: {r['escrituras']} escrituras para {r['actualizaciones']} cambios "
+        f"({r['coalescidas']} agrupados, {r['pendientes']} pendientes)\n"
+        f"• Índice: {r['chats']} chats, {r['idiomas_indexados']} grupos de idioma | Rutas reutilizadas: "
+        f"{r['aciertos_rutas']} | Menciones reutilizadas: {r['aciertos_menciones']} | "
+        f"Verificaciones: {r['verificaciones']} ({r['inconsistencias']} inconsistencias)",
+    ]
+    if l["total"]:
+        secciones.append(
+            f"🧹 Limpieza {'en curso' if l['en_curso'] else 'terminada'}: {l['revisados']}/{l['total']} chats revisados, "
+            f"{l['eliminados']} eliminados, {l['errores']} con error"
+        )
+    await gestor_envios.enviar(
+        update.effective_chat.id, update.message.reply_text, "\n\n".join(secciones), parse_mode='Markdown'
+    )
 
 # Comandos
 async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -486,7 +2499,9 @@ async def ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "ℹ️ `/ayuda`\n"
         "Muestra este mensaje de ayuda."
     )
-    await update.message.reply_text(texto_ayuda, parse_mode='Markdown')
+    await gestor_envios.enviar(
+        update.effective_chat.id, update.message.reply_text, texto_ayuda, parse_mode='Markdown'
+    )
 
 # Hacemos que /start sea un alias de /ayuda
 start = ayuda
@@ -516,150 +2531,650 @@ async def idiomas_disponibles(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Telegram tiene un límite de 4096 caracteres por mensaje. Si la lista es muy larga, la dividimos.
         if len(texto_final) > 4096:
-            await update.message.reply_text("La lista de idiomas es muy larga. Aquí están los más comunes:\n`es` - Español, `en` - Inglés, `fr` - Francés, `de` - Alemán, `pt` - Portugués, `it` - Italiano, `ja` - Japonés, `zh` - Chino, `ru` - Ruso.")
+            await gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, "La lista de idiomas es muy larga. Aquí están los más comunes:\n`es` - Español, `en` - Inglés, `fr` - Francés, `de` - Alemán, `pt` - Portugués, `it` - Italiano, `ja` - Japonés, `zh` - Chino, `ru` - Ruso."
+            )
         else:
-            await update.message.reply_text(texto_final, parse_mode='Markdown')
+            await gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, texto_final, parse_mode='Markdown'
+            )
             
     except Exception as e:
-        print(f"Error en /idiomas_disponibles: {e}")
-        await update.message.reply_text("❌ No se pudo mostrar la lista de idiomas.")
+        log.error(f"Error en /idiomas_disponibles: {e}")
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "❌ No se pudo mostrar la lista de idiomas."
+        )
         
 async def idioma(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) != 1:
-        await update.message.reply_text("Uso: /idioma <código_idioma> (ej: /idioma en)")
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "Uso: /idioma <código_idioma> (ej: /idioma en)"
+        )
         return
 
-    idioma = context.args[0].lower()
+    idioma = normalizar_idioma(context.args[0])
     user_id = str(update.message.from_user.id)
     chat_id = str(update.message.chat_id)
 
-    if chat_id not in idiomas:
-        idiomas[chat_id] = {}
-
-    idiomas[chat_id][user_id] = idioma
-    guardar_idiomas()
+    repositorio_idiomas.guardar_idioma(chat_id, user_id, idioma)
     
-    print(f"🔧 Idioma configurado: Usuario {user_id} → {idioma}")
-    await update.message.reply_text(f"Idioma registrado: {idioma}")
+    log.info(f"🔧 Idioma configurado: Usuario {user_id} → {idioma}")
+    await gestor_envios.enviar(
+        update.effective_chat.id, update.message.reply_text, f"Idioma registrado: {idioma}"
+    )
 
 async def mostrar_idiomas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.message.chat_id)
-    if chat_id in idiomas:
-        texto = "\n".join(f"{uid}: {lang}" for uid, lang in idiomas[chat_id].items())
+    idiomas = repositorio_idiomas.indice.idiomas_chat(chat_id)
+    if idiomas:
+        texto = "\n".join(
+            f"{NOMBRES_IDIOMAS.get(idioma, idioma)} ({idioma}): {', '.join(sorted(usuarios))}"
+            for idioma, usuarios in sorted(idiomas.items())
+        )
     else:
         texto = "No hay idiomas registrados en este grupo."
-    await update.message.reply_text(f"Idiomas en este grupo:\n{texto}")
+    await gestor_envios.enviar(
+        update.effective_chat.id, update.message.reply_text, f"Idiomas en este grupo:\n{texto}"
+    )
+
+async def preparar_traduccion(context, chat_id, texto, idioma_origen, idioma_destino, user_ids, lote=None):
+    """
+    Obtiene las menciones y la traducción de un idioma destino en paralelo.
+    Si se pasa la tarea de un lote, usa su resultado y solo traduce por separado
+    cuando el idioma falta o viene mal formado.
+    """
+    log.debug("🔄 Traduciendo para idioma %s (%s usuarios)", idioma_destino, len(user_ids))
+
+    async def traducir():
+        if lote is not None:
+            traducciones = await lote
+            if idioma_destino in traducciones:
+                return traducciones[idioma_destino]
+            log.debug("↩️ Traduciendo %s por separado", idioma_destino)
+        return await etapas_pipeline["traduccion"].ejecutar(traducir_texto, texto, idioma_origen, idioma_destino)
+
+    nombres_usuarios, texto_traducido = await asyncio.gather(
+        obtener_nombres_usuarios(context, chat_id, user_ids, idioma_destino),
+        traducir(),
+    )
+    return nombres_usuarios, texto_traducido
+
+async def iterar_tareas(tareas):
+    """
+    Devuelve las tareas terminadas según van acabando o, si TRADUCCIONES_EN_ORDEN
+    está activo, en el orden original
+    """
+    if TRADUCCIONES_EN_ORDEN:
+        for tarea in tareas:
+            await asyncio.wait([tarea])
+            yield tarea
+        return
+
+    pendientes = set(tareas)
+    while pendientes:
+        hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+        for tarea in hechas:
+            yield tarea
+
+def clave_tts(texto, idioma, speaker):
+    """
+    Clave de caché para un audio sintetizado
+    """
+    return hashlib.sha256(f"{speaker}\0{idioma}\0{texto.strip()}".encode("utf-8")).hexdigest()
+
+def _sintetizar_pcm(texto, idioma):
+    """
+    Sintetiza con XTTS y devuelve PCM float32 en memoria junto a su sample rate
+    """
+    wav = tts.tts(text=texto, language=idioma, speaker=tts_speaker)
+    return np.asarray(wav, dtype=np.float32).tobytes(), tts.synthesizer.output_sample_rate
+
+async def codificar_opus(pcm, sample_rate):
+    """
+    Codifica PCM float32 mono a OGG/Opus (formato nativo de notas de voz) con ffmpeg por tuberías
+    """
+    proceso = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "f32le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", TTS_OPUS_BITRATE, "-application", "voip",
+        "-f", "ogg", "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    salida, errores = await proceso.communicate(pcm)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"ffmpeg falló: {errores.decode(errors='ignore').strip()}")
+    return salida
+
+async def sintetizar_voz(texto, idioma):
+    """
+    Devuelve el audio OGG/Opus de un texto, usando la caché si ya se sintetizó
+    """
+    clave = clave_tts(texto, idioma, tts_speaker)
+    audio = await cache_tts.obtener(clave)
+    if audio is not None:
+        log.debug("💾 Audio TTS en caché para %s", idioma)
+        return audio
+
+    loop = asyncio.get_running_loop()
+    with tramo("sintesis", idioma=idioma):
+        pcm, sample_rate = await loop.run_in_executor(executor_tts, _sintetizar_pcm, texto, idioma)
+    with tramo("codificacion"):
+        audio = await codificar_opus(pcm, sample_rate)
+    cache_tts.guardar(clave, audio)
+    log.debug("✅ Audio TTS generado (%.0f KB)", len(audio) / 1024)
+    return audio
+
+async def enviar_voz_tts(context, chat_id, texto, idioma, sintesis=None):
+    """
+    Envía la traducción como nota de voz, reutilizando el file_id de Telegram
+    si el mismo audio ya se subió antes. `sintesis` puede ser una tarea de
+    sintetizar_voz lanzada de antemano. Solo la síntesis pasa por su etapa: el
+    envío, que puede esperar a los límites de Telegram, no ocupa al worker.
+    """
+    clave = clave_tts(texto, idioma, tts_speaker)
+    file_id = await cache_tts_file_ids.obtener(clave)
+    if file_id is not None:
+        try:
+            await gestor_envios.enviar(chat_id, context.bot.send_voice, chat_id=chat_id, voice=file_id)
+            log.debug("♻️ Audio reenviado por file_id al chat %s", chat_id)
+            return
+        except Exception as e:
+            log.warning(f"⚠️ file_id no válido, se vuelve a subir el audio: {e}")
+
+    audio = await (sintesis or etapas_pipeline["sintesis"].ejecutar(sintetizar_voz, texto, idioma))
+    with tramo("envio_voz", idioma=idioma):
+        mensaje = await gestor_envios.enviar(chat_id, context.bot.send_voice, chat_id=chat_id, voice=audio)
+    if mensaje and mensaje.voice:
+        cache_tts_file_ids.guardar(clave, mensaje.voice.file_id)
+    log.debug("🔊 Audio enviado al chat %s", chat_id)
+
+PATRON_FRASES = re.compile(r"[^.!?;。！？…]+[.!?;。！？…]*\s*")
+
+def dividir_frases(texto, minimo=TTS_FRASE_MIN_CARACTERES):
+    """
+    Divide un texto en frases, uniendo las muy cortas para no enviar notas de voz diminutas
+    """
+    frases = []
+    actual = ""
+    for trozo in PATRON_FRASES.findall(texto):
+        actual += trozo
+        if len(actual.strip()) >= minimo:
+            frases.append(actual.strip())
+            actual = ""
+    if actual.strip():
+        if frases:
+            frases[-1] = f"{frases[-1]} {actual.strip()}"
+        else:
+            frases.append(actual.strip())
+    return frases
+
+# Tiempo hasta el primer audio enviado (TTFB) y total, para comparar modos de TTS
+metricas_tts = {"envios": 0, "frases": 0, "ttfb_total": 0.0, "ttfb_max": 0.0, "tiempo_total": 0.0}
+
+def registrar_metricas_tts(ttfb, total, frases):
+    metricas_tts["envios"] += 1
+    metricas_tts["frases"] += frases
+    metricas_tts["ttfb_total"] += ttfb
+    metricas_tts["ttfb_max"] = max(metricas_tts["ttfb_max"], ttfb)
+    metricas_tts["tiempo_total"] += total
+    log.debug("⏱️ TTS: primer audio en %.2fs, total %.2fs (%s frases)", ttfb, total, frases)
+
+async def enviar_voz_tts_por_frases(context, chat_id, texto, idioma):
+    """
+    Sintetiza y envía la traducción frase a frase: la primera nota de voz sale
+    en cuanto está lista y la síntesis de la siguiente se solapa con el envío
+    de la actual
+    """
+    inicio = time.monotonic()
+    frases = dividir_frases(texto)
+
+    def lanzar(frase):
+        # Si Telegram ya tiene el audio no hace falta sintetizarlo
+        if cache_tts_file_ids.contiene(clave_tts(frase, idioma, tts_speaker)):
+            return None
+        return asyncio.ensure_future(etapas_pipeline["sintesis"].ejecutar(sintetizar_voz, frase, idioma))
+
+    ttfb = None
+    siguiente = lanzar(frases[0])
+    try:
+        for i, frase in enumerate(frases):
+            actual = siguiente
+            siguiente = lanzar(frases[i + 1]) if i + 1 < len(frases) else None
+            await enviar_voz_tts(context, chat_id, frase, idioma, actual)
+            if ttfb is None:
+                ttfb = time.monotonic() - inicio
+    finally:
+        if siguiente is not None:
+            siguiente.cancel()
+    registrar_metricas_tts(ttfb, time.monotonic() - inicio, len(frases))
+
+async def enviar_audio_traduccion(context, chat_id, idioma_destino, texto_traducido):
+    """
+    Genera (en la etapa de síntesis) y envía el audio TTS de una traducción
+    """
+    try:
+        log.debug("🎤 Generando audio TTS para el idioma: %s", idioma_destino)
+        if TTS_STREAMING and len(dividir_frases(texto_traducido)) > 1:
+            await enviar_voz_tts_por_frases(context, chat_id, texto_traducido, idioma_destino)
+        else:
+            inicio = time.monotonic()
+            await enviar_voz_tts(context, chat_id, texto_traducido, idioma_destino)
+            duracion = time.monotonic() - inicio
+            registrar_metricas_tts(duracion, duracion, 1)
+    except Exception as e:
+        ERRORES.inc(etapa="tts")
+        log.error(f"❌ Error al generar o enviar el audio TTS: {e}")
+
+def tts_disponible(idioma_destino):
+    """
+    Indica si se puede generar audio para un idioma
+    """
+    if tts and tts_speaker and idioma_destino in IDIOMAS_SOPORTADOS_TTS:
+        return True
+    if tts:
+        log.warning(f"⚠️ Idioma {idioma_destino} no soportado por TTS")
+    return False
+
+async def descargar_audio(archivo):
+    """
+    Descarga el audio a memoria y calcula el hash de su contenido (etapa de descarga)
+    """
+    log.debug("⬇️ Descargando audio...")
+    with tramo("descarga"):
+        archivo_file = await archivo.get_file()
+        datos = await archivo_file.download_as_bytearray()
+        clave_contenido = f"sha256:{hashlib.sha256(datos).hexdigest()}"
+    return datos, clave_contenido
 
 # Manejar audios (voice o audio)
 async def manejar_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    print("🎵 Audio recibido, procesando...")
+    log.debug("🎵 Audio recibido, procesando...")
     
     archivo = update.message.voice or update.message.audio
     if not archivo:
-        print("❌ No se encontró archivo de audio")
-        await update.message.reply_text("No se encontró archivo de audio.")
+        log.error("❌ No se encontró archivo de audio")
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "No se encontró archivo de audio."
+        )
         return
 
     chat_id = str(update.message.chat_id)
-    
-    if update.effective_chat.type in ['group', 'supergroup']:
-        await verificar_y_limpiar_usuarios_inactivos(context, chat_id)
+    # La duración viene en el mensaje, así que se conoce antes de descargar
+    duracion = archivo.duration or 0
+
+    try:
+        if MODO_WORKERS:
+            await encolar_audio(update, chat_id, archivo)
+            return
+        # De la llegada del audio a la última respuesta, incluida la espera en el planificador
+        with tramo("audio_total"):
+            await planificador_audios.ejecutar(chat_id, duracion, lambda: procesar_audio(update, context, archivo))
+    except ColaLlena as e:
+        log.warning(f"⏳ {e}")
+        await gestor_envios.enviar(
+            update.effective_chat.id, update.message.reply_text, "⏳ Hay demasiados audios en cola, inténtalo de nuevo en unos minutos."
+        )
+
+async def encolar_audio(update, chat_id, archivo):
+    """
+    Pasa un audio a la cola de trabajos (modo con workers). El trabajo lleva el
+    update completo y los idiomas del chat, así el worker no depende del
+    estado en memoria de este proceso. Lanza ColaLlena si la cola no admite más.
+    """
+    datos = {
+        "chat_id": chat_id,
+        "file_id": archivo.file_id,
+        "duracion": archivo.duration or 0,
+        "participantes": repositorio_idiomas.idiomas_chat(chat_id),
+        "update": update.to_dict(),
+    }
+    id_trabajo = await en_cola(cola_trabajos.encolar, datos, chat_id, COLA_TRABAJOS_MAX, PLANIFICADOR_COLA_POR_CHAT)
+    if id_trabajo is None:
+        raise ColaLlena(f"Cola de trabajos llena (máximo {COLA_TRABAJOS_MAX}, {PLANIFICADOR_COLA_POR_CHAT} por chat)")
+    log.debug("📮 Audio encolado como trabajo %s", id_trabajo)
+
+async def leer_ventanas_audio(datos, ventana_s=VENTANA_AUDIO_S):
+    """
+    Decodifica el audio en memoria con ffmpeg por tuberías y lo entrega en
+    ventanas de `ventana_s` segundos (float32, mono, 16 kHz) sin tener el PCM
+    entero a la vez
+    """
+    async for ventana in decodificador.ventanas(datos, ventana_s):
+        yield ventana
+
+def energia_por_tramas(muestras, trama):
+    """
+    Energía RMS de cada trama de `trama` muestras
+    """
+    n = len(muestras) // trama * trama
+    return np.sqrt((muestras[:n].reshape(-1, trama) ** 2).mean(axis=1))
+
+def buscar_silencio(muestras, busqueda_s=5):
+    """
+    Devuelve el punto de corte más silencioso dentro de los últimos `busqueda_s` segundos
+    """
+    trama = int(0.03 * MUESTREO_WHISPER)
+    inicio = max(0, len(muestras) - int(busqueda_s * MUESTREO_WHISPER))
+    energia = energia_por_tramas(muestras[inicio:], trama)
+    if len(energia) == 0:
+        return len(muestras)
+    return inicio + int(np.argmin(energia)) * trama + trama // 2
+
+def tiene_voz(muestras):
+    """
+    VAD por energía: hay voz si al menos ~0,3 s superan el umbral
+    """
+    trama = int(0.03 * MUESTREO_WHISPER)
+    return int((energia_por_tramas(muestras, trama) > VAD_UMBRAL).sum()) >= 10
+
+async def segmentar_por_silencios(ventanas):
+    """
+    Convierte las ventanas fijas en segmentos que terminan en un silencio, para
+    no cortar palabras. Solo se arrastran unos segundos de una ventana a la
+    siguiente, así que la memoria no depende de la duración del audio.
+    """
+    pendiente = np.zeros(0, dtype=np.float32)
+    async for ventana in ventanas:
+        muestras = np.concatenate([pendiente, ventana])
+        corte = buscar_silencio(muestras)
+        segmento, pendiente = muestras[:corte], muestras[corte:]
+        if len(segmento):
+            yield segmento
+    if len(pendiente):
+        yield pendiente
+
+class MensajeProgresivo:
+    """
+    Mensaje de Telegram que se va ampliando mediante ediciones y continúa en
+    un mensaje nuevo al acercarse al límite de 4096 caracteres
+    """
+
+    LIMITE = 4000
+
+    def __init__(self, mensaje_origen, cabecera):
+        self.mensaje_origen = mensaje_origen
+        self.cabecera = cabecera
+        self.texto = ""
+        self.mensaje = None
+
+    async def agregar(self, trozo):
+        nuevo = f"{self.texto} {trozo}".strip()
+        if self.mensaje is not None and len(self.cabecera) + len(nuevo) > self.LIMITE:
+            self.mensaje = None
+            nuevo = trozo.strip()
+        self.texto = nuevo
+        contenido = f"{self.cabecera}{self.texto}"
+        chat_id = self.mensaje_origen.chat_id
+        if self.mensaje is None:
+            self.mensaje = await gestor_envios.enviar(chat_id, self.mensaje_origen.reply_text, contenido)
+        else:
+            await gestor_envios.enviar(chat_id, self.mensaje.edit_text, contenido)
+
+class PublicadorTraducciones:
+    """
+    Publica el texto original y las traducciones de un audio según MODO_TRADUCCIONES:
+    - "separado": un mensaje para el original y otro por idioma
+    - "editado": un único mensaje que se edita al llegar cada traducción
+    - "unido": un único mensaje con todo, enviado al terminar
+    Al pasar de LIMITE caracteres se continúa en un mensaje nuevo, y los bloques
+    más largos (p. ej. un audio largo servido desde la caché) se trocean.
+    """
+
+    LIMITE = MensajeProgresivo.LIMITE
+
+    @classmethod
+    def trocear(cls, bloque):
+        """
+        Parte un bloque en trozos de hasta LIMITE caracteres, cortando en espacios si se puede
+        """
+        trozos = []
+        while len(bloque) > cls.LIMITE:
+            corte = bloque.rfind(" ", 0, cls.LIMITE + 1)
+            if corte <= 0:
+                corte = cls.LIMITE
+            trozos.append(bloque[:corte].rstrip())
+            bloque = bloque[corte:].lstrip()
+        trozos.append(bloque)
+        return trozos
+
+    def __init__(self, mensaje_origen, remitente, texto, modo=None):
+        self.mensaje_origen = mensaje_origen
+        self.chat_id = mensaje_origen.chat_id
+        self.modo = modo or MODO_TRADUCCIONES
+        self.bloques = [f"📝 {remitente}: {texto}"]
+        self.mensaje = None
+        self.contenido = ""
+
+    async def _responder(self, contenido):
+        return await gestor_envios.enviar(self.chat_id, self.mensaje_origen.reply_text, contenido)
+
+    async def _publicar(self, bloque):
+        """
+        Envía un bloque en mensajes nuevos; el último queda como mensaje actual
+        """
+        for trozo in self.trocear(bloque):
+            self.contenido = trozo
+            self.mensaje = await self._responder(trozo)
+
+    async def iniciar(self):
+        if self.modo != "unido":
+            await self._publicar(self.bloques[0])
+
+    async def agregar(self, idioma_destino, nombres_usuarios, texto_traducido):
+        bloque = (
+            f"🌐 Para {', '.join(nombres_usuarios)} "
+            f"({NOMBRES_IDIOMAS.get(idioma_destino, idioma_destino)}): {texto_traducido}"
+        )
+        with tramo("envio_texto", idioma=idioma_destino):
+            if self.modo == "unido":
+                self.bloques.append(bloque)
+            elif self.modo == "editado" and self.mensaje is not None and len(self.contenido) + len(bloque) + 2 <= self.LIMITE:
+                self.contenido = f"{self.contenido}\n\n{bloque}"
+                await gestor_envios.enviar(self.chat_id, self.mensaje.edit_text, self.contenido)
+            else:
+                await self._publicar(bloque)
+
+    async def terminar(self):
+        if self.modo != "unido":
+            return
+        contenido = ""
+        for bloque in (trozo for bloque in self.bloques for trozo in self.trocear(bloque)):
+            if contenido and len(contenido) + len(bloque) + 2 > self.LIMITE:
+                await self._responder(contenido)
+                contenido = ""
+            contenido = f"{contenido}\n\n{bloque}" if contenido else bloque
+        await self._responder(contenido)
+
+async def traducir_a_idiomas(texto, idioma_origen, idiomas_destino):
+    """
+    Traduce un texto a varios idiomas (en lote si procede) y devuelve {idioma: traducción}
+    """
+    traducciones = {}
+    if TRADUCCION_LOTE and len(idiomas_destino) >= TRADUCCION_LOTE_MIN:
+        traducciones = await etapas_pipeline["traduccion"].ejecutar(traducir_lote, texto, idioma_origen, idiomas_destino)
+    faltantes = [idioma for idioma in idiomas_destino if idioma not in traducciones]
+    resultados = await asyncio.gather(*(
+        etapas_pipeline["traduccion"].ejecutar(traducir_texto, texto, idioma_origen, idioma) for idioma in faltantes
+    ))
+    traducciones.update(zip(faltantes, resultados))
+    return traducciones
+
+async def procesar_audio_largo(update, context, datos, participantes=None):
+    """
+    Transcribe un audio largo por segmentos: cada segmento terminado se traduce
+    y se añade a mensajes que se van editando. Devuelve el resultado completo.
+    """
+    chat_id = str(update.message.chat_id)
+    remitente = update.message.from_user.first_name
+    pista = idioma_remitente(update, participantes)
+    idioma_detectado = None
+    idioma_asr = None
+    original = None
+    traducciones = {}
+    textos = []
 
-    print("⬇️ Descargando audio...")
-    archivo_file = await archivo.get_file()
-    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp:
-        await archivo_file.download_to_drive(temp.name)
-        temp_path = temp.name
+    log.debug("📼 Audio largo: transcripción por segmentos")
+    async for segmento in segmentar_por_silencios(leer_ventanas_audio(datos)):
+        if not tiene_voz(segmento):
+            continue
+
+        # El idioma se fija en el primer segmento (pista o detección) para el resto
+        if idioma_asr is None:
+            resultado = await transcribir_con_pista(
+                segmento, len(segmento) / MUESTREO_WHISPER, pista, "transcripcion_segmento"
+            )
+        else:
+            with tramo("transcripcion_segmento", idioma=idioma_asr):
+                resultado = await etapas_pipeline["transcripcion"].ejecutar(
+                    pool_transcripcion.transcribir, segmento, {"language": idioma_asr}, len(segmento) / MUESTREO_WHISPER
+                )
+        texto = resultado["text"].strip()
+
+        if idioma_asr is None:
+            idioma_asr = resultado["language"]
+            idioma_detectado = normalizar_idioma(idioma_asr)
+            log.debug("🌐 Idioma detectado: %s", idioma_detectado)
+            usuarios_por_idioma = rutas_idiomas(chat_id, idioma_detectado, participantes)
+            if usuarios_por_idioma:
+                original = MensajeProgresivo(update.message, f"📝 {remitente}: ")
+                for idioma_destino, user_ids in usuarios_por_idioma.items():
+                    nombres = await obtener_nombres_usuarios(context, chat_id, user_ids, idioma_destino)
+                    traducciones[idioma_destino] = MensajeProgresivo(
+                        update.message,
+                        f"🌐 Para {', '.join(nombres)} ({NOMBRES_IDIOMAS.get(idioma_destino, idioma_destino)}): ",
+                    )
+            else:
+                log.debug("✅ No se necesita traducción, todos entienden el idioma.")
+
+        if not texto:
+            continue
+        textos.append(texto)
+        log.debug("📝 Segmento %s: %s", len(textos), texto)
+
+        if original is not None:
+            await original.agregar(texto)
+            traducidos = await traducir_a_idiomas(texto, idioma_detectado, list(traducciones))
+            for idioma_destino, mensaje in traducciones.items():
+                await mensaje.agregar(traducidos[idioma_destino])
+
+    return {"text": " ".join(textos), "language": idioma_detectado or ""}
+
+async def procesar_audio(update: Update, context: ContextTypes.DEFAULT_TYPE, archivo, participantes=None, propagar_errores=False):
+    """
+    Descarga, transcribe, traduce y responde un audio (ejecutado por el planificador
+    o por un worker). Cada paso pasa por su etapa del pipeline, así que mientras
+    un mensaje se traduce o sintetiza el siguiente ya puede estar transcribiéndose.
+    Con `propagar_errores` los fallos se lanzan en lugar de responder al chat,
+    para que el worker pueda reintentar el trabajo.
+    """
+    chat_id = str(update.message.chat_id)
+    # Idioma configurado por el remitente, usado como pista para Whisper
+    pista = idioma_remitente(update, participantes)
+
+    # Un mismo archivo reenviado a varios grupos conserva su file_unique_id
+    clave_archivo = f"id:{archivo.file_unique_id}"
+    resultado = await cache_transcripciones.obtener(clave_archivo)
 
     try:
-        print("🎯 Transcribiendo con Whisper...")
-        resultado = modelo_whisper.transcribe(temp_path)
-        texto = resultado["text"]
-        idioma_detectado = resultado["language"]
+        if resultado is not None:
+            log.debug("💾 Transcripción en caché, se omite la descarga")
+        else:
+            datos, clave_contenido = await etapas_pipeline["descarga"].ejecutar(descargar_audio, archivo)
 
-        print(f"📝 Transcripción: {texto}")
-        print(f"🌐 Idioma detectado: {idioma_detectado}")
+            # Si el id no coincide, probar con el hash del contenido
+            resultado = await cache_transcripciones.obtener(clave_contenido)
 
-        if chat_id not in idiomas:
-            idiomas[chat_id] = {}
+            if resultado is not None:
+                log.debug("💾 Transcripción en caché por contenido")
+            elif not await esperar_asr(update):
+                return
+            elif (archivo.duration or 0) >= AUDIO_LARGO_S:
+                # Los resultados se publican sobre la marcha; aquí solo queda guardarlos
+                resultado = await procesar_audio_largo(update, context, datos, participantes)
+                cache_transcripciones.guardar(clave_contenido, resultado)
+                cache_transcripciones.guardar(clave_archivo, resultado)
+                return
+            else:
+                with tramo("decodificacion"):
+                    audio = await decodificador.decodificar(datos)
+                log.debug("🎯 Transcribiendo con Whisper...")
+                try:
+                    transcripcion = await transcribir_con_pista(audio, len(audio) / MUESTREO_WHISPER, pista)
+                except ColaLlena as e:
+                    log.warning(f"⏳ {e}")
+                    if propagar_errores:
+                        raise
+                    await gestor_envios.enviar(
+                        chat_id, update.message.reply_text, "⏳ Hay demasiados audios en cola, inténtalo de nuevo en unos minutos."
+                    )
+                    return
+                resultado = {"text": transcripcion["text"], "language": transcripcion["language"]}
+                cache_transcripciones.guardar(clave_contenido, resultado)
+            cache_transcripciones.guardar(clave_archivo, resultado)
+
+        texto = resultado["text"]
+        idioma_detectado = normalizar_idioma(resultado["language"])
+
+        log.debug("📝 Transcripción: %s", texto)
+        log.debug("🌐 Idioma detectado: %s", idioma_detectado)
 
-        participantes = idiomas.get(chat_id, {})
-        usuarios_por_idioma = agrupar_usuarios_por_idioma(participantes, idioma_detectado)
+        usuarios_por_idioma = rutas_idiomas(chat_id, idioma_detectado, participantes)
 
-        print(f"👥 Participantes: {participantes}")
-        print(f"🗂️ Usuarios agrupados por idioma: {usuarios_por_idioma}")
+        log.debug("🗂️ Usuarios agrupados por idioma: %s", usuarios_por_idioma)
 
         if usuarios_por_idioma:
-            print("🔄 Hay usuarios que necesitan traducción")
+            log.debug("🔄 Hay usuarios que necesitan traducción")
             
             usuario_remitente = update.message.from_user
             
             # Enviar mensaje original
-            await update.message.reply_text(f"📝 {usuario_remitente.first_name}: {texto}")
+            publicador = PublicadorTraducciones(update.message, usuario_remitente.first_name, texto)
+            await publicador.iniciar()
             
-            for idioma_destino, user_ids in usuarios_por_idioma.items():
+            lote = None
+            if TRADUCCION_LOTE and len(usuarios_por_idioma) >= TRADUCCION_LOTE_MIN:
+                lote = asyncio.create_task(etapas_pipeline["traduccion"].ejecutar(
+                    traducir_lote, texto, idioma_detectado, list(usuarios_por_idioma)
+                ))
+
+            # Lanzar todas las traducciones a la vez; cada idioma falla por separado
+            tareas = {
+                asyncio.create_task(
+                    preparar_traduccion(context, chat_id, texto, idioma_detectado, idioma_destino, user_ids, lote)
+                ): idioma_destino
+                for idioma_destino, user_ids in usuarios_por_idioma.items()
+            }
+
+            # El texto se publica en cuanto llega; el audio pasa a la etapa de síntesis
+            sintesis = []
+            async for tarea in iterar_tareas(tareas):
+                idioma_destino = tareas[tarea]
                 try:
-                    print(f"🔄 Traduciendo para idioma {idioma_destino} ({len(user_ids)} usuarios)")
-                    
-                    nombres_usuarios = await obtener_nombres_usuarios(context, chat_id, user_ids)
-                    texto_traducido = await traducir_texto(texto, idioma_detectado, idioma_destino)
-                    
-                    mencion = f"Para {', '.join(nombres_usuarios)}"
-                    
-                    await update.message.reply_text(
-                        f"🌐 {mencion} ({NOMBRES_IDIOMAS.get(idioma_destino, idioma_destino)}): {texto_traducido}"
-                    )
-                    
-                    # --- INICIO: FUNCIONALIDAD TTS CORREGIDA ---
-                    if tts and tts_speaker and idioma_destino in IDIOMAS_SOPORTADOS_TTS:
-                        temp_audio_path = None
-                        try:
-                            print(f"🎤 Generando audio TTS para el idioma: {idioma_destino}")
-                            # Crear un archivo temporal para el audio de salida
-                            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-                                temp_audio_path = temp_audio.name
-                            
-                            # Generar el audio desde el texto traducido CON SPEAKER
-                            tts.tts_to_file(
-                                text=texto_traducido,
-                                language=idioma_destino,
-                                speaker=tts_speaker,  # ESTE ERA EL PARÁMETRO FALTANTE
-                                file_path=temp_audio_path
-                            )
-                            print(f"✅ Audio temporal generado en: {temp_audio_path}")
-                            
-                            # Enviar el audio como un mensaje de voz
-                            await context.bot.send_voice(
-                                chat_id=chat_id,
-                                voice=open(temp_audio_path, 'rb')
-                            )
-                            print(f"🔊 Audio enviado al chat {chat_id}")
-                            
-                        except Exception as e:
-                            print(f"❌ Error al generar o enviar el audio TTS: {e}")
-                        finally:
-                            # Asegurarse de eliminar el archivo temporal para no ocupar espacio
-                            if temp_audio_path and os.path.exists(temp_audio_path):
-                                os.unlink(temp_audio_path)
-                                print(f"🧹 Archivo de audio temporal eliminado: {temp_audio_path}")
-                    elif tts and idioma_destino not in IDIOMAS_SOPORTADOS_TTS:
-                        print(f"⚠️ Idioma {idioma_destino} no soportado por TTS")
-                    # --- FIN: FUNCIONALIDAD TTS CORREGIDA ---
-                    
+                    nombres_usuarios, texto_traducido = tarea.result()
+                    await publicador.agregar(idioma_destino, nombres_usuarios, texto_traducido)
+                    if tts_disponible(idioma_destino):
+                        sintesis.append(asyncio.create_task(
+                            enviar_audio_traduccion(context, chat_id, idioma_destino, texto_traducido)
+                        ))
                 except Exception as e:
-                    print(f"❌ Error al traducir para idioma {idioma_destino}: {e}")
-                    await update.message.reply_text(f"❌ Error al traducir para idioma {idioma_destino}")
+                    ERRORES.inc(etapa="traduccion")
+                    log.error(f"❌ Error al traducir para idioma {idioma_destino}: {e}")
+                    await gestor_envios.enviar(
+                        chat_id, update.message.reply_text, f"❌ Error al traducir para idioma {idioma_destino}"
+                    )
+            await publicador.terminar()
+            await asyncio.gather(*sintesis, return_exceptions=True)
         else:
-            print("✅ No se necesita traducción, todos entienden el idioma.")
+            log.debug("✅ No se necesita traducción, todos entienden el idioma.")
 
     except Exception as e:
-        print(f"❌ Error general en manejar_audio: {e}")
-        await update.message.reply_text("❌ Error al procesar el audio")
-    
-    finally:
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
-            print("🧹 Archivo de audio entrante temporal eliminado")
+        ERRORES.inc(etapa="audio")
+        log.error(f"❌ Error general en manejar_audio: {e}")
+        if propagar_errores:
+            raise
+        await gestor_envios.enviar(chat_id, update.message.reply_text, "❌ Error al procesar el audio")
 
 async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -671,21 +3186,23 @@ async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bot_agregado = any(member.id == context.bot.id for member in nuevos_miembros)
         
         if bot_agregado:
-            print(f"🎉 Bot agregado al grupo: {update.effective_chat.title}")
+            log.info(f"🎉 Bot agregado al grupo: {update.effective_chat.title}")
             texto_bienvenida = (
                 "¡Hola a todos! 👋 Soy su **asistente de traducción por voz**.\n\n"
                 "Mi trabajo es simple: cuando envíen una nota de voz, la transcribiré y la traduciré para aquellos que hablen un idioma diferente.\n\n"
                 f"{TEXTO_INSTRUCCIONES_BASICAS}\n\n"
                 "¡Estoy listo para romper las barreras del idioma! 🎤🌍"
             )
-            await update.message.reply_text(texto_bienvenida, parse_mode='Markdown')
+            await gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, texto_bienvenida, parse_mode='Markdown'
+            )
         else:
             # Si otros usuarios se unen al grupo, también mostrar instrucciones básicas
             nombres_nuevos = [member.first_name for member in nuevos_miembros if not member.is_bot]
             if nombres_nuevos:
                 # Verificar si estos usuarios ya estaban en el grupo antes
                 chat_id = str(update.effective_chat.id)
-                usuarios_existentes = set(idiomas.get(chat_id, {}).keys())
+                usuarios_existentes = set(repositorio_idiomas.idiomas_chat(chat_id))
                 
                 # Filtrar solo usuarios realmente nuevos (que no tienen idioma configurado)
                 usuarios_nuevos = []
@@ -698,10 +3215,12 @@ async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"¡Bienvenidos {', '.join(usuarios_nuevos)}! 👋\n\n"
                         f"{TEXTO_INSTRUCCIONES_BASICAS}"
                     )
-                    await update.message.reply_text(texto_nuevos, parse_mode='Markdown')
+                    await gestor_envios.enviar(
+                        update.effective_chat.id, update.message.reply_text, texto_nuevos, parse_mode='Markdown'
+                    )
                 
     except Exception as e:
-        print(f"❌ Error en función bienvenida: {e}")     
+        log.error(f"❌ Error en función bienvenida: {e}")     
         
         
 # Función adicional para manejar cuando el bot se añade a un grupo (alternativa)
@@ -713,7 +3232,7 @@ async def bot_agregado_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if update.message.new_chat_members:
             for member in update.message.new_chat_members:
                 if member.id == context.bot.id:
-                    print(f"🎉 Bot agregado al grupo: {update.effective_chat.title} ({update.effective_chat.id})")
+                    log.info(f"🎉 Bot agregado al grupo: {update.effective_chat.title} ({update.effective_chat.id})")
                     
                     texto_inicial = (
                         "¡Hola a todos! 👋 Soy su **asistente de traducción por voz**.\n\n"
@@ -726,17 +3245,128 @@ async def bot_agregado_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE)
                         "¡Estoy listo para romper las barreras del idioma! 🎤🌍"
                     )
                     
-                    await update.message.reply_text(texto_inicial, parse_mode='Markdown')
+                    await gestor_envios.enviar(
+                        update.effective_chat.id, update.message.reply_text, texto_inicial, parse_mode='Markdown'
+                    )
                     break
                     
     except Exception as e:
-        print(f"❌ Error al procesar bot agregado al grupo: {e}")
+        log.error(f"❌ Error al procesar bot agregado al grupo: {e}")
 
-# Main
-def main():
-    print("🚀 Iniciando bot...")
-    app = ApplicationBuilder().token(TOKEN).build()
+# --- Métricas de Prometheus ---
+
+CACHE_ACIERTOS = registro.contador("bot_cache_aciertos_total", "Aciertos por caché")
+CACHE_FALLOS = registro.contador("bot_cache_fallos_total", "Fallos por caché")
+CACHE_BYTES = registro.indicador("bot_cache_bytes", "Bytes en memoria por caché")
+ETAPA_EN_COLA = registro.indicador("bot_etapa_en_cola", "Trabajos esperando en cada etapa del pipeline")
+ETAPA_EN_SERVICIO = registro.indicador("bot_etapa_en_servicio", "Trabajos en curso en cada etapa del pipeline")
+ETAPA_RECHAZADOS = registro.contador("bot_etapa_rechazados_total", "Trabajos rechazados por cola llena")
+AUDIOS_EN_COLA = registro.indicador("bot_planificador_en_cola", "Audios esperando en el planificador")
+MODELO_LISTO = registro.indicador("bot_modelo_listo", "1 si el modelo está cargado")
+TRABAJOS = registro.indicador("bot_trabajos", "Trabajos en la cola del modo workers por estado")
+PISTA_IDIOMA = registro.contador("bot_asr_pista_idioma_total", "Transcripciones por uso de la pista de idioma")
+ENVIOS = registro.contador("bot_envios_total", "Llamadas de envío a la API de Telegram")
+ENVIOS_RETRY_AFTER = registro.contador("bot_envios_retry_after_total", "Respuestas 429 (RetryAfter) de Telegram")
+DECODIFICACION_EN_FRIO = registro.contador(
+    "bot_decodificacion_en_frio_total", "Audios que no encontraron un ffmpeg precalentado en el pool"
+)
+
+@registro.recolector
+def recolectar_metricas():
+    """
+    Copia a las métricas los contadores que ya llevan cachés, etapas y colas
+    """
+    for cache in caches:
+        CACHE_ACIERTOS.fijar(cache.aciertos, cache=cache.nombre)
+        CACHE_FALLOS.fijar(cache.fallos, cache=cache.nombre)
+        CACHE_BYTES.fijar(cache.bytes_usados, cache=cache.nombre)
+    CACHE_ACIERTOS.fijar(cache_miembros.aciertos, cache="miembros")
+    CACHE_FALLOS.fijar(cache_miembros.fallos, cache="miembros")
+    for nombre, etapa in etapas_pipeline.items():
+        m = etapa.metricas()
+        ETAPA_EN_COLA.fijar(m["en_cola"], etapa=nombre)
+        ETAPA_EN_SERVICIO.fijar(m["en_servicio"], etapa=nombre)
+        ETAPA_RECHAZADOS.fijar(m["rechazados"], etapa=nombre)
+    AUDIOS_EN_COLA.fijar(planificador_audios.metricas()["en_cola"])
+    for nombre, estado_modelo in estado_modelos.items():
+        MODELO_LISTO.fijar(int(estado_modelo == "listo"), modelo=nombre)
+    for resultado, cantidad in metricas_pista.items():
+        PISTA_IDIOMA.fijar(cantidad, resultado=resultado)
+    e = gestor_envios.metricas()
+    ENVIOS.fijar(e["envios"])
+    ENVIOS_RETRY_AFTER.fijar(e["retry_after"])
+    DECODIFICACION_EN_FRIO.fijar(decodificador.metricas()["en_frio"])
+    if cola_trabajos is not None:
+        for estado_trabajo, cantidad in conteos_trabajos.items():
+            TRABAJOS.fijar(cantidad, estado=estado_trabajo)
+
+tareas_fondo = []
+servidores_fondo = []
+
+async def al_iniciar(app):
+    """
+    Arranca las tareas de fondo una vez existe el event loop
+    """
+    registrar_fase("importación y configuración", INICIO_PROCESO)
+    repositorio_idiomas.iniciar_escritor()
+    for cache in caches:
+        cache.iniciar_escritor()
+    if not MODO_WORKERS:
+        # En modo con workers los modelos solo se cargan en los workers
+        iniciar_carga_modelos()
+        await decodificador.iniciar()
+    tareas_fondo.append(asyncio.create_task(barrido_miembros_periodico(app)))
+    if MODO_WORKERS:
+        tareas_fondo.append(asyncio.create_task(vigilar_cola_trabajos()))
+    if limpieza_chats.pendiente():
+        log.info("🧹 Reanudando la limpieza de chats interrumpida")
+        limpieza_chats.iniciar(app.bot)
+    if LIMPIEZA_INTERVALO_H:
+        tareas_fondo.append(asyncio.create_task(limpieza_periodica(app)))
+    if METRICAS_PUERTO:
+        try:
+            servidores_fondo.append(await servir_metricas(METRICAS_HOST, METRICAS_PUERTO))
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo abrir el puerto de métricas {METRICAS_PUERTO}: {e}")
 
+async def al_detener(app):
+    """
+    Vuelca a disco todo lo pendiente antes de salir
+    """
+    for tarea in tareas_fondo:
+        tarea.cancel()
+    await limpieza_chats.detener()
+    await decodificador.detener()
+    for servidor in servidores_fondo:
+        servidor.close()
+    for etapa in etapas_pipeline.values():
+        await etapa.detener()
+    await repositorio_idiomas.detener_escritor()
+    for cache in caches:
+        await cache.detener_escritor()
+
+def configurar_logs():
+    logging.basicConfig(level=LOG_NIVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # httpx registra cada petición a la Bot API como INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def construir_app(token=TOKEN):
+    """
+    Crea la aplicación con todos los handlers registrados
+    """
+    builder = ApplicationBuilder().token(token).post_init(al_iniciar).post_shutdown(al_detener)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if UPDATES_CONCURRENTES:
+        builder = builder.concurrent_updates(ProcesadorUpdatesPorChat(UPDATES_CONCURRENTES))
+    app = builder.build()
+    registrar_handlers(app)
+    return app
+
+def registrar_handlers(app):
+    """
+    Registra los handlers del bot en una aplicación ya construida
+    """
     # Comandos básicos
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("ayuda", ayuda))
@@ -744,9 +3374,13 @@ def main():
     app.add_handler(CommandHandler("idioma", idioma))
     app.add_handler(CommandHandler("mostrar_idiomas", mostrar_idiomas))
     app.add_handler(CommandHandler("limpiar_json", comando_limpiar_json))
+    app.add_handler(CommandHandler("estado", estado))
     
     # Handlers de mensajes
-    app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, manejar_audio))
+    # block=False: la transcripción corre en el pool y no debe frenar el resto de updates.
+    # Por eso los audios quedan fuera del candado por chat: el handler lo suelta al
+    # momento y es el planificador quien los atiende en orden de llegada.
+    app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, manejar_audio, block=False))
     
     # IMPORTANTE: Estos handlers deben estar activos para que funcione la bienvenida
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, bienvenida))
@@ -754,9 +3388,27 @@ def main():
     
     # Handler para cambios de miembros
     app.add_handler(ChatMemberHandler(manejar_cambio_miembros, ChatMemberHandler.CHAT_MEMBER))
-    
-    print("Bot en marcha...")
-    app.run_polling()
+
+# Main
+def main():
+    configurar_logs()
+    log.info("🚀 Iniciando bot...")
+    app = construir_app()
+
+    if MODO_INGESTA == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("❌ MODO_INGESTA=webhook necesita WEBHOOK_URL")
+        log.info(f"Bot en marcha (webhook en {WEBHOOK_ESCUCHA}:{WEBHOOK_PUERTO}/{WEBHOOK_RUTA})...")
+        app.run_webhook(
+            listen=WEBHOOK_ESCUCHA,
+            port=WEBHOOK_PUERTO,
+            url_path=WEBHOOK_RUTA,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_RUTA}",
+            secret_token=WEBHOOK_SECRETO,
+        )
+    else:
+        log.info("Bot en marcha...")
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Cola de trabajos persistente en SQLite para el modo con workers.
+
+El bot de Telegram encola cada audio y uno o varios procesos worker lo
+consumen. Un trabajo tomado queda "en_proceso" durante `visibilidad_s`, plazo
+que el worker renueva mientras lo procesa. Si el worker lo confirma pasa a
+"hecho", si falla vuelve a "pendiente" con espera creciente y, agotados los
+reintentos, pasa a "muerto" (dead-letter). Si el worker muere sin confirmar,
+deja de renovar el plazo y el trabajo vuelve a estar disponible al vencer.
+
+La cola puede limitarse en total y por chat al encolar, y al tomar se da
+preferencia a los chats con menos trabajos en proceso, para que un grupo muy
+activo no ocupe a todos los workers.
+
+La misma base guarda los cupos de envío a Telegram (token buckets por chat y
+global) para que el bot y todos los workers respeten juntos los límites.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+
+ESTADOS = ("pendiente", "en_proceso", "hecho", "muerto")
+
+
+class ColaTrabajos:
+    def __init__(self, ruta_db, max_intentos=3, visibilidad_s=600, espera_base_s=5):
+        self.max_intentos = max_intentos
+        self.visibilidad_s = visibilidad_s
+        self.espera_base_s = espera_base_s
+        # isolation_level=None: las transacciones se abren a mano con BEGIN IMMEDIATE
+        self.db = sqlite3.connect(ruta_db, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS trabajos ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, datos TEXT NOT NULL, "
+            "estado TEXT NOT NULL DEFAULT 'pendiente', intentos INTEGER NOT NULL DEFAULT 0, "
+            "disponible_en REAL NOT NULL, vence_en REAL, tomado_por TEXT, error TEXT, "
+            "creado REAL NOT NULL, terminado REAL, chat_id TEXT)"
+        )
+        # Bases creadas antes de que existiera la columna chat_id
+        if "chat_id" not in {fila[1] for fila in self.db.execute("PRAGMA table_info(trabajos)")}:
+            self.db.execute("ALTER TABLE trabajos ADD COLUMN chat_id TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, disponible_en)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS trabajos_chat ON trabajos (chat_id, estado)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cupos_envio ("
+            "clave TEXT PRIMARY KEY, tokens REAL NOT NULL, ultimo REAL NOT NULL, "
+            "pausa_hasta REAL NOT NULL DEFAULT 0) WITHOUT ROWID"
+        )
+
+    def encolar(self, datos, chat_id=None, max_total=None, max_por_chat=None):
+        """
+        Añade un trabajo y devuelve su id, o None si ya hay `max_total`
+        trabajos sin terminar (o `max_por_chat` del mismo chat)
+        """
+        ahora = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if max_total is not None:
+                total, = self.db.execute(
+                    "SELECT COUNT(*) FROM trabajos WHERE estado IN ('pendiente', 'en_proceso')"
+                ).fetchone()
+                if total >= max_total:
+                    self.db.execute("COMMIT")
+                    return None
+            if max_por_chat is not None and chat_id is not None:
+                en_chat, = self.db.execute(
+                    "SELECT COUNT(*) FROM trabajos WHERE chat_id = ? AND estado IN ('pendiente', 'en_proceso')",
+                    (chat_id,),
+                ).fetchone()
+                if en_chat >= max_por_chat:
+                    self.db.execute("COMMIT")
+                    return None
+            cursor = self.db.execute(
+                "INSERT INTO trabajos (datos, disponible_en, creado, chat_id) VALUES (?, ?, ?, ?)",
+                (json.dumps(datos, ensure_ascii=False), ahora, ahora, chat_id),
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid
+
+    def tomar(self, worker):
+        """
+        Reserva el siguiente trabajo disponible. Devuelve (id, datos, intento) o None.
+        """
+        ahora = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Trabajos de workers caídos: se recuperan o, sin intentos, se descartan
+            self.db.execute(
+                "UPDATE trabajos SET estado = 'muerto', error = 'plazo de proceso vencido', terminado = ? "
+                "WHERE estado = 'en_proceso' AND vence_en <= ? AND intentos >= ?",
+                (ahora, ahora, self.max_intentos),
+            )
+            self.db.execute(
+                "UPDATE trabajos SET estado = 'pendiente', disponible_en = ? "
+                "WHERE estado = 'en_proceso' AND vence_en <= ?",
+                (ahora, ahora),
+            )
+            # Primero los chats con menos trabajos en proceso; dentro de cada chat, en orden
+            fila = self.db.execute(
+                "SELECT id, datos, intentos FROM trabajos AS t WHERE estado = 'pendiente' AND disponible_en <= ? "
+                "ORDER BY (SELECT COUNT(*) FROM trabajos WHERE chat_id = t.chat_id AND estado = 'en_proceso'), "
+                "disponible_en, id LIMIT 1",
+                (ahora,),
+            ).fetchone()
+            if fila is None:
+                self.db.execute("COMMIT")
+                return None
+            id_trabajo, datos, intentos = fila
+            self.db.execute(
+                "UPDATE trabajos SET estado = 'en_proceso', intentos = ?, vence_en = ?, tomado_por = ? WHERE id = ?",
+                (intentos + 1, ahora + self.visibilidad_s, worker, id_trabajo),
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return id_trabajo, json.loads(datos), intentos + 1
+
+    def renovar(self, id_trabajo, worker):
+        """
+        Alarga el plazo de un trabajo en proceso (latido del worker que lo
+        tiene). Devuelve False si el trabajo ya no es de este worker.
+        """
+        cursor = self.db.execute(
+            "UPDATE trabajos SET vence_en = ? WHERE id = ? AND estado = 'en_proceso' AND tomado_por = ?",
+            (time.time() + self.visibilidad_s, id_trabajo, worker),
+        )
+        return cursor.rowcount > 0
+
+    def confirmar(self, id_trabajo):
+        """
+        Marca un trabajo como terminado (ack)
+        """
+        self.db.execute(
+            "UPDATE trabajos SET estado = 'hecho', error = NULL, terminado = ? WHERE id = ?",
+            (time.time(), id_trabajo),
+        )
+
+    def fallar(self, id_trabajo, error):
+        """
+        Devuelve el trabajo a la cola con espera exponencial, o lo pasa a
+        "muerto" si ya agotó sus intentos. Devuelve True si se reintentará.
+        """
+        ahora = time.time()
+        intentos, = self.db.execute("SELECT intentos FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+        if intentos >= self.max_intentos:
+            self.db.execute(
+                "UPDATE trabajos SET estado = 'muerto', error = ?, terminado = ? WHERE id = ?",
+                (str(error), ahora, id_trabajo),
+            )
+            return False
+        self.db.execute(
+            "UPDATE trabajos SET estado = 'pendiente', error = ?, disponible_en = ? WHERE id = ?",
+            (str(error), ahora + self.espera_base_s * 2 ** (intentos - 1), id_trabajo),
+        )
+        return True
+
+    def reencolar_muertos(self):
+        """
+        Vuelve a poner en cola los trabajos muertos, con los intentos a cero
+        """
+        cursor = self.db.execute(
+            "UPDATE trabajos SET estado = 'pendiente', intentos = 0, disponible_en = ?, terminado = NULL "
+            "WHERE estado = 'muerto'",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+    def purgar_hechos(self, antiguedad_s=86400):
+        cursor = self.db.execute(
+            "DELETE FROM trabajos WHERE estado = 'hecho' AND terminado < ?", (time.time() - antiguedad_s,)
+        )
+        self.db.execute("DELETE FROM cupos_envio WHERE ultimo < ? AND pausa_hasta < ?", (time.time() - 3600,) * 2)
+        return cursor.rowcount
+
+    def reservar_envio(self, cupos):
+        """
+        Toma a la vez un permiso de cada token bucket `(clave, tasa, rafaga)`.
+        Devuelve 0 si lo consiguió o los segundos que hay que esperar (por
+        falta de permisos o por una pausa de RetryAfter) antes de reintentar.
+        """
+        ahora = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            espera = 0.0
+            filas = []
+            for clave, tasa, rafaga in cupos:
+                fila = self.db.execute(
+                    "SELECT tokens, ultimo, pausa_hasta FROM cupos_envio WHERE clave = ?", (clave,)
+                ).fetchone()
+                tokens, ultimo, pausa_hasta = fila or (rafaga, ahora, 0.0)
+                tokens = min(rafaga, tokens + (ahora - ultimo) * tasa)
+                espera = max(espera, pausa_hasta - ahora, (1 - tokens) / tasa)
+                filas.append([clave, tokens, ahora, pausa_hasta])
+            if espera <= 0:
+                for fila in filas:
+                    fila[1] -= 1
+            self.db.executemany("INSERT OR REPLACE INTO cupos_envio VALUES (?, ?, ?, ?)", filas)
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return max(espera, 0.0)
+
+    def pausar_envios(self, clave, segundos):
+        """
+        Pausa los envíos a `clave` en todos los procesos (RetryAfter de Telegram)
+        """
+        hasta = time.time() + segundos
+        self.db.execute(
+            "INSERT INTO cupos_envio VALUES (?, 0, ?, ?) "
+            "ON CONFLICT (clave) DO UPDATE SET pausa_hasta = MAX(pausa_hasta, excluded.pausa_hasta)",
+            (clave, time.time(), hasta),
+        )
+
+    def metricas(self):
+        conteos = dict.fromkeys(ESTADOS, 0)
+        conteos.update(self.db.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado"))
+        return conteos
+
+
+def nombre_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
@@ -0,0 +1,229 @@
+"""
+Decodificación en memoria de notas de voz (OGG/Opus) a float32 mono.
+
+El audio descargado nunca pasa por disco: los bytes entran a ffmpeg por stdin
+y el PCM sale por stdout. En modo "pool" se mantienen `tamano_pool` procesos
+ffmpeg ya arrancados y esperando en stdin, así el arranque de ffmpeg (fork,
+carga de bibliotecas y códecs) queda fuera del camino de cada mensaje. Cada
+proceso decodifica un solo audio y se repone en segundo plano. En modo
+"pyav" se decodifica dentro del proceso con PyAV (libavcodec), sin
+subprocesos; si PyAV no está instalado se usa el pool.
+"""
+import io
+import time
+import asyncio
+import logging
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger("bot.decodificador")
+
+MODOS = ("pool", "ffmpeg", "pyav")
+
+
+def pcm_a_float(datos):
+    """
+    Convierte PCM s16le a float32 en [-1, 1)
+    """
+    return np.frombuffer(datos, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def decodificar_pyav(datos, muestreo):
+    """
+    Decodifica un audio en memoria con PyAV y lo remuestrea a s16 mono
+    """
+    import av
+
+    partes = []
+    with av.open(io.BytesIO(datos)) as contenedor:
+        remuestreador = av.AudioResampler(format="s16", layout="mono", rate=muestreo)
+        for trama in contenedor.decode(audio=0):
+            partes.extend(salida.to_ndarray().reshape(-1) for salida in remuestreador.resample(trama))
+        # Vaciar lo que el remuestreador aún retiene
+        partes.extend(salida.to_ndarray().reshape(-1) for salida in remuestreador.resample(None))
+    if not partes:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(partes).astype(np.float32) / 32768.0
+
+
+class Decodificador:
+    def __init__(self, modo="pool", tamano_pool=2, muestreo=16000):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de decodificación desconocido: {modo} (usa {', '.join(MODOS)})")
+        self.modo = modo
+        self.tamano_configurado = tamano_pool
+        self.tamano_pool = tamano_pool if modo == "pool" else 0
+        self.muestreo = muestreo
+        self.listos = deque()  # procesos ffmpeg arrancados esperando datos en stdin
+        self.reponiendo = set()
+        self.detenido = False
+        self.decodificados = 0
+        self.en_frio = 0  # audios que tuvieron que arrancar su propio ffmpeg
+        self.errores = 0
+        self.tiempo_total = 0.0
+
+    def _comando(self):
+        return (
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(self.muestreo), "pipe:1",
+        )
+
+    async def _lanzar(self):
+        return await asyncio.create_subprocess_exec(
+            *self._comando(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    async def _agregar_listo(self):
+        try:
+            proceso = await self._lanzar()
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo arrancar ffmpeg para el pool de decodificación: {e}")
+            return
+        if self.detenido:
+            proceso.kill()
+            await proceso.wait()
+            return
+        self.listos.append(proceso)
+
+    def _reponer(self):
+        """
+        Arranca en segundo plano los procesos que faltan para llenar el pool
+        """
+        while not self.detenido and len(self.listos) + len(self.reponiendo) < self.tamano_pool:
+            tarea = asyncio.create_task(self._agregar_listo())
+            self.reponiendo.add(tarea)
+            tarea.add_done_callback(self.reponiendo.discard)
+
+    async def _tomar(self):
+        """
+        Devuelve un proceso ffmpeg listo del pool o, si no queda ninguno, uno nuevo
+        """
+        proceso = None
+        while self.listos:
+            candidato = self.listos.popleft()
+            if candidato.returncode is None:
+                proceso = candidato
+                break
+        self._reponer()
+        if proceso is None:
+            if self.tamano_pool:
+                self.en_frio += 1
+            proceso = await self._lanzar()
+        return proceso
+
+    async def iniciar(self):
+        """
+        Comprueba PyAV (modo "pyav") y precalienta el pool
+        """
+        if self.modo == "pyav":
+            try:
+                import av  # noqa: F401
+            except ImportError:
+                log.warning("⚠️ PyAV no está instalado (pip install av), se decodifica con el pool de ffmpeg")
+                self.modo = "pool"
+                self.tamano_pool = self.tamano_configurado
+        self.detenido = False
+        self._reponer()
+        if self.reponiendo:
+            await asyncio.gather(*list(self.reponiendo))
+            log.debug("🎞️ Pool de decodificación con %s procesos ffmpeg", len(self.listos))
+
+    async def detener(self):
+        self.detenido = True
+        for tarea in list(self.reponiendo):
+            tarea.cancel()
+        while self.listos:
+            proceso = self.listos.popleft()
+            if proceso.returncode is None:
+                proceso.kill()
+            await proceso.wait()
+
+    async def decodificar(self, datos):
+        """
+        Decodifica un audio completo en memoria a float32 mono a `muestreo` Hz
+        """
+        inicio = time.perf_counter()
+        try:
+            if self.modo == "pyav":
+                audio = await asyncio.get_running_loop().run_in_executor(
+                    None, decodificar_pyav, datos, self.muestreo
+                )
+            else:
+                proceso = await self._tomar()
+                salida, errores = await proceso.communicate(datos)
+                if proceso.returncode != 0:
+                    raise RuntimeError(f"ffmpeg falló: {errores.decode(errors='ignore').strip()}")
+                audio = pcm_a_float(salida)
+        except Exception:
+            self.errores += 1
+            raise
+        self.decodificados += 1
+        self.tiempo_total += time.perf_counter() - inicio
+        return audio
+
+    @staticmethod
+    async def _leer_errores(proceso, maximo=4096):
+        """
+        Vacía stderr para que ffmpeg no se bloquee y conserva los últimos `maximo` bytes
+        """
+        errores = b""
+        while trozo := await proceso.stderr.read(65536):
+            errores = (errores + trozo)[-maximo:]
+        return errores
+
+    async def ventanas(self, datos, ventana_s):
+        """
+        Decodifica un audio en memoria y lo entrega en ventanas de `ventana_s`
+        segundos sin tener el PCM completo a la vez. Siempre usa ffmpeg (del
+        pool si lo hay): la entrada se escribe por stdin mientras se lee stdout
+        y stderr. Si ffmpeg termina con error se lanza RuntimeError después de
+        las ventanas que sí pudo decodificar.
+        """
+        proceso = await self._tomar()
+
+        async def escribir():
+            try:
+                proceso.stdin.write(datos)
+                await proceso.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                proceso.stdin.close()
+
+        escritor = asyncio.create_task(escribir())
+        errores = asyncio.create_task(self._leer_errores(proceso))
+        bytes_ventana = int(ventana_s * self.muestreo) * 2
+        try:
+            while True:
+                try:
+                    pcm = await proceso.stdout.readexactly(bytes_ventana)
+                except asyncio.IncompleteReadError as e:
+                    pcm = e.partial
+                if pcm:
+                    yield pcm_a_float(pcm)
+                if len(pcm) < bytes_ventana:
+                    break
+            await proceso.wait()
+            if proceso.returncode != 0:
+                self.errores += 1
+                raise RuntimeError(f"ffmpeg falló: {(await errores).decode(errors='ignore').strip()}")
+        finally:
+            if proceso.returncode is None:
+                proceso.kill()
+            escritor.cancel()
+            errores.cancel()
+            await proceso.wait()
+
+    def metricas(self):
+        return {
+            "modo": self.modo,
+            "listos": len(self.listos),
+            "decodificados": self.decodificados,
+            "en_frio": self.en_frio,
+            "errores": self.errores,
+            "tiempo_medio": self.tiempo_total / self.decodificados if self.decodificados else 0.0,
+        }
@@ -0,0 +1,184 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+`tramo(etapa, ...)` mide una etapa (descarga, transcripción, traducción...)
+y la anota en un histograma por etapa e idioma; si la etapa lanza una
+excepción cuenta además un error. `servir_metricas` expone todo en
+http://host:puerto/metrics.
+
+Los contadores e histogramas se actualizan desde el event loop, no desde
+hilos del pool.
+"""
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger("bot.metricas")
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas) + "}"
+
+
+def _formatear_valor(valor):
+    return repr(float(valor)) if valor != float("inf") else "+Inf"
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.valores = {}  # etiquetas ordenadas -> valor
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        self.valores[clave] = self.valores.get(clave, 0) + valor
+
+    def fijar(self, valor, **etiquetas):
+        """Copia un valor que ya se cuenta en otro objeto (cachés, colas...)"""
+        self.valores[tuple(sorted(etiquetas.items()))] = valor
+
+    def muestras(self):
+        for etiquetas, valor in self.valores.items():
+            yield self.nombre, etiquetas, valor
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(buckets)
+        self.series = {}  # etiquetas ordenadas -> [conteos por bucket, suma, total]
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        serie = self.series.get(clave)
+        if serie is None:
+            serie = self.series[clave] = [[0] * len(self.buckets), 0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def muestras(self):
+        for etiquetas, (conteos, suma, total) in self.series.items():
+            for limite, conteo in zip(self.buckets, conteos):
+                yield f"{self.nombre}_bucket", etiquetas + (("le", _formatear_valor(limite)),), conteo
+            yield f"{self.nombre}_bucket", etiquetas + (("le", "+Inf"),), total
+            yield f"{self.nombre}_sum", etiquetas, suma
+            yield f"{self.nombre}_count", etiquetas, total
+
+
+class Indicador(Contador):
+    """
+    Valor instantáneo (gauge) que se lee al exportar
+    """
+
+    tipo = "gauge"
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+        self.recolectores = []
+
+    def _agregar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda):
+        return self._agregar(Contador(nombre, ayuda))
+
+    def indicador(self, nombre, ayuda):
+        return self._agregar(Indicador(nombre, ayuda))
+
+    def histograma(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        return self._agregar(Histograma(nombre, ayuda, buckets))
+
+    def recolector(self, funcion):
+        """
+        Registra una función que actualiza métricas justo antes de exportarlas
+        """
+        self.recolectores.append(funcion)
+        return funcion
+
+    def exponer(self):
+        for funcion in self.recolectores:
+            try:
+                funcion()
+            except Exception as e:
+                log.warning(f"⚠️ Error en un recolector de métricas: {e}")
+        lineas = []
+        for metrica in self.metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            for nombre, etiquetas, valor in metrica.muestras():
+                lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_valor(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+DURACION_ETAPAS = registro.histograma("bot_etapa_duracion_segundos", "Duración de cada etapa por idioma")
+ERRORES = registro.contador("bot_errores_total", "Errores por etapa")
+
+
+@contextmanager
+def tramo(etapa, **etiquetas):
+    """
+    Mide una etapa. Las etiquetas pueden completarse dentro del bloque
+    (p. ej. el idioma detectado) a través del diccionario que devuelve.
+    """
+    datos = dict(etiquetas)
+    inicio = time.perf_counter()
+    try:
+        yield datos
+    except Exception:
+        ERRORES.inc(etapa=etapa)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        DURACION_ETAPAS.observar(duracion, etapa=etapa, **datos)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"⏱️ {etapa} {duracion * 1000:.0f} ms {datos}")
+
+
+async def servir_metricas(host, puerto, registro=registro):
+    """
+    Servidor HTTP mínimo que responde GET /metrics
+    """
+
+    async def atender(lector, escritor):
+        try:
+            peticion = await lector.readline()
+            while (await lector.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            partes = peticion.decode(errors="ignore").split()
+            if len(partes) >= 2 and partes[0] == "GET" and partes[1].split("?")[0] == "/metrics":
+                cuerpo = registro.exponer().encode()
+                cabecera = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            else:
+                cuerpo = b"Not Found\n"
+                cabecera = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            escritor.write(f"{cabecera}Content-Length: {len(cuerpo)}\r\nConnection: close\r\n\r\n".encode() + cuerpo)
+            await escritor.drain()
+        finally:
+            escritor.close()
+
+    servidor = await asyncio.start_server(atender, host, puerto)
+    log.info(f"📈 Métricas en http://{host}:{puerto}/metrics")
+    return servidor
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Las bases de datos del bot se crean al importarlo: que no caigan en el repo
+_directorio = tempfile.mkdtemp(prefix="bot-tests-")
+for variable, archivo in (
+    ("IDIOMAS_DB", "idiomas.db"),
+    ("CACHE_TRANSCRIPCION_DB", "cache.db"),
+    ("CACHE_TTS_DB", "cache.db"),
+    ("COLA_TRABAJOS_DB", "trabajos.db"),
+):
+    os.environ.setdefault(variable, os.path.join(_directorio, archivo))
+os.environ.setdefault("METRICAS_PUERTO", "0")
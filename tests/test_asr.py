@@ -0,0 +1,72 @@
+import sys
+import types
+
+import numpy as np
+
+from asr import MUESTREO, MotorFasterWhisper
+
+
+class ModeloFalso:
+    """
+    faster-whisper falso: una ventana con señal produce "hola"; una de
+    silencio, lo que Whisper devuelve sin voz (no_speech_prob alta)
+    """
+
+    hf_tokenizer = None
+
+    def __init__(self):
+        self.model = self
+        self.is_multilingual = True
+
+    def feature_extractor(self, ventana):
+        return np.full((80, 3000), np.abs(ventana).max(), dtype=np.float32)
+
+    def generate(self, caracteristicas, prompts, **opciones):
+        assert opciones.get("return_no_speech_prob")
+        return [
+            types.SimpleNamespace(sequences_ids=[[1, 2, 3]], scores=[-0.2], no_speech_prob=0.01)
+            if ventana.max() > 0 else
+            types.SimpleNamespace(sequences_ids=[[4, 5]], scores=[-1.8], no_speech_prob=0.95)
+            for ventana in caracteristicas
+        ]
+
+
+class TokenizadorFalso:
+    def __init__(self, *args, **kwargs):
+        self.sot_sequence = (0,)
+        self.no_timestamps = 9
+
+    def decode(self, tokens):
+        return "hola" if tokens == [1, 2, 3] else "Subtítulos por la comunidad"
+
+
+def crear_motor(monkeypatch):
+    monkeypatch.setitem(sys.modules, "ctranslate2", types.SimpleNamespace(
+        StorageView=types.SimpleNamespace(from_array=lambda array: array)
+    ))
+    monkeypatch.setitem(sys.modules, "faster_whisper", types.ModuleType("faster_whisper"))
+    monkeypatch.setitem(sys.modules, "faster_whisper.tokenizer", types.SimpleNamespace(Tokenizer=TokenizadorFalso))
+    motor = MotorFasterWhisper.__new__(MotorFasterWhisper)
+    motor.hilos = 0
+    motor.modelos = {"falso": ModeloFalso()}
+    motor.transcritos_uno_a_uno = []
+
+    def transcribir(audio, nombre_modelo, opciones=None):
+        motor.transcritos_uno_a_uno.append(len(audio) / MUESTREO)
+        return {"text": "largo", "language": "es", "confianza": 1.0}
+
+    motor.transcribir = transcribir
+    return motor
+
+
+def test_lote_descarta_audio_corto_sin_voz_y_deja_los_largos_a_transcribir(monkeypatch):
+    motor = crear_motor(monkeypatch)
+    voz = np.full(5 * MUESTREO, 0.1, dtype=np.float32)
+    silencio = np.zeros(3 * MUESTREO, dtype=np.float32)  # se rellena con ceros hasta 30 s
+    largo = np.full(60 * MUESTREO, 0.1, dtype=np.float32)
+
+    resultados = motor.transcribir_lote([voz, silencio, largo], "falso", [{"language": "es"}] * 3)
+
+    assert [r["text"] for r in resultados] == ["hola", "", "largo"]
+    assert resultados[1]["confianza"] == 0.0
+    assert motor.transcritos_uno_a_uno == [60]
@@ -0,0 +1,32 @@
+import asyncio
+
+from bot import CacheLRU
+
+
+def test_cache_en_disco_lleva_la_cuenta_de_bytes_y_vuelca_en_lotes(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+
+    async def escenario():
+        cache = CacheLRU("prueba", 1000, ruta_db=ruta, intervalo_ms=10)
+        cache.iniciar_escritor()
+        for i in range(30):
+            cache.guardar(f"clave{i}", b"x" * 50)
+        cache.guardar("clave0", b"y" * 20)  # reemplazo: no cuenta dos veces
+        await cache.detener_escritor()
+        return cache
+
+    cache = asyncio.run(escenario())
+    total = cache.db.execute("SELECT SUM(LENGTH(valor) + LENGTH(clave)) FROM cache_prueba").fetchone()[0]
+    assert cache.bytes_disco == total <= 1000
+    assert cache.escrituras == 1
+
+    async def releer():
+        otra = CacheLRU("prueba", 1000, ruta_db=ruta)
+        assert otra.bytes_disco == total
+        clave = otra.db.execute("SELECT clave FROM cache_prueba ORDER BY clave LIMIT 1").fetchone()[0]
+        return otra, clave, await otra.obtener(clave)
+
+    otra, clave, valor = asyncio.run(releer())
+    assert valor is not None
+    creado, usado = otra.db.execute("SELECT creado, usado FROM cache_prueba WHERE clave = ?", (clave,)).fetchone()
+    assert usado > creado
@@ -0,0 +1,43 @@
+import asyncio
+
+from bot import PlanificadorAudios
+
+
+def test_audios_de_un_chat_se_responden_en_orden_de_llegada():
+    respuestas = []
+
+    async def procesar(nombre, segundos):
+        await asyncio.sleep(segundos / 1000)
+        respuestas.append(nombre)
+
+    async def escenario():
+        planificador = PlanificadorAudios(concurrencia=4, por_chat=1)
+        # Con el chat ocupado llegan una nota larga y después una corta
+        await asyncio.gather(
+            planificador.ejecutar("-100", 10, lambda: procesar("primera", 10)),
+            planificador.ejecutar("-100", 60, lambda: procesar("larga", 60)),
+            planificador.ejecutar("-100", 2, lambda: procesar("corta", 2)),
+        )
+
+    asyncio.run(escenario())
+    assert respuestas == ["primera", "larga", "corta"]
+
+
+def test_la_duracion_sigue_repartiendo_entre_chats():
+    orden = []
+
+    async def procesar(chat_id):
+        orden.append(chat_id)
+        await asyncio.sleep(0)
+
+    async def escenario():
+        planificador = PlanificadorAudios(concurrencia=1, por_chat=1)
+        # El chat A manda una nota larga; B, que llega después, no espera a las siguientes de A
+        await asyncio.gather(
+            planificador.ejecutar("A", 60, lambda: procesar("A")),
+            planificador.ejecutar("A", 60, lambda: procesar("A")),
+            planificador.ejecutar("B", 5, lambda: procesar("B")),
+        )
+
+    asyncio.run(escenario())
+    assert orden == ["A", "B", "A"]
@@ -0,0 +1,139 @@
+"""
+Worker de inferencia para el modo con workers (MODO_WORKERS=1).
+
+Carga los modelos una vez, toma audios de la cola de trabajos que llena el
+bot y publica las respuestas directamente en Telegram. Se pueden arrancar
+tantos workers como núcleos o máquinas haya, siempre que compartan
+COLA_TRABAJOS_DB (y, si se quiere compartir la caché, CACHE_TRANSCRIPCION_DB).
+
+Uso:
+    python worker.py
+    python worker.py --reencolar-muertos
+"""
+import types
+import asyncio
+import logging
+import argparse
+
+from telegram import Bot, Update
+
+import bot
+from cola_trabajos import ColaTrabajos, nombre_worker
+from metricas import servir_metricas
+
+log = logging.getLogger("bot.worker")
+
+# Segundos entre consultas a la cola cuando está vacía
+ESPERA_COLA_VACIA_S = 0.5
+
+
+async def renovar_plazo(cola, id_trabajo, worker):
+    """
+    Latido: renueva el plazo del trabajo mientras se procesa, para que un audio
+    largo no pase a otro worker al vencer TRABAJO_VISIBILIDAD_S
+    """
+    while True:
+        await asyncio.sleep(cola.visibilidad_s / 3)
+        try:
+            if not await bot.en_cola(cola.renovar, id_trabajo, worker):
+                log.warning(f"⚠️ El trabajo {id_trabajo} ya no es de este worker")
+                return
+        except Exception as e:
+            log.warning(f"⚠️ No se pudo renovar el plazo del trabajo {id_trabajo}: {e}")
+
+
+async def procesar_trabajo(cola, worker, id_trabajo, datos, intento, bot_telegram):
+    """
+    Procesa un trabajo y lo confirma, lo reintenta o lo pasa a muertos
+    """
+    update = Update.de_json(datos["update"], bot_telegram)
+    archivo = update.message.voice or update.message.audio
+    contexto = types.SimpleNamespace(bot=bot_telegram)
+    log.debug("🛠️ Trabajo %s (intento %s) del chat %s", id_trabajo, intento, datos['chat_id'])
+
+    latido = asyncio.create_task(renovar_plazo(cola, id_trabajo, worker))
+    try:
+        await bot.procesar_audio(update, contexto, archivo, datos["participantes"], propagar_errores=True)
+    except Exception as e:
+        if await bot.en_cola(cola.fallar, id_trabajo, e):
+            log.warning(f"🔁 Trabajo {id_trabajo} falló ({e}), se reintentará")
+            return
+        log.warning(f"💀 Trabajo {id_trabajo} descartado tras {intento} intentos: {e}")
+        try:
+            await bot.gestor_envios.enviar(
+                update.effective_chat.id, update.message.reply_text, "❌ Error al procesar el audio"
+            )
+        except Exception as error:
+            log.error(f"❌ No se pudo avisar del error: {error}")
+        return
+    finally:
+        latido.cancel()
+    await bot.en_cola(cola.confirmar, id_trabajo)
+    log.debug("✅ Trabajo %s completado", id_trabajo)
+
+
+async def ejecutar_worker():
+    await bot.cargar_modelos()
+    if bot.estado_modelos["asr"] != "listo":
+        log.error("❌ El worker necesita el modelo ASR y no se pudo cargar")
+        return
+
+    cola = ColaTrabajos(bot.COLA_TRABAJOS_DB, bot.TRABAJO_REINTENTOS, bot.TRABAJO_VISIBILIDAD_S)
+    await bot.en_cola(cola.purgar_hechos)
+    await bot.decodificador.iniciar()
+    for cache in bot.caches:
+        cache.iniciar_escritor()
+    worker = nombre_worker()
+    en_curso = set()
+    if bot.METRICAS_PUERTO:
+        # Cada worker de la misma máquina necesita su propio METRICAS_PUERTO
+        try:
+            await servir_metricas(bot.METRICAS_HOST, bot.METRICAS_PUERTO)
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo abrir el puerto de métricas {bot.METRICAS_PUERTO}: {e}")
+    log.info(f"👷 Worker {worker} esperando trabajos ({bot.WORKER_CONCURRENCIA} a la vez)...")
+
+    async with Bot(bot.TOKEN) as bot_telegram:
+        try:
+            while True:
+                if len(en_curso) >= bot.WORKER_CONCURRENCIA:
+                    await asyncio.wait(en_curso, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                trabajo = await bot.en_cola(cola.tomar, worker)
+                if trabajo is None:
+                    await asyncio.sleep(ESPERA_COLA_VACIA_S)
+                    continue
+                tarea = asyncio.create_task(procesar_trabajo(cola, worker, *trabajo, bot_telegram))
+                en_curso.add(tarea)
+                tarea.add_done_callback(en_curso.discard)
+        finally:
+            # Los trabajos sin confirmar vuelven a la cola al vencer su plazo
+            for tarea in en_curso:
+                tarea.cancel()
+            for etapa in bot.etapas_pipeline.values():
+                await etapa.detener()
+            await bot.decodificador.detener()
+            for cache in bot.caches:
+                await cache.detener_escritor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reencolar-muertos", action="store_true",
+                        help="Vuelve a poner en cola los trabajos muertos y sale")
+    args = parser.parse_args()
+    bot.configurar_logs()
+
+    if args.reencolar_muertos:
+        cola = ColaTrabajos(bot.COLA_TRABAJOS_DB, bot.TRABAJO_REINTENTOS, bot.TRABAJO_VISIBILIDAD_S)
+        log.info(f"🔁 {cola.reencolar_muertos()} trabajos devueltos a la cola")
+        return
+
+    try:
+        asyncio.run(ejecutar_worker())
+    except KeyboardInterrupt:
+        log.info("👋 Worker detenido")
+
+
+if __name__ == "__main__":
+    main()